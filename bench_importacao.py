@@ -0,0 +1,103 @@
+# Benchmark do tempo de importação (python -X importtime) do bot e do parser
+#
+# Uso:
+#   python bench_importacao.py                    -> tempo de importação de formatador e botforma
+#   python bench_importacao.py --comparar HEAD~1  -> compara com os mesmos módulos numa versão anterior (git)
+#   python bench_importacao.py --detalhes 15      -> mostra os 15 módulos que mais pesam na importação do botforma
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+MODULOS = ("formatador", "botforma")
+
+
+# Função para importar um módulo num processo novo e devolver as linhas do -X importtime
+def importtime(modulo, pasta):
+    with tempfile.TemporaryDirectory() as dados:
+        # Versões antigas exigem o token e abrem os bancos na importação: tudo fica num diretório temporário
+        ambiente = dict(
+            os.environ,
+            PYTHONPATH=pasta,
+            API_TOKEN=os.getenv("API_TOKEN", "123456:BENCH"),
+            QUEUE_DB_FILE=os.path.join(dados, "fila.db"),
+            USER_REGISTRY_DB=os.path.join(dados, "usuarios.db"),
+        )
+        resultado = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+            cwd=dados, env=ambiente, capture_output=True, text=True,
+        )
+    if resultado.returncode != 0:
+        return None
+    linhas = []
+    for linha in resultado.stderr.splitlines():
+        if not linha.startswith("import time:") or "|" not in linha or "self [us]" in linha:
+            continue
+        proprio, acumulado, nome = linha[len("import time:"):].split("|")
+        linhas.append((int(proprio), int(acumulado), nome.rstrip()))
+    return linhas
+
+
+# Função para medir o tempo total (em ms) de importação de um módulo, mediana de várias execuções
+def measure(modulo, pasta, repeticoes):
+    totais = []
+    for _ in range(repeticoes):
+        linhas = importtime(modulo, pasta)
+        if linhas is None:
+            return None
+        # O módulo pedido é o último da lista e o seu tempo acumulado inclui tudo o que ele importou
+        totais.append(linhas[-1][1] / 1000)
+    return statistics.median(totais)
+
+
+# Função para extrair os arquivos .py de uma versão do repositório num diretório temporário
+def checkout(revisao, destino):
+    arquivo = os.path.join(destino, "versao.tar")
+    subprocess.run(["git", "archive", "--format=tar", "-o", arquivo, revisao], cwd=AQUI, check=True)
+    with tarfile.open(arquivo) as tar:
+        tar.extractall(destino, members=[m for m in tar.getmembers() if m.name.endswith(".py")])
+    return destino
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do tempo de importação do bot e do parser")
+    parser.add_argument("--repeticoes", type=int, default=5, help="execuções por módulo (vale a mediana)")
+    parser.add_argument("--comparar", metavar="REVISAO", help="revisão do git usada como referência")
+    parser.add_argument("--detalhes", type=int, default=0, metavar="N", help="mostrar os N módulos mais pesados")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporario:
+        referencia = checkout(args.comparar, temporario) if args.comparar else None
+
+        print(f"{'módulo':<12} {'atual':>10}" + (f" {args.comparar:>12} {'diferença':>10}" if referencia else ""))
+        for modulo in MODULOS:
+            atual = measure(modulo, AQUI, args.repeticoes)
+            linha = f"{modulo:<12} {_ms(atual):>10}"
+            if referencia:
+                antes = measure(modulo, referencia, args.repeticoes)
+                diferenca = f"{(atual - antes) / antes:+.0%}" if atual is not None and antes else "-"
+                linha += f" {_ms(antes):>12} {diferenca:>10}"
+            print(linha)
+
+    if args.detalhes:
+        # Só os módulos importados pelo botforma: os que vêm depois da última importação de nível zero anterior
+        # a ele (os do início do interpretador, como o site, ficam de fora)
+        linhas = importtime("botforma", AQUI) or []
+        inicio = max((i for i, linha in enumerate(linhas[:-1]) if not linha[2].startswith("  ")), default=-1)
+        linhas = linhas[inicio + 1:-1]
+        print("\nMódulos mais pesados na importação do botforma (tempo acumulado):")
+        for _, acumulado, nome in sorted(linhas, key=lambda linha: linha[1], reverse=True)[:args.detalhes]:
+            print(f"  {acumulado / 1000:8.1f} ms  {nome.strip()}")
+
+
+# Função para formatar um tempo em ms (ou "-" se o módulo não existe/não importa naquela versão)
+def _ms(valor):
+    return "-" if valor is None else f"{valor:.1f} ms"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# Benchmark e verificação de regressão do parser (process_message) com o corpus de mensagens do EV+ Scanner
+#
+# Uso:
+#   python bench_parser.py                 -> verifica o corpus e mede latência e mensagens/s do corpus inteiro
+#   python bench_parser.py --por-mensagem  -> mostra também a latência de cada mensagem do corpus
+#   python bench_parser.py --verificar     -> apenas compara a saída do parser com o resultado esperado
+#   python bench_parser.py --duplicadas 60 -> fluxo de alertas com 60% de reencaminhamentos, com e sem o cache
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import formatador
+from formatador import parse_bet, process_message
+
+# Corpus com as mensagens e o formatted_message/formatted_data esperados de cada uma
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus_parser.json")
+
+
+# Função para carregar o corpus de mensagens
+def load_corpus(path=CORPUS_FILE):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Função para comparar a saída do parser com o resultado esperado de cada mensagem
+def verify_corpus(corpus):
+    falhas = []
+    for caso in corpus:
+        try:
+            formatted_message, formatted_data = process_message(caso["mensagem"])
+        except Exception as e:
+            falhas.append((caso["nome"], f"exceção {type(e).__name__}: {e}"))
+            continue
+        if formatted_message != caso["formatted_message"]:
+            falhas.append((caso["nome"], f"formatted_message {formatted_message!r} != {caso['formatted_message']!r}"))
+        elif formatted_data != caso["formatted_data"]:
+            falhas.append((caso["nome"], f"formatted_data {formatted_data!r} != {caso['formatted_data']!r}"))
+    return falhas
+
+
+# Função para medir a latência de cada chamada do parser (em microssegundos)
+def measure(mensagens, repeticoes):
+    latencias = []
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        for mensagem in mensagens:
+            t0 = time.perf_counter_ns()
+            process_message(mensagem)
+            latencias.append((time.perf_counter_ns() - t0) / 1000)
+    total = time.perf_counter() - inicio
+    return latencias, total
+
+
+# Função para montar um fluxo de alertas como o dos grupos: cada alerta novo é uma mensagem do corpus com
+# um identificador próprio, e parte das mensagens reencaminha um dos alertas recentes
+def make_stream(mensagens, total, duplicadas, recentes=50, semente=42):
+    aleatorio = random.Random(semente)
+    fluxo = []
+    for i in range(total):
+        if fluxo and aleatorio.random() * 100 < duplicadas:
+            fluxo.append(aleatorio.choice(fluxo[-recentes:]))
+        else:
+            fluxo.append(f"{aleatorio.choice(mensagens)}\n#{i}")
+    return fluxo
+
+
+# Função para comparar o parser com e sem o cache de apostas interpretadas num fluxo com duplicatas
+def measure_cache(fluxo):
+    inicio = time.perf_counter()
+    for mensagem in fluxo:
+        try:
+            process_message(mensagem)
+        except (IndexError, ValueError):
+            pass
+    sem_cache = time.perf_counter() - inicio
+
+    formatador.clear_parse_cache()
+    antes = dict(formatador.parse_cache_stats)
+    inicio = time.perf_counter()
+    for mensagem in fluxo:
+        parse_bet(mensagem)
+    com_cache = time.perf_counter() - inicio
+    acertos = formatador.parse_cache_stats["hits"] - antes["hits"]
+    return sem_cache, com_cache, acertos
+
+
+# Função para calcular um percentil de uma lista de latências
+def percentile(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark e regressão do parser de apostas")
+    parser.add_argument("--corpus", default=CORPUS_FILE, help="arquivo JSON do corpus")
+    parser.add_argument("--repeticoes", type=int, default=200, help="quantas vezes o corpus é processado")
+    parser.add_argument("--por-mensagem", action="store_true", help="mostrar a latência de cada mensagem")
+    parser.add_argument("--verificar", action="store_true", help="apenas verificar a saída do parser")
+    parser.add_argument("--duplicadas", type=float, metavar="PCT",
+                        help="medir o cache num fluxo de alertas com PCT%% de reencaminhamentos")
+    parser.add_argument("--mensagens", type=int, default=20000, help="tamanho do fluxo de alertas (com --duplicadas)")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+
+    # Nenhuma medição vale se a saída do parser mudou
+    falhas = verify_corpus(corpus)
+    for nome, motivo in falhas:
+        print(f"FALHOU {nome}: {motivo}")
+    if falhas:
+        sys.exit(1)
+    print(f"Corpus OK: {len(corpus)} mensagens com a saída esperada")
+    if args.verificar:
+        return
+
+    mensagens = [caso["mensagem"] for caso in corpus]
+    process_message(mensagens[0])  # Aquecimento
+
+    if args.duplicadas is not None:
+        fluxo = make_stream(mensagens, args.mensagens, args.duplicadas)
+        sem_cache, com_cache, acertos = measure_cache(fluxo)
+        print(
+            f"Fluxo de {len(fluxo)} alertas ({args.duplicadas:g}% reencaminhados) | "
+            f"sem cache {len(fluxo) / sem_cache:,.0f} mensagens/s | "
+            f"com cache {len(fluxo) / com_cache:,.0f} mensagens/s | "
+            f"acertos {acertos / len(fluxo):.1%} | ganho {sem_cache / com_cache:.1f}x"
+        )
+        return
+
+    if args.por_mensagem:
+        for caso in corpus:
+            latencias, _ = measure([caso["mensagem"]], args.repeticoes)
+            print(f"{caso['nome']:<32} {statistics.median(latencias):8.1f} us (p99 {percentile(latencias, 99):.1f} us)")
+
+    latencias, total = measure(mensagens, args.repeticoes)
+    print(
+        f"Corpus inteiro: {len(latencias)} chamadas em {total:.2f}s | "
+        f"{len(latencias) / total:,.0f} mensagens/s | "
+        f"média {statistics.fmean(latencias):.1f} us | "
+        f"p50 {percentile(latencias, 50):.1f} us | p99 {percentile(latencias, 99):.1f} us"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,469 +1,2093 @@
+from __future__ import annotations
+
 import re
 import os
 import json  # Para armazenar os dados localmente num arquivo JSON
+import threading
+import time
+import datetime
+import asyncio
+import functools
+import random
+import sqlite3
+import hashlib
+import html
+import math
+import secrets
+import signal
+import socket
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
-from telegram import Update
-from telegram.ext import Application, MessageHandler, filters, CallbackContext, CommandHandler
-import gspread
-from google.oauth2.service_account import Credentials
-from google.auth.transport.requests import Request
-
-# Caminho do arquivo que armazenará os links das planilhas
-USER_SHEETS_FILE = "user_sheets.json"
+from loguru import logger
 
-# Carregar as variáveis de ambiente do arquivo .env
+# Carregar as variáveis de ambiente do arquivo .env antes dos módulos do projeto, que leem as configurações ao
+# serem importados
 load_dotenv()
 
-# Obter o token da API do Telegram a partir do arquivo .env
+import metricas  # noqa: E402
+from metricas import span  # noqa: E402
+from credenciais import GOOGLE_CREDENTIALS_FILE, CredentialManager  # noqa: E402
+from planilhas import GspreadBackend, SimulatedSheets  # noqa: E402
+import formatador  # noqa: E402
+from formatador import TRANSLATIONS, parse_bets, process_message, translate  # noqa: E402,F401 (reexportados)
+
+# telegram, gspread e google-auth só são importados quando usados (main() e primeiro acesso a uma planilha)
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import CallbackContext
+
+# Caminho do arquivo JSON antigo com os links das planilhas (migrado para o SQLite na primeira execução)
+USER_SHEETS_FILE = "user_sheets.json"
+
+# Permissões pedidas pela conta de serviço do Google (o arquivo vem de GOOGLE_CREDENTIALS_FILE)
+GOOGLE_SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+# Aba padrão onde as apostas são registradas
+SHEET_NAME = "APOSTAS"
+
+# Regras de roteamento das apostas de cada usuário (comando /rota), para nenhuma aba crescer demais:
+#   "unica"   -> tudo na aba APOSTAS (padrão)
+#   "esporte" -> uma aba por esporte ("APOSTAS - Futebol")
+#   "mes"     -> uma aba por mês da data do jogo ("APOSTAS 2024-05")
+#   "ano"     -> uma planilha por ano (registrada com /rota ano 2025 link); anos sem planilha registrada vão
+#                para a aba "APOSTAS 2025" da planilha principal
+# As abas que ainda não existem são criadas com o cabeçalho da aba APOSTAS.
+ROUTING_MODES = ("unica", "esporte", "mes", "ano")
+
+# Formato aplicado à coluna de data (C) e data-base dos números de série de datas do Google Sheets
+DATE_NUMBER_FORMAT = {"type": "DATE", "pattern": "dd/mm/yyyy"}
+SHEETS_EPOCH = datetime.date(1899, 12, 30)
+
+# Tempo de vida (em segundos) e tamanho máximo do cache de abas abertas (uma entrada por planilha e aba)
+SHEET_CACHE_TTL = float(os.getenv("SHEET_CACHE_TTL", "600"))
+SHEET_CACHE_MAX_SIZE = int(os.getenv("SHEET_CACHE_MAX_SIZE", "1024"))
+
+# Tempo de vida (em segundos) do índice da próxima linha livre antes de reler a coluna B
+NEXT_ROW_TTL = float(os.getenv("NEXT_ROW_TTL", "300"))
+
+# Threads dedicadas às chamadas (bloqueantes) da API do Google Sheets
+SHEETS_MAX_WORKERS = int(os.getenv("SHEETS_MAX_WORKERS", "8"))
+# Máximo de escritas em andamento/na fila do pool; acima disso os handlers aguardam uma vaga
+SHEETS_MAX_PENDING = int(os.getenv("SHEETS_MAX_PENDING", "64"))
+# Quantas atualizações do Telegram podem ser processadas ao mesmo tempo
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "32"))
+
+# Fila persistente das apostas que ainda não foram gravadas na planilha
+QUEUE_DB_FILE = os.getenv("QUEUE_DB_FILE", "fila_apostas.db")
+# Intervalo (em segundos) entre as verificações da fila e máximo de apostas por escrita
+QUEUE_FLUSH_INTERVAL = float(os.getenv("QUEUE_FLUSH_INTERVAL", "1"))
+QUEUE_BATCH_SIZE = int(os.getenv("QUEUE_BATCH_SIZE", "200"))
+# Tentativas antes de desistir de uma aposta e limites do backoff exponencial (em segundos)
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "8"))
+QUEUE_BACKOFF_BASE = float(os.getenv("QUEUE_BACKOFF_BASE", "2"))
+QUEUE_BACKOFF_MAX = float(os.getenv("QUEUE_BACKOFF_MAX", "300"))
+# Requisições por minuto enviadas ao Google no total e para cada planilha, e rajada máxima acumulada
+# (por processo: com vários bots, divida a cota entre eles)
+SHEETS_REQUESTS_PER_MINUTE = float(os.getenv("SHEETS_REQUESTS_PER_MINUTE", "55"))
+SHEETS_REQUESTS_PER_MINUTE_PER_SHEET = float(os.getenv("SHEETS_REQUESTS_PER_MINUTE_PER_SHEET", "20"))
+SHEETS_BURST = float(os.getenv("SHEETS_BURST", "5"))
+# Pausa de todas as requisições quando a cota estoura (erro 429), dobrando a cada 429 seguido até o máximo
+SHEETS_QUOTA_PAUSE = float(os.getenv("SHEETS_QUOTA_PAUSE", "30"))
+SHEETS_QUOTA_PAUSE_MAX = float(os.getenv("SHEETS_QUOTA_PAUSE_MAX", "240"))
+
+# Índice de apostas já recebidas de cada usuário, para descartar duplicatas antes de qualquer escrita
+DEDUP_DB_FILE = os.getenv("DEDUP_DB_FILE", QUEUE_DB_FILE)
+# Por quanto tempo (em segundos) uma aposta repetida é descartada (0 desativa) e limite de apostas lembradas por usuário
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", str(3 * 24 * 3600)))
+DEDUP_MAX_PER_USER = int(os.getenv("DEDUP_MAX_PER_USER", "5000"))
+
+# Arquivo SQLite com as estatísticas das apostas gravadas (/stats); por padrão o mesmo da fila
+STATS_DB_FILE = os.getenv("STATS_DB_FILE", QUEUE_DB_FILE)
+# Quantas linhas mostrar por esporte, mercado e casa de aposta no /stats
+STATS_TOP = int(os.getenv("STATS_TOP", "5"))
+
+# Modo de gravação: "fila" (cada mensagem segue para a planilha em instantes) ou "local" (as apostas ficam num livro
+# local, que é a fonte da verdade, e são compactadas na planilha periodicamente em escritas maiores)
+SHEETS_WRITE_MODE = os.getenv("SHEETS_WRITE_MODE", "fila")
+# Arquivo SQLite do livro local de apostas; por padrão o mesmo da fila
+LEDGER_DB_FILE = os.getenv("LEDGER_DB_FILE", QUEUE_DB_FILE)
+# Intervalo (em segundos) entre as compactações do livro nas planilhas e máximo de apostas por planilha em cada uma
+LEDGER_COMPACT_INTERVAL = float(os.getenv("LEDGER_COMPACT_INTERVAL", "30"))
+LEDGER_COMPACT_BATCH = int(os.getenv("LEDGER_COMPACT_BATCH", "2000"))
+# Intervalo (em segundos) entre as conciliações de cada planilha com o livro e máximo de planilhas conciliadas por vez
+LEDGER_RECONCILE_INTERVAL = float(os.getenv("LEDGER_RECONCILE_INTERVAL", "3600"))
+LEDGER_RECONCILE_BATCH = int(os.getenv("LEDGER_RECONCILE_BATCH", "10"))
+# Coluna (oculta) onde fica o ID de cada linha gravada a partir do livro
+LEDGER_ID_COLUMN = os.getenv("LEDGER_ID_COLUMN", "Z")
+
+# Onde ficam registradas as planilhas dos usuários: "sqlite" (padrão) ou "json" (arquivo único, formato antigo)
+USER_REGISTRY_BACKEND = os.getenv("USER_REGISTRY_BACKEND", "sqlite")
+USER_REGISTRY_DB = os.getenv("USER_REGISTRY_DB", "usuarios.db")
+
+# Onde fica o estado da conversa de cada usuário: "sqlite" (padrão, compartilhado entre processos) ou "memory"
+USER_STATE_BACKEND = os.getenv("USER_STATE_BACKEND", "sqlite")
+USER_STATE_DB = os.getenv("USER_STATE_DB", USER_REGISTRY_DB)
+# Arquivo SQLite com a regra de roteamento de cada usuário
+USER_ROUTES_DB = os.getenv("USER_ROUTES_DB", USER_REGISTRY_DB)
+
+# Identificação deste processo quando vários bots dividem a mesma fila (o padrão já é único por processo)
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}:{os.getpid()}")
+# Por quanto tempo (em segundos) um processo fica como único responsável pelas escritas de uma planilha
+QUEUE_LEASE_TTL = float(os.getenv("QUEUE_LEASE_TTL", "120"))
+
+# Onde as apostas são gravadas: "gspread" (Google Sheets, padrão) ou "simulador" (planilhas em memória, para
+# testes de carga sem rede); no simulador: latência média (em segundos) de cada requisição, cota de requisições
+# por minuto do Google simulado (0 = sem limite) e fração de requisições que recebem 429 por sorteio
+SHEETS_BACKEND = os.getenv("SHEETS_BACKEND", "gspread")
+SHEETS_SIM_LATENCY = float(os.getenv("SHEETS_SIM_LATENCY", "0.05"))
+SHEETS_SIM_QUOTA_PER_MINUTE = float(os.getenv("SHEETS_SIM_QUOTA_PER_MINUTE", "300"))
+SHEETS_SIM_ERROR_RATE = float(os.getenv("SHEETS_SIM_ERROR_RATE", "0"))
+
+# Como o bot recebe as atualizações do Telegram: "polling" (padrão), "webhook" (registra WEBHOOK_URL no Telegram)
+# ou "worker" (atrás do roteador.py: só recebe as atualizações repassadas, sem nunca chamar o setWebhook)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Modos webhook e worker: endereço local do servidor HTTP (atrás de um proxy reverso ou do roteador) e caminho
+# do endpoint
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+# URL pública (do proxy) registrada no Telegram no modo webhook (obrigatória nele)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Segredo enviado pelo Telegram no cabeçalho X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Endereço alternativo da Bot API (ex.: um Telegram falso local nos testes de carga)
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "")
+# Envio de respostas: intervalo mínimo (em segundos) entre mensagens no mesmo chat, mensagens por segundo
+# no total e quantas vezes reenviar uma mensagem recusada pelo Telegram (RetryAfter ou falha de rede)
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", "1"))
+TELEGRAM_MESSAGES_PER_SECOND = float(os.getenv("TELEGRAM_MESSAGES_PER_SECOND", "25"))
+TELEGRAM_SEND_RETRIES = int(os.getenv("TELEGRAM_SEND_RETRIES", "5"))
+
+# Obter o token da API do Telegram a partir do arquivo .env (verificado em main(), ao iniciar o bot)
 API_TOKEN = os.getenv("API_TOKEN")
 
-# Verificar se o token foi carregado corretamente
-if not API_TOKEN:
-    raise ValueError("O token da API ('API_TOKEN') não foi encontrado no arquivo .env.")
 
+# Objeto criado apenas no primeiro uso (ex.: abrir um banco SQLite), para importar o módulo não abrir nem criar arquivos
+class _LazyInstance:
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __contains__(self, item):
+        return item in self._get()
+
+
+# Função para extrair o ID da planilha a partir do link
+def extract_spreadsheet_id(sheet_link):
+    return sheet_link.split("/d/")[1].split("/")[0]
+
+
+# Registro das planilhas dos usuários em SQLite: consulta e gravação por chave, sem reescrever tudo
+class SQLiteUserRegistry:
+    def __init__(self, path, legacy_json=None):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS usuarios ("
+            " user_id TEXT PRIMARY KEY,"
+            " sheet_link TEXT NOT NULL,"
+            " spreadsheet_id TEXT NOT NULL,"
+            " registrado_em REAL NOT NULL)"
+        )
+        if legacy_json and os.path.exists(legacy_json):
+            self._migrate_json(legacy_json)
+
+    # Importar o arquivo JSON antigo numa única transação e renomeá-lo para não importar de novo
+    def _migrate_json(self, path):
+        with open(path, "r") as f:
+            antigos = json.load(f)
+        agora = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO usuarios (user_id, sheet_link, spreadsheet_id, registrado_em) VALUES (?, ?, ?, ?)",
+                [(user_id, link, extract_spreadsheet_id(link), agora) for user_id, link in antigos.items()],
+            )
+            self._conn.execute("COMMIT")
+        os.replace(path, path + ".migrado")
+
+    def __contains__(self, user_id):
+        return self.get_spreadsheet_id(user_id) is not None
+
+    # Obter o ID da planilha do usuário (None se ele não registrou nenhuma)
+    def get_spreadsheet_id(self, user_id):
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT spreadsheet_id FROM usuarios WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return linha[0] if linha else None
+
+    # Registrar (ou atualizar) a planilha de um usuário
+    def register(self, user_id, sheet_link):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO usuarios (user_id, sheet_link, spreadsheet_id, registrado_em) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(user_id) DO UPDATE SET sheet_link = excluded.sheet_link,"
+                " spreadsheet_id = excluded.spreadsheet_id",
+                (user_id, sheet_link, extract_spreadsheet_id(sheet_link), time.time()),
+            )
+
+
+# Registro das planilhas dos usuários no arquivo JSON antigo, agora gravado de forma atômica
+class JsonUserRegistry:
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r") as f:
+                self._links = json.load(f)
+        except FileNotFoundError:
+            self._links = {}
+
+    def __contains__(self, user_id):
+        return user_id in self._links
+
+    # Obter o ID da planilha do usuário (None se ele não registrou nenhuma)
+    def get_spreadsheet_id(self, user_id):
+        link = self._links.get(user_id)
+        return extract_spreadsheet_id(link) if link else None
+
+    # Registrar a planilha e regravar o arquivo num temporário, trocando-o de uma vez só
+    def register(self, user_id, sheet_link):
+        with self._lock:
+            self._links[user_id] = sheet_link
+            temporario = self._path + ".tmp"
+            with open(temporario, "w") as f:
+                json.dump(self._links, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporario, self._path)
+
+
+# Função para abrir o registro de planilhas configurado
+def open_user_registry():
+    if USER_REGISTRY_BACKEND == "json":
+        return JsonUserRegistry(USER_SHEETS_FILE)
+    if USER_REGISTRY_BACKEND == "sqlite":
+        return SQLiteUserRegistry(USER_REGISTRY_DB, legacy_json=USER_SHEETS_FILE)
+    raise ValueError(f"USER_REGISTRY_BACKEND inválido: {USER_REGISTRY_BACKEND!r} (use 'sqlite' ou 'json').")
+
+
+# Inicializar o registro das planilhas
+user_registry = _LazyInstance(open_user_registry)
+
+
+# Estado da conversa de cada usuário guardado na memória do processo (perdido a cada reinício)
+class MemoryStateStore:
+    def __init__(self):
+        self._states = {}
+
+    # Obter o estado do usuário (None se ele não está em nenhum modo)
+    def get(self, user_id):
+        return self._states.get(user_id)
+
+    def set(self, user_id, state):
+        self._states[user_id] = state
+
+    def clear(self, user_id):
+        self._states.pop(user_id, None)
+
+
+# Estado da conversa de cada usuário em SQLite: sobrevive a reinícios e é visto por todos os processos do bot
+class SQLiteStateStore:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS estados ("
+            " user_id TEXT PRIMARY KEY,"
+            " estado TEXT NOT NULL,"
+            " atualizado_em REAL NOT NULL)"
+        )
+
+    # Obter o estado do usuário (None se ele não está em nenhum modo)
+    def get(self, user_id):
+        with self._lock:
+            linha = self._conn.execute("SELECT estado FROM estados WHERE user_id = ?", (user_id,)).fetchone()
+        return linha[0] if linha else None
+
+    def set(self, user_id, state):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO estados (user_id, estado, atualizado_em) VALUES (?, ?, ?)"
+                " ON CONFLICT(user_id) DO UPDATE SET estado = excluded.estado, atualizado_em = excluded.atualizado_em",
+                (user_id, state, time.time()),
+            )
+
+    def clear(self, user_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM estados WHERE user_id = ?", (user_id,))
+
+
+# Função para abrir o armazenamento de estados configurado
+def open_state_store():
+    if USER_STATE_BACKEND == "memory":
+        return MemoryStateStore()
+    if USER_STATE_BACKEND == "sqlite":
+        return SQLiteStateStore(USER_STATE_DB)
+    raise ValueError(f"USER_STATE_BACKEND inválido: {USER_STATE_BACKEND!r} (use 'sqlite' ou 'memory').")
+
+
+# Inicializar o armazenamento do estado de cada usuário (ex.: se está em modo de registrar apostas)
+user_state = _LazyInstance(open_state_store)
+
+
+# Regra de roteamento de cada usuário em SQLite: modo e planilhas registradas para cada ano
+class SQLiteRouteStore:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rotas ("
+            " user_id TEXT PRIMARY KEY,"
+            " modo TEXT NOT NULL,"
+            " planilhas_por_ano TEXT NOT NULL,"
+            " atualizado_em REAL NOT NULL)"
+        )
 
-# Função para carregar os dados das planilhas dos usuários
-def load_user_sheets():
+    # Obter (modo, {ano: spreadsheet_id}) do usuário; quem nunca configurou usa a aba única
+    def get(self, user_id):
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT modo, planilhas_por_ano FROM rotas WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return (linha[0], json.loads(linha[1])) if linha else ("unica", {})
+
+    def set_mode(self, user_id, modo):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO rotas (user_id, modo, planilhas_por_ano, atualizado_em) VALUES (?, ?, '{}', ?)"
+                " ON CONFLICT(user_id) DO UPDATE SET modo = excluded.modo, atualizado_em = excluded.atualizado_em",
+                (user_id, modo, time.time()),
+            )
+
+    # Registrar a planilha de um ano (o modo passa a ser "ano")
+    def set_year_spreadsheet(self, user_id, ano, spreadsheet_id):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            linha = self._conn.execute(
+                "SELECT planilhas_por_ano FROM rotas WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            planilhas = json.loads(linha[0]) if linha else {}
+            planilhas[str(ano)] = spreadsheet_id
+            self._conn.execute(
+                "INSERT INTO rotas (user_id, modo, planilhas_por_ano, atualizado_em) VALUES (?, 'ano', ?, ?)"
+                " ON CONFLICT(user_id) DO UPDATE SET modo = excluded.modo,"
+                " planilhas_por_ano = excluded.planilhas_por_ano, atualizado_em = excluded.atualizado_em",
+                (user_id, json.dumps(planilhas, sort_keys=True), time.time()),
+            )
+            self._conn.execute("COMMIT")
+
+
+# Inicializar o armazenamento das regras de roteamento
+user_routes = _LazyInstance(lambda: SQLiteRouteStore(USER_ROUTES_DB))
+
+
+# Função para escolher o destino (planilha, aba) de uma aposta conforme a regra do usuário
+def route_bet(rota, spreadsheet_id, data):
+    modo, planilhas_por_ano = rota
+    if modo == "esporte":
+        return spreadsheet_id, f"{SHEET_NAME} - {data['sport']}"
+    if modo == "mes":
+        return spreadsheet_id, f"{SHEET_NAME} {data['date'][:7]}"
+    if modo == "ano":
+        ano = data['date'][:4]
+        if ano in planilhas_por_ano:
+            return planilhas_por_ano[ano], SHEET_NAME
+        return spreadsheet_id, f"{SHEET_NAME} {ano}"
+    return spreadsheet_id, SHEET_NAME
+
+
+# Balde de fichas: cada requisição consome uma ficha e as fichas voltam no ritmo configurado
+class _TokenBucket:
+    def __init__(self, per_minute, burst):
+        self._rate = per_minute / 60
+        self._capacity = max(1.0, burst)
+        self.tokens = self._capacity
+        self._updated = time.monotonic()
+
+    def refill(self, agora):
+        self.tokens = min(self._capacity, self.tokens + (agora - self._updated) * self._rate)
+        self._updated = agora
+
+    # Segundos até existir uma ficha inteira
+    def time_to_token(self):
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self._rate
+
+    @property
+    def full(self):
+        return self.tokens >= self._capacity
+
+
+# Agendador central das requisições ao Google Sheets: orçamento global e por planilha, vez alternada entre
+# as planilhas que estão esperando (uma planilha movimentada não atrasa as outras) e pausa automática no 429
+class SheetsQuotaScheduler:
+    def __init__(self, per_minute, per_sheet_per_minute, burst, quota_pause, quota_pause_max):
+        self._per_sheet_per_minute = per_sheet_per_minute
+        self._burst = burst
+        self._quota_pause = quota_pause
+        self._quota_pause_max = quota_pause_max
+        self._cond = threading.Condition()
+        self._global = _TokenBucket(per_minute, burst)
+        self._sheets = {}  # spreadsheet_id -> _TokenBucket
+        self._waiting = []  # [ordem de chegada, spreadsheet_id] de quem aguarda uma ficha
+        self._last_served = {}  # spreadsheet_id -> vez em que foi atendida pela última vez
+        self._turn = 0
+        self._arrivals = 0
+        self._paused_until = 0.0
+        self._pause = 0.0  # Pausa atual; dobra a cada 429 seguido e zera no primeiro sucesso
+
+    def _sheet_bucket(self, spreadsheet_id):
+        bucket = self._sheets.get(spreadsheet_id)
+        if bucket is None:
+            if len(self._sheets) > 4096:
+                # Esquecer os baldes cheios (planilhas paradas), que voltariam a ser criados iguais
+                esperando = {sid for _, sid in self._waiting}
+                self._sheets = {sid: b for sid, b in self._sheets.items() if sid in esperando or not b.full}
+                self._last_served = {sid: t for sid, t in self._last_served.items() if sid in self._sheets}
+            bucket = self._sheets[spreadsheet_id] = _TokenBucket(self._per_sheet_per_minute, self._burst)
+        return bucket
+
+    # Quem é atendido agora: entre os que têm ficha na planilha, a planilha atendida há mais tempo
+    def _next_waiter(self, agora):
+        escolhido = None
+        for waiter in self._waiting:
+            spreadsheet_id = waiter[1]
+            if spreadsheet_id is not None:
+                bucket = self._sheet_bucket(spreadsheet_id)
+                bucket.refill(agora)
+                if bucket.tokens < 1:
+                    continue
+            chave = (self._last_served.get(spreadsheet_id, -1), waiter[0])
+            if escolhido is None or chave < escolhido[0]:
+                escolhido = (chave, waiter)
+        return escolhido[1] if escolhido else None
+
+    # Bloquear até a requisição poder ser enviada (chamado nas threads do pool, antes de cada requisição)
+    def acquire(self, spreadsheet_id=None):
+        with self._cond:
+            self._arrivals += 1
+            waiter = [self._arrivals, spreadsheet_id]
+            self._waiting.append(waiter)
+            try:
+                while True:
+                    agora = time.monotonic()
+                    self._global.refill(agora)
+                    espera = self._paused_until - agora
+                    if espera <= 0:
+                        espera = self._global.time_to_token()
+                    if espera <= 0:
+                        if self._next_waiter(agora) is waiter:
+                            self._global.tokens -= 1
+                            if spreadsheet_id is not None:
+                                self._sheets[spreadsheet_id].tokens -= 1
+                                self._turn += 1
+                                self._last_served[spreadsheet_id] = self._turn
+                            return
+                        espera = min((self._sheets[w[1]].time_to_token() for w in self._waiting
+                                      if w[1] is not None), default=0.05) or 0.05
+                    self._cond.wait(espera)
+            finally:
+                self._waiting.remove(waiter)
+                self._cond.notify_all()
+
+    # Registrar um 429: suspender todas as requisições, com pausa crescente se eles continuarem
+    def quota_exceeded(self):
+        with self._cond:
+            self._pause = min(max(self._pause * 2, self._quota_pause), self._quota_pause_max)
+            self._paused_until = max(self._paused_until, time.monotonic() + self._pause * random.uniform(1, 1.2))
+            self._global.tokens = 0
+        logger.warning("Cota do Google Sheets excedida; pausando as requisições por {:.0f}s", self._pause)
+
+    def succeeded(self):
+        if self._pause:
+            with self._cond:
+                self._pause = 0.0
+
+    # Verificar se o orçamento global permite uma requisição agora (fora de pausa e com ficha)
+    def has_budget(self):
+        with self._cond:
+            agora = time.monotonic()
+            self._global.refill(agora)
+            return agora >= self._paused_until and self._global.tokens >= 1
+
+    # Planilhas sem orçamento agora: o flusher deixa as apostas delas acumularem na fila,
+    # para serem enviadas juntas numa única escrita quando o orçamento voltar
+    def throttled_sheets(self):
+        with self._cond:
+            agora = time.monotonic()
+            sem_ficha = set()
+            for spreadsheet_id, bucket in self._sheets.items():
+                bucket.refill(agora)
+                if bucket.tokens < 1:
+                    sem_ficha.add(spreadsheet_id)
+            return sem_ficha
+
+
+# Agendador compartilhado por todas as requisições do processo
+sheets_scheduler = SheetsQuotaScheduler(
+    SHEETS_REQUESTS_PER_MINUTE, SHEETS_REQUESTS_PER_MINUTE_PER_SHEET, SHEETS_BURST,
+    SHEETS_QUOTA_PAUSE, SHEETS_QUOTA_PAUSE_MAX,
+)
+
+# ID da planilha no endereço de uma requisição da API do Google Sheets
+_SPREADSHEET_URL_RE = re.compile(r"/spreadsheets/([a-zA-Z0-9_-]+)")
+
+
+# Função para dar nome ao tipo de chamada de uma requisição (ex.: "metadata", "values.get", "batchUpdate")
+def _sheets_call_type(method, endpoint, encontrado):
+    if encontrado is None:
+        return "outra"
+    resto = endpoint.split("?")[0][encontrado.end():]
+    if resto.startswith("/values"):
+        resto = resto[len("/values"):]
+        if resto.startswith(":"):
+            return "values:" + resto[1:]
+        return {"GET": "values.get", "PUT": "values.update", "POST": "values.append"}.get(method.upper(), "values")
+    if resto.startswith(":"):
+        return resto[1:]
+    return "metadata" if method.upper() == "GET" else method.lower()
+
+
+# Função para passar uma requisição à planilha pelo agendador de cota, medindo a latência e o resultado
+# (erros da API trazem o código HTTP em .code; os demais contam como falha de rede)
+def scheduled_request(spreadsheet_id, chamada, call):
+    inicio = time.perf_counter()
+    sheets_scheduler.acquire(spreadsheet_id)
+    enviado = time.perf_counter()
+    metricas.sheets_quota_wait_seconds.observe(enviado - inicio, chamada=chamada)
     try:
-        with open(USER_SHEETS_FILE, "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+        resultado = call()
+    except Exception as e:
+        codigo = getattr(e, "code", None)
+        if not isinstance(codigo, int):
+            metricas.sheets_requests.inc(chamada=chamada, status="rede")
+            raise
+        metricas.sheets_request_seconds.observe(time.perf_counter() - enviado, chamada=chamada)
+        metricas.sheets_requests.inc(chamada=chamada, status=codigo)
+        if codigo == 429:
+            sheets_scheduler.quota_exceeded()
+        raise
+    metricas.sheets_request_seconds.observe(time.perf_counter() - enviado, chamada=chamada)
+    metricas.sheets_requests.inc(chamada=chamada, status=getattr(resultado, "status_code", 200))
+    sheets_scheduler.succeeded()
+    return resultado
+
+
+# Classe do cliente HTTP do gspread que passa cada requisição pelo agendador de cota e mede a latência de cada uma
+# (criada no primeiro uso, junto com a importação do gspread)
+@functools.lru_cache(maxsize=None)
+def _scheduled_http_client_class():
+    import gspread
+
+    class ScheduledHTTPClient(gspread.http_client.HTTPClient):
+        def request(self, method, endpoint, *args, **kwargs):
+            encontrado = _SPREADSHEET_URL_RE.search(endpoint)
+            return scheduled_request(
+                encontrado.group(1) if encontrado else None,
+                _sheets_call_type(method, endpoint, encontrado),
+                functools.partial(super().request, method, endpoint, *args, **kwargs),
+            )
+
+    return ScheduledHTTPClient
+
+
+# Credenciais da conta de serviço, com o token renovado em segundo plano
+credential_manager = CredentialManager(GOOGLE_CREDENTIALS_FILE, GOOGLE_SCOPES)
+
+# Cliente gspread autorizado uma única vez e compartilhado por todo o processo
+_gspread_client = None
+_gspread_client_lock = threading.Lock()
+
+# Cache LRU das abas abertas: (spreadsheet_id, título da aba) -> (aba, instante em que foi aberta)
+_sheet_cache = OrderedDict()
+_sheet_cache_lock = threading.Lock()
+
+# Contadores do cache de abas
+sheet_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+
+# Função para obter o cliente gspread compartilhado (autoriza apenas no primeiro uso)
+def get_gspread_client():
+    global _gspread_client
+    with _gspread_client_lock:
+        if _gspread_client is None:
+            # O token é renovado em segundo plano pelo gerenciador, antes de expirar
+            with span("credenciais"):
+                import gspread
+
+                credential_manager.start()
+                _gspread_client = gspread.authorize(
+                    credential_manager.credentials(), http_client=_scheduled_http_client_class())
+        return _gspread_client
+
+
+# Função para criar o backend das planilhas escolhido em SHEETS_BACKEND
+def open_sheet_backend():
+    if SHEETS_BACKEND == "gspread":
+        return GspreadBackend(get_gspread_client)
+    if SHEETS_BACKEND == "simulador":
+        logger.warning("Gravando as apostas no simulador de planilhas em memória (SHEETS_BACKEND=simulador)")
+        return SimulatedSheets(
+            latency=SHEETS_SIM_LATENCY,
+            quota_per_minute=SHEETS_SIM_QUOTA_PER_MINUTE,
+            error_rate=SHEETS_SIM_ERROR_RATE,
+            request_hook=scheduled_request,
+        )
+    raise ValueError(f"SHEETS_BACKEND inválido: {SHEETS_BACKEND!r} (use 'gspread' ou 'simulador').")
+
+
+# Backend das planilhas (criado no primeiro acesso)
+sheet_backend = _LazyInstance(open_sheet_backend)
+
+
+# Função para abrir várias abas de uma planilha, reaproveitando o cache sempre que possível. As que faltam são
+# abertas juntas (e as abas de roteamento que ainda não existem, criadas com o cabeçalho da aba padrão).
+def get_worksheets(spreadsheet_id, titles):
+    agora = time.monotonic()
+    sheets = {}
+    with _sheet_cache_lock:
+        for title in titles:
+            chave = (spreadsheet_id, title)
+            entrada = _sheet_cache.get(chave)
+            if entrada is not None and agora - entrada[1] < SHEET_CACHE_TTL:
+                _sheet_cache.move_to_end(chave)
+                sheet_cache_stats["hits"] += 1
+                sheets[title] = entrada[0]
+            else:
+                # Entrada ausente ou expirada
+                _sheet_cache.pop(chave, None)
+                sheet_cache_stats["misses"] += 1
 
+    faltando = [title for title in titles if title not in sheets]
+    if not faltando:
+        return sheets
 
-# Função para salvar os dados das planilhas dos usuários
-def save_user_sheets(user_sheets):
-    with open(USER_SHEETS_FILE, "w") as f:
-        json.dump(user_sheets, f)
+    # Abrir a planilha fora do lock para não bloquear as outras threads
+    with span("abrir_planilha", planilha=spreadsheet_id, abas=len(faltando)):
+        abertas = sheet_backend.open_worksheets(spreadsheet_id, faltando, create_from=SHEET_NAME)
 
+    with _sheet_cache_lock:
+        for title, sheet in abertas.items():
+            _sheet_cache[(spreadsheet_id, title)] = (sheet, agora)
+            _sheet_cache.move_to_end((spreadsheet_id, title))
+        while len(_sheet_cache) > SHEET_CACHE_MAX_SIZE:
+            _sheet_cache.popitem(last=False)
+            sheet_cache_stats["evictions"] += 1
 
-# Inicializar os dados das planilhas
-user_sheets = load_user_sheets()
+    sheets.update(abertas)
+    return sheets
 
 
-# Função para acessar a planilha correta do usuário
-def get_google_sheet(user_id):
+# Função para abrir uma aba de uma planilha (padrão: APOSTAS), reaproveitando o cache sempre que possível
+def get_worksheet(spreadsheet_id, title=SHEET_NAME):
+    return get_worksheets(spreadsheet_id, [title])[title]
+
+
+# Função para remover do cache uma aba ou, sem título, todas as abas de uma planilha (ex.: o bot perdeu o acesso)
+def invalidate_sheet(spreadsheet_id, title=None):
+    with _sheet_cache_lock:
+        chaves = [(spreadsheet_id, title)] if title is not None else [
+            chave for chave in _sheet_cache if chave[0] == spreadsheet_id]
+        for chave in chaves:
+            if _sheet_cache.pop(chave, None) is not None:
+                sheet_cache_stats["invalidations"] += 1
+
+
+# Função para verificar se um erro indica falta de permissão ou planilha/aba inexistente
+def is_access_error(error):
+    return sheet_backend.is_access_error(error)
+
+
+# Função para verificar se um erro pode ter vindo dos dados de uma aposta (requisição recusada pelo Google ou
+# falha ao montar as células), e não da planilha, da cota ou da rede
+def is_bet_error(error):
+    return isinstance(error, (KeyError, TypeError, ValueError)) or sheet_backend.is_invalid_request_error(error)
+
+
+# Índice da próxima linha livre: (spreadsheet_id, título da aba) -> [linha, instante da última leitura da coluna B]
+_next_free_row = {}
+_next_free_row_lock = threading.Lock()
+
+# Locks por planilha: as escritas na mesma planilha são feitas uma de cada vez
+_sheet_write_locks = {}
+
+
+# Função para obter o lock de escrita de uma planilha
+def _get_write_lock(spreadsheet_id):
+    with _next_free_row_lock:
+        return _sheet_write_locks.setdefault(spreadsheet_id, threading.Lock())
+
+
+# Função para escrever o título de uma aba numa referência A1 (ex.: 'APOSTAS - Futebol'!B:B)
+def _quoted_title(title):
+    return "'" + title.replace("'", "''") + "'"
+
+
+# Função para ler a coluna B de várias abas numa única requisição, cada uma a partir da linha informada;
+# devolve título -> quantas linhas há do início até a última preenchida (0 se estiver tudo vazio)
+def _read_column_b(sheets, inicios):
+    resposta = sheets[0].spreadsheet.values_batch_get(
+        [f"{_quoted_title(sheet.title)}!B{inicios[sheet.title]}:B" for sheet in sheets],
+        params={"majorDimension": "COLUMNS"},
+    )
+    preenchidas = {}
+    for sheet, intervalo in zip(sheets, resposta.get("valueRanges", [])):
+        column_b = (intervalo.get("values") or [[]])[0]
+        ultima = len(column_b)
+        while ultima and not column_b[ultima - 1]:
+            ultima -= 1
+        preenchidas[sheet.title] = ultima
+    return preenchidas
+
+
+# Função para obter a próxima linha livre de cada aba (título -> linha): a linha logo após a última preenchida da
+# coluna B, para um bloco de várias linhas nunca cair num buraco no meio da aba e sobrescrever as linhas de baixo.
+# Numa única requisição, as abas sem índice (ou com o índice expirado) têm a coluna B inteira lida e as demais só
+# a partir da linha do índice, para conferir que ela continua livre. Linhas digitadas à mão ou gravadas por outro
+# processo depois da última leitura são um conflito: o índice é descartado e a coluna B dessas abas, relida.
+def _get_next_free_rows(spreadsheet_id, sheets):
+    agora = time.monotonic()
+    inicios = {}
+    with _next_free_row_lock:
+        for sheet in sheets:
+            entrada = _next_free_row.get((spreadsheet_id, sheet.title))
+            valida = entrada is not None and agora - entrada[1] < NEXT_ROW_TTL
+            inicios[sheet.title] = entrada[0] if valida else 1
+
+    lido_em = time.monotonic()
+    with span("ler_proxima_linha", planilha=spreadsheet_id, abas=len(sheets)):
+        preenchidas = _read_column_b(sheets, inicios)
+
+    rows = {}
+    lidas = []
+    conflitos = []
+    for sheet in sheets:
+        inicio, ultima = inicios[sheet.title], preenchidas[sheet.title]
+        if inicio == 1:
+            rows[sheet.title] = max(2, ultima + 1)  # Os dados começam na linha 2
+            lidas.append(sheet.title)
+        elif ultima:
+            conflitos.append(sheet)
+        else:
+            rows[sheet.title] = inicio
+
+    if conflitos:
+        logger.warning("Linhas novas na planilha {} fora do bot (abas {}): relendo a coluna B",
+                       spreadsheet_id, ", ".join(sheet.title for sheet in conflitos))
+        with _next_free_row_lock:
+            for sheet in conflitos:
+                _next_free_row.pop((spreadsheet_id, sheet.title), None)
+        lido_em = time.monotonic()
+        with span("ler_proxima_linha", planilha=spreadsheet_id, abas=len(conflitos), conflito=True):
+            preenchidas = _read_column_b(conflitos, {sheet.title: 1 for sheet in conflitos})
+        for sheet in conflitos:
+            rows[sheet.title] = max(2, preenchidas[sheet.title] + 1)
+            lidas.append(sheet.title)
+
+    # Só a leitura da coluna inteira renova o índice; a conferência não muda o instante da última leitura
+    with _next_free_row_lock:
+        for title in lidas:
+            _next_free_row[(spreadsheet_id, title)] = [rows[title], lido_em]
+    return rows
+
+
+# Função para avançar o índice de uma aba localmente depois de uma escrita bem-sucedida
+def _advance_next_free_row(spreadsheet_id, title, row):
+    with _next_free_row_lock:
+        entrada = _next_free_row.get((spreadsheet_id, title))
+        if entrada is not None:
+            entrada[0] = row
+
+
+# Função para descartar o índice de todas as abas de uma planilha (a coluna B será relida na próxima escrita)
+def invalidate_next_free_row(spreadsheet_id):
+    with _next_free_row_lock:
+        for chave in [chave for chave in _next_free_row if chave[0] == spreadsheet_id]:
+            del _next_free_row[chave]
+
+
+# Função para obter o ID da planilha registrada pelo usuário
+def get_user_spreadsheet_id(user_id):
     # Verificar se o usuário registrou uma planilha
-    if user_id not in user_sheets:
+    spreadsheet_id = user_registry.get_spreadsheet_id(user_id)
+    if spreadsheet_id is None:
         raise ValueError(
             "Nenhuma planilha registrada para este usuário. Use o comando /registrar para registrar sua planilha.")
 
-    # Obter o link da planilha do usuário
-    sheet_link = user_sheets[user_id]
+    return spreadsheet_id
 
-    # Extrair o ID da planilha a partir do link
-    spreadsheet_id = sheet_link.split("/d/")[1].split("/")[0]
 
-    credenciais_path = r'C:\Users\brand\botformatador\credenciais.json'  # Atualize para o caminho correto
+# Função para acessar a planilha correta do usuário
+def get_google_sheet(user_id):
+    return get_worksheet(get_user_spreadsheet_id(user_id))
 
-    # Credenciais para acessar a Google Sheets API
-    creds = Credentials.from_service_account_file(credenciais_path, scopes=["https://www.googleapis.com/auth/spreadsheets"])
 
-    # Verifica se as credenciais estão válidas, caso contrário, tenta atualizar
-    if creds and creds.expired and creds.refresh_token:
-        creds.refresh(Request())
+# Função para inserir dados na planilha
+def insert_data_to_sheet(data):
+    insert_bets_to_sheet(data['user_id'], [data])
 
-    # Autoriza o cliente gspread com as credenciais
-    client = gspread.authorize(creds)
 
-    # Abrir a planilha pelo ID e selecionar a aba "APOSTAS"
-    sheet_name = "APOSTAS"  # Mantém a aba padrão "APOSTAS"
-    sheet = client.open_by_key(spreadsheet_id).worksheet(sheet_name)
+# Função para inserir várias apostas de uma vez na planilha do usuário
+def insert_bets_to_sheet(user_id, bets):
+    append_bets_to_sheet(get_user_spreadsheet_id(user_id), bets)
+    record_bet_stats(user_id, bets)
 
-    return sheet
 
+# Função para somar apostas gravadas às estatísticas do usuário; uma falha aqui não desfaz a gravação
+def record_bet_stats(user_id, bets):
+    try:
+        bet_stats.record(user_id, bets)
+    except Exception as e:
+        logger.error("Erro ao atualizar as estatísticas do usuário {}: {}", user_id, e)
 
 
-# Função para inserir dados na planilha
-def insert_data_to_sheet(data):
-    # Obter a planilha
-    sheet = get_google_sheet(data['user_id'])
-
-    # Obter todos os valores da planilha
-    all_values = sheet.get_all_values()
-
-    # Encontrar a primeira linha vazia na coluna B (a partir da linha 2)
-    row_to_insert = 2  # Começar a busca a partir da linha 2
-    while row_to_insert <= len(all_values) and all_values[row_to_insert - 1][1]:  # Coluna B é o índice 1
-        row_to_insert += 1
-
-    # Preparar os dados para serem inseridos
-    values_to_insert = [
-        data['bookmaker'],  # Coluna B: Casa de Aposta
-        data['date'],  # Coluna C: Data
-        data['ev_percentage'],  # Coluna D: EV%
-        data['game_description'],  # Coluna E: Jogo
-        data['bet_description'],  # Coluna F: Aposta
-        data['sport'],  # Coluna G: Esporte
-        data['market'],  # Coluna H: Mercado
-        data['odds'],  # Coluna I: Odd
-        data['stake'],  # Coluna J: Stake
-    ]
+# Função para gravar várias apostas de uma vez numa planilha; tabs diz a aba de cada aposta (padrão: APOSTAS) e
+# ids, se informado, o ID de cada linha (gravado na coluna oculta do livro local).
+# As apostas de todas as abas vão numa única requisição batchUpdate.
+def append_bets_to_sheet(spreadsheet_id, bets, tabs=None, ids=None):
+    if not bets:
+        return
 
-    # Atualizar as células necessárias na planilha em uma única requisição
-    cell_range = f"B{row_to_insert}:J{row_to_insert}"
-    sheet.update(values=[values_to_insert], range_name=cell_range)
+    # Agrupar por aba, mantendo a ordem de chegada dentro de cada uma
+    por_aba = {}
+    for data, title, row_id in zip(bets, tabs or [SHEET_NAME] * len(bets), ids or [None] * len(bets)):
+        apostas, ids_aba = por_aba.setdefault(title, ([], []))
+        apostas.append(data)
+        ids_aba.append(row_id)
+
+    sheets = get_worksheets(spreadsheet_id, list(por_aba))
+
+    with _get_write_lock(spreadsheet_id):
+        try:
+            rows = _get_next_free_rows(spreadsheet_id, list(sheets.values()))
+            blocos = [
+                (sheets[title], rows[title], apostas, ids_aba if ids else None)
+                for title, (apostas, ids_aba) in por_aba.items()
+            ]
+            with span("gravar_linhas", planilha=spreadsheet_id, apostas=len(bets), abas=len(blocos)):
+                _write_rows_to_sheet(blocos)
+        except Exception as e:
+            # Após qualquer falha não dá para confiar no índice: a coluna B será relida
+            invalidate_next_free_row(spreadsheet_id)
+            # Descartar as abas do cache se o bot perdeu o acesso ou a planilha/aba deixou de existir
+            if is_access_error(e):
+                invalidate_sheet(spreadsheet_id)
+            raise
+
+        for sheet, row_to_insert, apostas, _ in blocos:
+            _advance_next_free_row(spreadsheet_id, sheet.title, row_to_insert + len(apostas))
+
+
+# Função para converter um valor Python no formato de célula da API do Google Sheets
+def _cell_value(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {"userEnteredValue": {"numberValue": value}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+
+# Função para converter a data "yyyy-mm-dd" no número de série que o Google Sheets entende como data
+def _date_cell_value(date_str):
+    try:
+        serial = (datetime.date.fromisoformat(date_str) - SHEETS_EPOCH).days
+    except ValueError:
+        # Data inválida: gravar o texto como veio, igual ao que o Sheets faria
+        return _cell_value(date_str)
+    return _cell_value(serial)
+
+
+# Função para montar as células das colunas B a J de uma aposta
+def _row_cells(data):
+    return [
+        _cell_value(data['bookmaker']),  # Coluna B: Casa de Aposta
+        _date_cell_value(data['date']),  # Coluna C: Data
+        _cell_value(data['ev_percentage']),  # Coluna D: EV%
+        _cell_value(data['game_description']),  # Coluna E: Jogo
+        _cell_value(data['bet_description']),  # Coluna F: Aposta
+        _cell_value(data['sport']),  # Coluna G: Esporte
+        _cell_value(data['market']),  # Coluna H: Mercado
+        _cell_value(data['odds']),  # Coluna I: Odd
+        _cell_value(data['stake']),  # Coluna J: Stake
+    ]
 
-    # Formatar a célula de data como número no formato dd/mm/yyyy
-    date_cell = f"C{row_to_insert}"
-    sheet.format(date_cell, {"numberFormat": {"type": "DATE", "pattern": "dd/mm/yyyy"}})
 
-    # Definir o valor da célula de data diretamente para garantir que seja reconhecido como número
-    date_value = data['date']
-    sheet.update_acell(date_cell, date_value)
+# Função para converter as letras de uma coluna no índice usado pela API (A -> 0)
+def _column_index(letras):
+    indice = 0
+    for letra in letras.upper():
+        indice = indice * 26 + ord(letra) - ord("A") + 1
+    return indice - 1
+
+
+# Função para montar as operações que escrevem as apostas num bloco contíguo da aba a partir da linha informada,
+# com o ID de cada linha na coluna oculta se ids for informado; devolve também se a grade da aba precisou aumentar
+def _block_requests(sheet, row_to_insert, bets, ids=None):
+    start_index = row_to_insert - 1  # A API usa índices começando em 0
+    end_index = start_index + len(bets)
+
+    requests = []
+
+    # Aumentar a grade da aba se o bloco não couber nas linhas existentes
+    grid_expanded = end_index > sheet.row_count
+    if grid_expanded:
+        requests.append({
+            "appendDimension": {"sheetId": sheet.id, "dimension": "ROWS", "length": end_index - sheet.row_count}
+        })
+
+    if ids is not None:
+        coluna_id = _column_index(LEDGER_ID_COLUMN)
+        # A aba precisa chegar até a coluna dos IDs
+        if coluna_id >= sheet.col_count:
+            requests.append({
+                "appendDimension": {"sheetId": sheet.id, "dimension": "COLUMNS", "length": coluna_id + 1 - sheet.col_count}
+            })
+            grid_expanded = True
+        requests.append({
+            "updateCells": {
+                "start": {"sheetId": sheet.id, "rowIndex": start_index, "columnIndex": coluna_id},
+                "rows": [{"values": [_cell_value(row_id)]} for row_id in ids],
+                "fields": "userEnteredValue",
+            }
+        })
+        # Manter a coluna dos IDs oculta
+        requests.append({
+            "updateDimensionProperties": {
+                "range": {"sheetId": sheet.id, "dimension": "COLUMNS", "startIndex": coluna_id, "endIndex": coluna_id + 1},
+                "properties": {"hiddenByUser": True},
+                "fields": "hiddenByUser",
+            }
+        })
+
+    # Valores de todas as apostas (colunas B a J) em um único bloco
+    requests.append({
+        "updateCells": {
+            "start": {"sheetId": sheet.id, "rowIndex": start_index, "columnIndex": 1},
+            "rows": [{"values": _row_cells(data)} for data in bets],
+            "fields": "userEnteredValue",
+        }
+    })
+
+    # Formatar toda a coluna de data do bloco como dd/mm/yyyy de uma só vez
+    requests.append({
+        "repeatCell": {
+            "range": {
+                "sheetId": sheet.id,
+                "startRowIndex": start_index,
+                "endRowIndex": end_index,
+                "startColumnIndex": 2,
+                "endColumnIndex": 3,
+            },
+            "cell": {"userEnteredFormat": {"numberFormat": DATE_NUMBER_FORMAT}},
+            "fields": "userEnteredFormat.numberFormat",
+        }
+    })
+
+    return requests, grid_expanded
+
+
+# Função para escrever os blocos (aba, linha inicial, apostas, IDs das linhas ou None) de uma mesma planilha
+def _write_rows_to_sheet(blocos):
+    requests = []
+    expandidas = []
+    for sheet, row_to_insert, bets, ids in blocos:
+        operacoes, grid_expanded = _block_requests(sheet, row_to_insert, bets, ids)
+        requests.extend(operacoes)
+        if grid_expanded:
+            expandidas.append(sheet)
+
+    # Valores e formatação de todas as abas vão juntos numa única requisição batchUpdate
+    spreadsheet = blocos[0][0].spreadsheet
+    spreadsheet.batch_update({"requests": requests})
+
+    # As propriedades das abas em cache ficaram desatualizadas após aumentar a grade
+    for sheet in expandidas:
+        invalidate_sheet(spreadsheet.id, sheet.title)
+
+
+# Função para comparar as colunas B a J lidas da planilha (valores sem formatação) com as de uma aposta
+def _row_matches(data, lidos):
+    for j, celula in enumerate(_row_cells(data)):
+        esperado = celula["userEnteredValue"]
+        lido = lidos[j] if j < len(lidos) else ""
+        if "numberValue" in esperado:
+            if isinstance(lido, bool) or not isinstance(lido, (int, float)):
+                return False
+            if not math.isclose(lido, esperado["numberValue"], rel_tol=1e-9, abs_tol=1e-12):
+                return False
+        elif str(lido) != esperado["stringValue"]:
+            return False
+    return True
+
+
+# Função para conciliar uma planilha com o livro local; linhas traz (ID na planilha, ID no livro, aba, aposta) das
+# apostas que o livro diz estarem gravadas. Linhas editadas voltam aos valores do livro e cópias de uma mesma linha
+# são apagadas; devolve os IDs do livro que sumiram da planilha (para a compactação gravá-los de novo) e quantas
+# linhas foram editadas e apagadas por serem cópias.
+def reconcile_sheet(spreadsheet_id, linhas):
+    por_aba = {}
+    for row_id, ledger_id, title, data in linhas:
+        por_aba.setdefault(title, {})[row_id] = (ledger_id, data)
+    if not por_aba:
+        return [], 0, 0
+
+    sheets = get_worksheets(spreadsheet_id, list(por_aba))
+    letra_id = LEDGER_ID_COLUMN.upper()
+    coluna_id = _column_index(letra_id)
+    # Abas que não chegam até a coluna dos IDs (ex.: colunas excluídas) não têm nenhuma linha do livro
+    lidas = [title for title in por_aba if coluna_id < sheets[title].col_count]
+
+    faltando = [ledger_id for title in por_aba if title not in lidas for ledger_id, _ in por_aba[title].values()]
+    editadas = copias = 0
+    with _get_write_lock(spreadsheet_id):
+        try:
+            if not lidas:
+                return faltando, editadas, copias
+            ranges = []
+            for title in lidas:
+                ranges += [f"{_quoted_title(title)}!B2:J", f"{_quoted_title(title)}!{letra_id}2:{letra_id}"]
+            spreadsheet = sheets[lidas[0]].spreadsheet
+            with span("ler_planilha", planilha=spreadsheet_id, abas=len(lidas)):
+                resposta = spreadsheet.values_batch_get(ranges, params={"valueRenderOption": "UNFORMATTED_VALUE"})
+            intervalos = resposta.get("valueRanges", [])
+
+            requests, exclusoes = [], []
+            for i, title in enumerate(lidas):
+                sheet, apostas = sheets[title], por_aba[title]
+                valores = intervalos[2 * i].get("values", [])
+                encontradas = set()
+                copias_aba = []
+                for n, celulas in enumerate(intervalos[2 * i + 1].get("values", [])):
+                    row_id = str(celulas[0]) if celulas else ""
+                    if row_id not in apostas:
+                        continue  # Linha sem ID ou de fora do livro: pertence ao usuário
+                    row = n + 2
+                    if row_id in encontradas:
+                        # A mesma linha gravada duas vezes (ex.: o bot caiu entre a escrita e o registro no livro)
+                        copias_aba.append(row)
+                        continue
+                    encontradas.add(row_id)
+                    if not _row_matches(apostas[row_id][1], valores[n] if n < len(valores) else []):
+                        requests += _block_requests(sheet, row, [apostas[row_id][1]])[0]
+                        editadas += 1
+                faltando += [ledger_id for row_id, (ledger_id, _) in apostas.items() if row_id not in encontradas]
+                # As cópias são excluídas de baixo para cima, para as linhas de cima não mudarem de posição
+                exclusoes += [
+                    {"deleteDimension": {
+                        "range": {"sheetId": sheet.id, "dimension": "ROWS", "startIndex": row - 1, "endIndex": row},
+                    }} for row in reversed(copias_aba)
+                ]
+                copias += len(copias_aba)
+
+            # As correções usam os números de linha lidos: vão antes das exclusões no mesmo batchUpdate
+            requests += exclusoes
+            if requests:
+                with span("reparar_linhas", planilha=spreadsheet_id, linhas=editadas + copias):
+                    spreadsheet.batch_update({"requests": requests})
+        finally:
+            # O usuário pode ter excluído linhas: reler a próxima linha livre e as propriedades das abas
+            invalidate_next_free_row(spreadsheet_id)
+            invalidate_sheet(spreadsheet_id)
+    return faltando, editadas, copias
+
+
+# Pool de threads onde rodam as chamadas ao Google Sheets, fora do loop do asyncio
+_sheets_executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_WORKERS, thread_name_prefix="sheets")
+
+# Vagas do pool: limita quantas escritas podem estar em andamento ao mesmo tempo
+_sheets_slots = asyncio.Semaphore(SHEETS_MAX_PENDING)
+
+# Locks por chave (usuário ou planilha) para manter a ordem das escritas: chave -> [asyncio.Lock, tarefas usando]
+_user_io_locks = {}
+
+
+# Função para executar uma chamada bloqueante do Google Sheets no pool, na ordem de chegada de cada chave
+async def run_sheet_io(key, func, *args):
+    entrada = _user_io_locks.setdefault(key, [asyncio.Lock(), 0])
+    entrada[1] += 1
+    try:
+        # Primeiro a vez da chave (ordem), depois uma vaga no pool (contrapressão)
+        async with entrada[0]:
+            async with _sheets_slots:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(_sheets_executor, functools.partial(func, *args))
+    finally:
+        entrada[1] -= 1
+        if entrada[1] == 0:
+            del _user_io_locks[key]
+
+
+# Campos que identificam uma aposta ao procurar duplicatas
+BET_IDENTITY_FIELDS = ("bookmaker", "date", "game_description", "bet_description", "odds")
+
+
+# Função para calcular a impressão digital de uma aposta (campos de identidade normalizados)
+def bet_digest(data):
+    chave = "\x1f".join(" ".join(str(data[campo]).split()).casefold() for campo in BET_IDENTITY_FIELDS)
+    return hashlib.blake2b(chave.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# Responsabilidade de cada processo pelas planilhas em que grava (tabela responsaveis), para dois bots nunca
+# gravarem na mesma planilha ao mesmo tempo; usada pela fila e pelo livro local, que também têm _conn e _lock
+class _SheetLeases:
+    def _create_leases(self):
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responsaveis ("
+            " spreadsheet_id TEXT PRIMARY KEY,"
+            " worker TEXT NOT NULL,"
+            " valido_ate REAL NOT NULL)"
+        )
 
-    # Definir o valor da célula de data diretamente para garantir que seja reconhecido como número
-    date_value = data['date']
-    sheet.update_acell(date_cell, date_value)
+    # Renovar a responsabilidade pelas planilhas que este processo ainda está gravando
+    def renew(self, spreadsheet_ids):
+        with self._lock:
+            self._renew(spreadsheet_ids, time.time())
 
+    def _renew(self, spreadsheet_ids, agora):
+        self._conn.executemany(
+            "UPDATE responsaveis SET valido_ate = ? WHERE spreadsheet_id = ? AND worker = ?",
+            [(agora + self._lease_ttl, spreadsheet_id, self._worker_id) for spreadsheet_id in spreadsheet_ids],
+        )
 
-# Função para processar a mensagem e extrair os dados
-def process_message(message):
-    sport = "Desconhecido"
-    # Dividir a mensagem em linhas
-    lines = message.split("\n")
+    # Tornar este processo o responsável pela planilha: None se outro bot ainda responde por ela,
+    # True se ela veio de outro bot (o índice da próxima linha deste processo pode estar desatualizado)
+    def _claim(self, spreadsheet_id, agora):
+        atual = self._conn.execute(
+            "SELECT worker, valido_ate FROM responsaveis WHERE spreadsheet_id = ?", (spreadsheet_id,)
+        ).fetchone()
+        if atual and atual[0] != self._worker_id and atual[1] > agora:
+            return None
+        self._conn.execute(
+            "INSERT INTO responsaveis (spreadsheet_id, worker, valido_ate) VALUES (?, ?, ?)"
+            " ON CONFLICT(spreadsheet_id) DO UPDATE SET worker = excluded.worker, valido_ate = excluded.valido_ate",
+            (spreadsheet_id, self._worker_id, agora + self._lease_ttl),
+        )
+        return atual is not None and atual[0] != self._worker_id
+
+    # Liberar as planilhas deste processo (ao encerrar), para outro bot assumi-las sem esperar o prazo
+    def release(self):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE responsaveis SET valido_ate = 0 WHERE worker = ?", (self._worker_id,)
+            )
+
+
+# Fila persistente (SQLite) das apostas aguardando gravação na planilha
+class BetQueue(_SheetLeases):
+    def __init__(self, path, worker_id, lease_ttl):
+        self._worker_id = worker_id
+        self._lease_ttl = lease_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fila ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " spreadsheet_id TEXT NOT NULL,"
+            " user_id TEXT NOT NULL,"
+            " chat_id INTEGER,"
+            " dados TEXT NOT NULL,"
+            " tentativas INTEGER NOT NULL DEFAULT 0,"
+            " proxima_tentativa REAL NOT NULL DEFAULT 0,"
+            " ultimo_erro TEXT,"
+            " falhou INTEGER NOT NULL DEFAULT 0,"
+            " criado_em REAL NOT NULL,"
+            " aba TEXT NOT NULL DEFAULT 'APOSTAS')"
+        )
+        # Filas criadas antes do roteamento por aba
+        colunas = {linha[1] for linha in self._conn.execute("PRAGMA table_info(fila)")}
+        if "aba" not in colunas:
+            self._conn.execute("ALTER TABLE fila ADD COLUMN aba TEXT NOT NULL DEFAULT 'APOSTAS'")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS fila_pendentes ON fila (falhou, spreadsheet_id, id)")
+        self._create_leases()
+
+    # Adicionar as apostas de uma mensagem à fila numa única transação; destinos traz (planilha, aba, aposta)
+    def enqueue(self, user_id, chat_id, destinos):
+        agora = time.time()
+        linhas = [
+            (spreadsheet_id, aba, user_id, chat_id, json.dumps(data), agora) for spreadsheet_id, aba, data in destinos
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO fila (spreadsheet_id, aba, user_id, chat_id, dados, criado_em) VALUES (?, ?, ?, ?, ?, ?)",
+                linhas,
+            )
+            self._conn.execute("COMMIT")
+
+    # Montar os lotes prontos para envio: um por planilha (com todas as abas dela), respeitando a ordem de chegada;
+    # com only, só das planilhas informadas. Cada lote vem com um indicador de que a planilha acabou de passar a
+    # este processo (vinda de outro bot).
+    def due_batches(self, limit, skip=(), only=None):
+        agora = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._renew(skip, agora)
+
+                # Uma planilha só está pronta se a aposta mais antiga dela já pode ser reenviada
+                prontas = self._conn.execute(
+                    "SELECT f.spreadsheet_id FROM fila f"
+                    " JOIN (SELECT MIN(id) AS primeiro FROM fila WHERE falhou = 0 GROUP BY spreadsheet_id) p"
+                    " ON f.id = p.primeiro WHERE f.proxima_tentativa <= ?",
+                    (agora,),
+                ).fetchall()
+
+                lotes = []
+                for (spreadsheet_id,) in prontas:
+                    if spreadsheet_id in skip or (only is not None and spreadsheet_id not in only):
+                        continue
+                    assumida = self._claim(spreadsheet_id, agora)
+                    if assumida is None:
+                        continue  # Outro bot está gravando nesta planilha
+                    linhas = self._conn.execute(
+                        "SELECT id, user_id, chat_id, dados, tentativas, aba FROM fila"
+                        " WHERE falhou = 0 AND spreadsheet_id = ? ORDER BY id LIMIT ?",
+                        (spreadsheet_id, limit),
+                    ).fetchall()
+                    lotes.append((spreadsheet_id, linhas, assumida))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return lotes
+
+    # Quantidade de apostas aguardando gravação (sem contar as que já foram desistidas); com spreadsheet_ids, só
+    # nessas planilhas
+    def pending(self, spreadsheet_ids=None):
+        with self._lock:
+            if spreadsheet_ids is None:
+                return self._conn.execute("SELECT COUNT(*) FROM fila WHERE falhou = 0").fetchone()[0]
+            return sum(
+                self._conn.execute(
+                    "SELECT COUNT(*) FROM fila WHERE falhou = 0 AND spreadsheet_id = ?", (spreadsheet_id,)
+                ).fetchone()[0]
+                for spreadsheet_id in spreadsheet_ids
+            )
+
+    # Quantidade de apostas das planilhas informadas que atingiram o limite de tentativas
+    def failed(self, spreadsheet_ids):
+        with self._lock:
+            return sum(
+                self._conn.execute(
+                    "SELECT COUNT(*) FROM fila WHERE falhou = 1 AND spreadsheet_id = ?", (spreadsheet_id,)
+                ).fetchone()[0]
+                for spreadsheet_id in spreadsheet_ids
+            )
+
+    # Remover da fila as apostas gravadas com sucesso
+    def mark_done(self, ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM fila WHERE id = ?", [(i,) for i in ids])
+
+    # Registrar uma falha; devolve as linhas que atingiram o limite de tentativas
+    def mark_failed(self, rows, error, count_attempt=True):
+        agora = time.time()
+        desistidas = []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for row_id, user_id, chat_id, dados, tentativas, aba in rows:
+                if count_attempt:
+                    tentativas += 1
+                espera = min(QUEUE_BACKOFF_BASE ** tentativas, QUEUE_BACKOFF_MAX) * random.uniform(0.8, 1.2)
+                falhou = int(tentativas >= QUEUE_MAX_ATTEMPTS)
+                if falhou:
+                    desistidas.append((row_id, user_id, chat_id, dados, tentativas, aba))
+                self._conn.execute(
+                    "UPDATE fila SET tentativas = ?, proxima_tentativa = ?, ultimo_erro = ?, falhou = ? WHERE id = ?",
+                    (tentativas, agora + espera, str(error), falhou, row_id),
+                )
+            self._conn.execute("COMMIT")
+        return desistidas
+
+
+# Índice persistente (SQLite) das apostas recentes de cada usuário, usado para descartar duplicatas
+class DedupIndex:
+    def __init__(self, path, window, max_per_user):
+        self._window = window
+        self._max_per_user = max_per_user
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS duplicatas ("
+            " user_id TEXT NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " visto_em REAL NOT NULL,"
+            " PRIMARY KEY (user_id, digest)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS duplicatas_idade ON duplicatas (user_id, visto_em)")
+
+    # Marcar quais apostas são novas (True) e registrá-las; as repetidas (False) têm o registro renovado
+    def filter_new(self, user_id, bets):
+        if self._window <= 0:
+            return [True] * len(bets)
+
+        agora = time.time()
+        novas = []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            # Esquecer o que saiu da janela de tempo
+            self._conn.execute(
+                "DELETE FROM duplicatas WHERE user_id = ? AND visto_em < ?", (user_id, agora - self._window)
+            )
+            for data in bets:
+                digest = bet_digest(data)
+                existe = self._conn.execute(
+                    "SELECT 1 FROM duplicatas WHERE user_id = ? AND digest = ?", (user_id, digest)
+                ).fetchone()
+                self._conn.execute(
+                    "INSERT INTO duplicatas (user_id, digest, visto_em) VALUES (?, ?, ?)"
+                    " ON CONFLICT(user_id, digest) DO UPDATE SET visto_em = excluded.visto_em",
+                    (user_id, digest, agora),
+                )
+                novas.append(existe is None)
+            # Manter apenas as apostas mais recentes do usuário
+            self._conn.execute(
+                "DELETE FROM duplicatas WHERE user_id = ? AND digest IN ("
+                " SELECT digest FROM duplicatas WHERE user_id = ? ORDER BY visto_em DESC LIMIT -1 OFFSET ?)",
+                (user_id, user_id, self._max_per_user),
+            )
+            self._conn.execute("COMMIT")
+        return novas
+
+    # Esquecer apostas que não puderam ser gravadas, para que o usuário possa reenviá-las
+    def forget(self, user_id, bets):
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM duplicatas WHERE user_id = ? AND digest = ?",
+                [(user_id, bet_digest(data)) for data in bets],
+            )
+
+
+# Dimensões em que as estatísticas são agregadas: nome -> campo da aposta
+STATS_DIMENSIONS = {"total": None, "esporte": "sport", "mercado": "market", "casa": "bookmaker"}
+
+
+# Estatísticas (SQLite) das apostas gravadas na planilha de cada usuário, mantidas a cada gravação
+# para o /stats responder sem ler a planilha
+class BetStats:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Uma linha por aposta gravada, só com as colunas usadas nas contas
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS apostas_gravadas ("
+            " user_id TEXT NOT NULL,"
+            " esporte TEXT NOT NULL,"
+            " mercado TEXT NOT NULL,"
+            " casa TEXT NOT NULL,"
+            " stake REAL NOT NULL,"
+            " odd REAL NOT NULL,"
+            " ev REAL NOT NULL,"
+            " gravado_em REAL NOT NULL)"
+        )
+        # Somas por usuário e dimensão, atualizadas na mesma transação que grava as apostas acima
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS estatisticas ("
+            " user_id TEXT NOT NULL,"
+            " dimensao TEXT NOT NULL,"
+            " valor TEXT NOT NULL,"
+            " apostas INTEGER NOT NULL,"
+            " stake REAL NOT NULL,"
+            " odd_soma REAL NOT NULL,"
+            " ev_soma REAL NOT NULL,"
+            " lucro_esperado REAL NOT NULL,"
+            " PRIMARY KEY (user_id, dimensao, valor)) WITHOUT ROWID"
+        )
 
-    # A linha 11 contém o mercado, que queremos extrair
-    mercado_line = lines[10]  # Linha 11 é a index 10 (indexing começa de 0)
+    # Registrar apostas gravadas na planilha do usuário e somá-las aos agregados
+    def record(self, user_id, bets):
+        agora = time.time()
+        linhas = []
+        somas = {}
+        for data in bets:
+            stake, odd, ev = float(data["stake"]), float(data["odds"]), float(data["ev_percentage"])
+            linhas.append((user_id, data["sport"], data["market"], data["bookmaker"], stake, odd, ev, agora))
+            for dimensao, campo in STATS_DIMENSIONS.items():
+                chave = (dimensao, "" if campo is None else str(data[campo]))
+                soma = somas.setdefault(chave, [0, 0.0, 0.0, 0.0, 0.0])
+                soma[0] += 1
+                soma[1] += stake
+                soma[2] += odd
+                soma[3] += ev
+                soma[4] += stake * ev
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO apostas_gravadas (user_id, esporte, mercado, casa, stake, odd, ev, gravado_em)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                linhas,
+            )
+            self._conn.executemany(
+                "INSERT INTO estatisticas (user_id, dimensao, valor, apostas, stake, odd_soma, ev_soma, lucro_esperado)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(user_id, dimensao, valor) DO UPDATE SET"
+                " apostas = apostas + excluded.apostas, stake = stake + excluded.stake,"
+                " odd_soma = odd_soma + excluded.odd_soma, ev_soma = ev_soma + excluded.ev_soma,"
+                " lucro_esperado = lucro_esperado + excluded.lucro_esperado",
+                [(user_id, dimensao, valor, *soma) for (dimensao, valor), soma in somas.items()],
+            )
+            self._conn.execute("COMMIT")
+
+    # Agregados do usuário: dimensão -> lista de linhas (maior stake primeiro)
+    def summary(self, user_id):
+        with self._lock:
+            linhas = self._conn.execute(
+                "SELECT dimensao, valor, apostas, stake, odd_soma, ev_soma, lucro_esperado FROM estatisticas"
+                " WHERE user_id = ? ORDER BY dimensao, stake DESC, valor",
+                (user_id,),
+            ).fetchall()
+        resumo = {}
+        for dimensao, valor, apostas, stake, odd_soma, ev_soma, lucro_esperado in linhas:
+            resumo.setdefault(dimensao, []).append({
+                "valor": valor,
+                "apostas": apostas,
+                "stake": stake,
+                "odd_media": odd_soma / apostas,
+                "ev_medio": ev_soma / apostas,
+                "lucro_esperado": lucro_esperado,
+                # Retorno esperado sobre o valor apostado (o bot não sabe o resultado das apostas)
+                "roi_esperado": lucro_esperado / stake if stake else 0.0,
+            })
+        return resumo
+
+
+# Campos de cada aposta guardados no livro local, na ordem das colunas B a J da planilha
+LEDGER_FIELDS = ("bookmaker", "date", "ev_percentage", "game_description", "bet_description", "sport", "market",
+                 "odds", "stake")
+
+
+# Função para remontar uma aposta a partir dos campos guardados no livro local
+def _ledger_bet(campos):
+    return dict(zip(LEDGER_FIELDS, campos))
+
+
+# Livro local (SQLite) do modo "local": cada aposta é guardada aqui, com uma coluna por campo, antes de qualquer
+# chamada ao Google. As planilhas são cópias do livro, atualizadas pela compactação e conferidas pela conciliação
+# (cada linha gravada leva o ID dela na coluna oculta LEDGER_ID_COLUMN).
+class BetLedger(_SheetLeases):
+    def __init__(self, path, worker_id, lease_ttl):
+        self._worker_id = worker_id
+        self._lease_ttl = lease_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Colunas das apostas sem tipo declarado: números continuam números e textos continuam textos
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS livro ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " spreadsheet_id TEXT NOT NULL,"
+            " aba TEXT NOT NULL,"
+            " user_id TEXT NOT NULL,"
+            " chat_id INTEGER,"
+            f" {', '.join(LEDGER_FIELDS)},"
+            " na_planilha INTEGER NOT NULL DEFAULT 0,"
+            " criado_em REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS livro_planilha ON livro (na_planilha, spreadsheet_id, id)")
+        # Situação de cada planilha: falhas seguidas (com a espera até a próxima tentativa) e última conciliação
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS planilhas_livro ("
+            " spreadsheet_id TEXT PRIMARY KEY,"
+            " tentativas INTEGER NOT NULL DEFAULT 0,"
+            " proxima_tentativa REAL NOT NULL DEFAULT 0,"
+            " ultimo_erro TEXT,"
+            " conciliada_em REAL NOT NULL)"
+        )
+        # Prefixo dos IDs das linhas, sorteado na criação do livro: um livro novo nunca confunde as linhas de outro
+        self._conn.execute("CREATE TABLE IF NOT EXISTS livro_info (chave TEXT PRIMARY KEY, valor TEXT NOT NULL)")
+        self._conn.execute(
+            "INSERT OR IGNORE INTO livro_info (chave, valor) VALUES ('prefixo', ?)", (secrets.token_hex(4),)
+        )
+        self.prefix = self._conn.execute("SELECT valor FROM livro_info WHERE chave = 'prefixo'").fetchone()[0]
+        self._create_leases()
+
+    # ID de uma linha do livro na coluna oculta da planilha
+    def row_id(self, ledger_id):
+        return f"{self.prefix}-{ledger_id}"
+
+    # Guardar as apostas de uma mensagem numa única transação; destinos traz (planilha, aba, aposta)
+    def append(self, user_id, chat_id, destinos):
+        agora = time.time()
+        linhas = [
+            (spreadsheet_id, aba, user_id, chat_id, *(data[campo] for campo in LEDGER_FIELDS), agora)
+            for spreadsheet_id, aba, data in destinos
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                f"INSERT INTO livro (spreadsheet_id, aba, user_id, chat_id, {', '.join(LEDGER_FIELDS)}, criado_em)"
+                f" VALUES ({', '.join('?' * (len(LEDGER_FIELDS) + 5))})",
+                linhas,
+            )
+            # A primeira conciliação de uma planilha nova só acontece depois do intervalo
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO planilhas_livro (spreadsheet_id, conciliada_em) VALUES (?, ?)",
+                [(spreadsheet_id, agora) for spreadsheet_id in {linha[0] for linha in linhas}],
+            )
+            self._conn.execute("COMMIT")
+
+    # Montar os lotes da compactação: um por planilha, com as apostas que ainda não estão nela, na ordem de chegada.
+    # Cada lote vem com um indicador de que a planilha acabou de passar a este processo (vinda de outro bot).
+    def due_batches(self, limit, skip=()):
+        agora = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._renew(skip, agora)
+                prontas = self._conn.execute(
+                    "SELECT p.spreadsheet_id FROM planilhas_livro p WHERE p.proxima_tentativa <= ? AND EXISTS ("
+                    " SELECT 1 FROM livro l WHERE l.na_planilha = 0 AND l.spreadsheet_id = p.spreadsheet_id)",
+                    (agora,),
+                ).fetchall()
+
+                lotes = []
+                for (spreadsheet_id,) in prontas:
+                    if spreadsheet_id in skip:
+                        continue
+                    assumida = self._claim(spreadsheet_id, agora)
+                    if assumida is None:
+                        continue  # Outro bot está gravando nesta planilha
+                    linhas = self._conn.execute(
+                        f"SELECT id, aba, user_id, chat_id, {', '.join(LEDGER_FIELDS)} FROM livro"
+                        " WHERE na_planilha = 0 AND spreadsheet_id = ? ORDER BY id LIMIT ?",
+                        (spreadsheet_id, limit),
+                    ).fetchall()
+                    lotes.append((spreadsheet_id, linhas, assumida))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return lotes
+
+    # Escolher as planilhas a conciliar (as conciliadas há mais tempo primeiro), cada uma com as apostas que
+    # o livro diz estarem gravadas nela
+    def due_reconciliations(self, limit, interval, skip=()):
+        agora = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                candidatas = self._conn.execute(
+                    "SELECT spreadsheet_id FROM planilhas_livro WHERE conciliada_em <= ? AND proxima_tentativa <= ?"
+                    " ORDER BY conciliada_em",
+                    (agora - interval, agora),
+                ).fetchall()
+
+                escolhidas = []
+                for (spreadsheet_id,) in candidatas:
+                    if len(escolhidas) >= limit:
+                        break
+                    if spreadsheet_id in skip:
+                        continue
+                    assumida = self._claim(spreadsheet_id, agora)
+                    if assumida is None:
+                        continue
+                    linhas = self._conn.execute(
+                        f"SELECT id, aba, {', '.join(LEDGER_FIELDS)} FROM livro"
+                        " WHERE na_planilha = 1 AND spreadsheet_id = ? ORDER BY id",
+                        (spreadsheet_id,),
+                    ).fetchall()
+                    escolhidas.append((spreadsheet_id, linhas, assumida))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return escolhidas
+
+    # Quantidade de apostas que ainda não estão na planilha
+    def pending(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM livro WHERE na_planilha = 0").fetchone()[0]
+
+    # Marcar apostas como gravadas na planilha (as falhas anteriores da planilha são esquecidas)
+    def mark_written(self, spreadsheet_id, ids):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("UPDATE livro SET na_planilha = 1 WHERE id = ?", [(i,) for i in ids])
+            self._conn.execute(
+                "UPDATE planilhas_livro SET tentativas = 0, proxima_tentativa = 0, ultimo_erro = NULL"
+                " WHERE spreadsheet_id = ?",
+                (spreadsheet_id,),
+            )
+            self._conn.execute("COMMIT")
+
+    # Devolver à compactação apostas que sumiram da planilha
+    def mark_missing(self, ids):
+        with self._lock:
+            self._conn.executemany("UPDATE livro SET na_planilha = 0 WHERE id = ?", [(i,) for i in ids])
+
+    # Registrar a conciliação de uma planilha
+    def mark_reconciled(self, spreadsheet_id):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE planilhas_livro SET conciliada_em = ?, tentativas = 0, proxima_tentativa = 0, ultimo_erro = NULL"
+                " WHERE spreadsheet_id = ?",
+                (time.time(), spreadsheet_id),
+            )
+
+    # Registrar uma falha ao gravar ou conciliar uma planilha; as apostas continuam no livro e são tentadas de novo
+    # depois da espera. Devolve True quando as falhas seguidas acabaram de chegar ao limite (para avisar o usuário).
+    def mark_failed(self, spreadsheet_id, error, count_attempt=True):
+        with self._lock:
+            tentativas = self._conn.execute(
+                "SELECT tentativas FROM planilhas_livro WHERE spreadsheet_id = ?", (spreadsheet_id,)
+            ).fetchone()[0]
+            if count_attempt:
+                tentativas += 1
+            espera = min(QUEUE_BACKOFF_BASE ** tentativas, QUEUE_BACKOFF_MAX) * random.uniform(0.8, 1.2)
+            self._conn.execute(
+                "UPDATE planilhas_livro SET tentativas = ?, proxima_tentativa = ?, ultimo_erro = ?"
+                " WHERE spreadsheet_id = ?",
+                (tentativas, time.time() + espera, str(error), spreadsheet_id),
+            )
+        return count_attempt and tentativas == QUEUE_MAX_ATTEMPTS
+
+
+# Inicializar a fila de apostas, o índice de duplicatas e as estatísticas
+bet_queue = _LazyInstance(lambda: BetQueue(QUEUE_DB_FILE, WORKER_ID, QUEUE_LEASE_TTL))
+dedup_index = _LazyInstance(lambda: DedupIndex(DEDUP_DB_FILE, DEDUP_WINDOW, DEDUP_MAX_PER_USER))
+bet_stats = _LazyInstance(lambda: BetStats(STATS_DB_FILE))
+bet_ledger = _LazyInstance(lambda: BetLedger(LEDGER_DB_FILE, WORKER_ID, QUEUE_LEASE_TTL))
+
+# Métricas lidas na hora da coleta: tamanho da fila e uso do cache de abas
+metricas.registry.gauge("botsheets_fila_pendentes", "Apostas na fila aguardando gravação",
+                        lambda: bet_queue.pending())
+metricas.registry.gauge("botsheets_livro_pendentes", "Apostas do livro local que ainda não estão na planilha",
+                        lambda: bet_ledger.pending() if SHEETS_WRITE_MODE == "local" else 0)
+metricas.registry.gauge("botsheets_cache_abas_acertos", "Aberturas de aba atendidas pelo cache",
+                        lambda: sheet_cache_stats["hits"])
+metricas.registry.gauge("botsheets_cache_abas_faltas", "Aberturas de aba que foram ao Google",
+                        lambda: sheet_cache_stats["misses"])
+metricas.registry.gauge("botsheets_cache_parser_acertos", "Apostas reaproveitadas do cache do parser",
+                        lambda: formatador.parse_cache_stats["hits"])
+metricas.registry.gauge("botsheets_cache_parser_faltas", "Apostas interpretadas do zero",
+                        lambda: formatador.parse_cache_stats["misses"])
+
+# Tarefa que esvazia a fila e planilhas com um lote sendo enviado no momento
+_queue_flusher_task = None
+_flushing = {}
+
+# Tarefa do livro local (modo "local") e planilhas sendo compactadas ou conciliadas no momento
+_ledger_task = None
+_ledger_tasks = {}
+
+
+# Função para verificar se um erro indica que a cota de requisições do Google foi excedida
+def is_quota_error(error):
+    return sheet_backend.is_quota_error(error)
+
+
+# Função para enviar um lote da fila para a planilha
+async def _flush_batch(application, spreadsheet_id, rows):
+    bets = [json.loads(dados) for _, _, _, dados, _, _ in rows]
+    tabs = [row[5] for row in rows]
+    try:
+        with span("gravar_lote", planilha=spreadsheet_id, apostas=len(bets)):
+            await run_sheet_io(spreadsheet_id, append_bets_to_sheet, spreadsheet_id, bets, tabs)
+    except Exception as e:
+        if len(rows) > 1 and is_bet_error(e):
+            # Uma aposta com problema não pode gastar as tentativas do lote inteiro: gravar as metades
+            # separadamente até isolá-la (as boas são gravadas, só ela volta para a fila)
+            logger.warning("Erro ao gravar {} aposta(s) na planilha {} ({}): dividindo o lote",
+                           len(rows), spreadsheet_id, e)
+            meio = len(rows) // 2
+            await _flush_batch(application, spreadsheet_id, rows[:meio])
+            await _flush_batch(application, spreadsheet_id, rows[meio:])
+            return
 
-    # Extrair o texto do mercado até o parêntese "("
-    mercado = mercado_line.split("(")[0].strip()  # Remove espaços extras
+        quota = is_quota_error(e)  # O agendador já pausou as requisições
+        logger.error("Erro ao gravar {} aposta(s) na planilha {}: {}", len(rows), spreadsheet_id, e)
+        # Cota esgotada não conta como tentativa: a aposta em si não tem problema
+        desistidas = await asyncio.to_thread(bet_queue.mark_failed, rows, e, not quota)
+        metricas.bets_retried.inc(len(rows) - len(desistidas))
+        metricas.bets_failed.inc(len(desistidas), motivo="gravacao")
+        for _, user_id, _, dados, _, _ in desistidas:
+            await asyncio.to_thread(dedup_index.forget, user_id, [json.loads(dados)])
+        await _notify_failed_bets(application, [row[2] for row in desistidas])
+        return
 
-    # Procurar as informações principais (EV%, Stake, odds, emoji de esporte, etc.)
-    ev_percentage = re.search(r"(\d+\.\d+)% aposta de valor", message)
-    stake = re.search(r"Stake: (\d+\.\d+)u", message)
-    odds = re.search(r"@ (\d+\.\d+)", message)
-    sport_emoji = re.search(
-        r"([\U0001F3C0\U000026BD\U0001F3BE\U0001F6A9\U0001F7E8\U0001F93D\U0001F3D2\U0001F3C8\U0001F3AE"
-        r"\U0001F3D0\U0001F93E\U000026BE\U0001F3CC])",  # Incluído emoji de beisebol (\U000026BE)
-        message
-    )
-    date = re.search(r"(\d{2})\.(\d{2})\.(\d{4})", message)  # Encontrar a data
-    bookmaker = re.search(r"na (\w+)", message)  # Casa de aposta
-    # Captura o nome do confronto entre duas equipes
-    game_description = "Desconhecido"
-    game_lines = re.findall(r"(.*\s(?:vs|x)\s.*?)(?=\s\d{2}\.\d{2}\.\d{4})", message)
-
-    if game_lines:
-        game_description = game_lines[0].strip()
-
-    # Inicializar a descrição da aposta
-    description_text = "Descrição não encontrada"
-    if not description_text:
-        description_text = "Descrição não encontrada"  # Defina um valor padrão caso não tenha sido encontrado
-
-    # Capturar a descrição da aposta
-    description = re.search(r"Aposta: (.+?) @", message)
-    if description:
-        description_text = description.group(1).strip()  # Extrai a descrição da aposta
-
-        # Verificar se "Mais" ou "Menos" está na descrição e se "1ª Parte" está na mensagem
-        primeira_parte_match = re.search(r"1ª Parte", message)  # Verificar se "1ª Parte" está na mensagem
-
-        if "Mais" in description_text:
-            if primeira_parte_match:  # Se "1ª Parte" estiver na mensagem
-                mercado = f"1ª Parte - Over {mercado.split(' ')[-1]}"  # Adiciona "1ª Parte" ao mercado
+    await asyncio.to_thread(bet_queue.mark_done, [row[0] for row in rows])
+    metricas.bets_written.inc(len(rows))
+
+    por_usuario = {}
+    for (_, user_id, *_), data in zip(rows, bets):
+        por_usuario.setdefault(user_id, []).append(data)
+    for user_id, apostas in por_usuario.items():
+        await asyncio.to_thread(record_bet_stats, user_id, apostas)
+
+
+# Função para avisar os usuários sobre apostas que não puderam ser gravadas (um chat_id por aposta); guardadas
+# indica que elas continuam no livro local e serão gravadas quando a planilha voltar a aceitar
+async def _notify_failed_bets(application, chat_ids, guardadas=False):
+    por_chat = {}
+    for chat_id in chat_ids:
+        if chat_id is not None:
+            por_chat[chat_id] = por_chat.get(chat_id, 0) + 1
+
+    for chat_id, quantidade in por_chat.items():
+        if guardadas:
+            texto = (f"Não foi possível registrar {quantidade} aposta(s) na sua planilha após várias tentativas. "
+                     "Elas continuam guardadas e serão registradas assim que a planilha voltar a aceitar: "
+                     "verifique se o bot ainda é editor dela.")
+        else:
+            texto = (f"Não foi possível registrar {quantidade} aposta(s) na sua planilha após várias tentativas. "
+                     "Verifique se o bot ainda é editor da planilha e envie as apostas novamente.")
+        try:
+            await outbound.send(application.bot, chat_id, [texto])
+        except Exception as e:
+            logger.error("Erro ao avisar o chat {} sobre apostas não registradas: {}", chat_id, e)
+
+
+# Tarefa em segundo plano que esvazia a fila, um lote por planilha de cada vez, conforme o orçamento de requisições
+async def queue_flusher(application):
+    while True:
+        try:
+            if sheets_scheduler.has_budget():
+                # Planilhas sem orçamento ficam de fora e acumulam apostas para uma escrita maior depois
+                skip = set(_flushing) | sheets_scheduler.throttled_sheets()
+                lotes = await asyncio.to_thread(bet_queue.due_batches, QUEUE_BATCH_SIZE, skip)
             else:
-                mercado = f"Over {mercado.split(' ')[-1]}"  # Caso contrário, apenas "Over"
-        elif "Menos" in description_text:
-            if primeira_parte_match:  # Se "1ª Parte" estiver na mensagem
-                mercado = f"1ª Parte - Under {mercado.split(' ')[-1]}"  # Adiciona "1ª Parte" ao mercado
+                await asyncio.to_thread(bet_queue.renew, set(_flushing))
+                lotes = []
+        except Exception as e:
+            logger.error("Erro ao ler a fila de apostas: {}", e)
+            lotes = []
+
+        for spreadsheet_id, rows, assumida in lotes:
+            if assumida:
+                # Outro bot gravou nesta planilha desde a última vez: reler a próxima linha livre
+                invalidate_next_free_row(spreadsheet_id)
+            tarefa = asyncio.create_task(_flush_batch(application, spreadsheet_id, rows))
+            _flushing[spreadsheet_id] = tarefa
+            tarefa.add_done_callback(lambda _, sid=spreadsheet_id: _flushing.pop(sid, None))
+
+        await asyncio.sleep(QUEUE_FLUSH_INTERVAL)
+
+
+# Função para compactar numa planilha as apostas do livro local que ainda não estão nela
+async def _compact_ledger_batch(application, spreadsheet_id, rows):
+    bets = [_ledger_bet(row[4:]) for row in rows]
+    tabs = [row[1] for row in rows]
+    ids = [bet_ledger.row_id(row[0]) for row in rows]
+    try:
+        with span("compactar_livro", planilha=spreadsheet_id, apostas=len(bets)):
+            await run_sheet_io(spreadsheet_id, append_bets_to_sheet, spreadsheet_id, bets, tabs, ids)
+    except Exception as e:
+        quota = is_quota_error(e)  # O agendador já pausou as requisições
+        logger.error("Erro ao compactar {} aposta(s) do livro na planilha {}: {}", len(rows), spreadsheet_id, e)
+        avisar = await asyncio.to_thread(bet_ledger.mark_failed, spreadsheet_id, e, not quota)
+        metricas.bets_retried.inc(len(rows))
+        if avisar:
+            await _notify_failed_bets(application, [row[3] for row in rows], guardadas=True)
+        return
+
+    await asyncio.to_thread(bet_ledger.mark_written, spreadsheet_id, [row[0] for row in rows])
+    metricas.bets_written.inc(len(rows))
+
+
+# Função para conciliar uma planilha com o livro local; as linhas que sumiram dela voltam para a compactação.
+# Devolve se a conciliação foi concluída.
+async def _reconcile_ledger_sheet(spreadsheet_id, rows):
+    linhas = [(bet_ledger.row_id(row[0]), row[0], row[1], _ledger_bet(row[2:])) for row in rows]
+    try:
+        with span("conciliar_planilha", planilha=spreadsheet_id, apostas=len(linhas)):
+            faltando, editadas, copias = await run_sheet_io(spreadsheet_id, reconcile_sheet, spreadsheet_id, linhas)
+    except Exception as e:
+        logger.error("Erro ao conciliar a planilha {} com o livro: {}", spreadsheet_id, e)
+        await asyncio.to_thread(bet_ledger.mark_failed, spreadsheet_id, e, not is_quota_error(e))
+        return False
+
+    if faltando:
+        await asyncio.to_thread(bet_ledger.mark_missing, faltando)
+    await asyncio.to_thread(bet_ledger.mark_reconciled, spreadsheet_id)
+    if faltando or editadas or copias:
+        metricas.ledger_repairs.inc(len(faltando), tipo="apagada")
+        metricas.ledger_repairs.inc(editadas, tipo="editada")
+        metricas.ledger_repairs.inc(copias, tipo="copia")
+        logger.info("Planilha {} conciliada com o livro: {} linha(s) apagada(s), {} editada(s), {} cópia(s)",
+                    spreadsheet_id, len(faltando), editadas, copias)
+    return True
+
+
+# Tarefa em segundo plano do modo "local": a cada LEDGER_COMPACT_INTERVAL compacta o livro nas planilhas, uma
+# escrita por planilha com tudo o que acumulou, e concilia as planilhas que passaram do LEDGER_RECONCILE_INTERVAL
+async def ledger_compactor(application):
+    while True:
+        try:
+            if sheets_scheduler.has_budget():
+                skip = set(_ledger_tasks) | sheets_scheduler.throttled_sheets()
+                lotes = await asyncio.to_thread(bet_ledger.due_batches, LEDGER_COMPACT_BATCH, skip)
+                skip |= {spreadsheet_id for spreadsheet_id, _, _ in lotes}
+                conciliacoes = await asyncio.to_thread(
+                    bet_ledger.due_reconciliations, LEDGER_RECONCILE_BATCH, LEDGER_RECONCILE_INTERVAL, skip)
             else:
-                mercado = f"Under {mercado.split(' ')[-1]}"  # Caso contrário, apenas "Under"
-        # Verificar se a linha de mercado contém "Player Props" e extrair o mercado entre parênteses
-        if "Player Props" in mercado_line:
-            player_props_match = re.search(r"Player Props - (.+?) \((.+?)\)", mercado_line)
-            if player_props_match:
-                market_in_parentheses = player_props_match.group(2).strip()
-                # Combinar com "Mais" ou "Menos" se estiver presente na descrição
-                if "Mais" in description_text:
-                    mercado = f"Mais {market_in_parentheses}"
-                elif "Menos" in description_text:
-                    mercado = f"Menos {market_in_parentheses}"
-
-    # Verificar se há "Total de Cantos Asiáticos" na mensagem
-    cantos_asiaticos_match = re.search(r"Total de Cantos Asiáticos", message)
-    if cantos_asiaticos_match:
-        # Capturar a linha de apostas
-        apostas_match = re.search(r"Aposta: (.+?) @", message)
-        if apostas_match:
-            apostas_text = apostas_match.group(1).strip()
-            # Combina "Cantos asiáticos" com a linha de apostas
-            description_text = f"{apostas_text} Cantos asiáticos"
-            if "Cantos" in message:
-                mercado = mercado + "Cantos"
-
-    # Verificar se há "Total de Cartões Asiáticos" na mensagem
-    cartoes_asiaticos_match = re.search(r"Total de Cartões Asiáticos", message)
-    if cartoes_asiaticos_match:
-        # Capturar a linha de apostas
-        apostas_match = re.search(r"Aposta: (.+?) @", message)
-        if apostas_match:
-            apostas_text = apostas_match.group(1).strip()
-            # Combina "Cartões asiáticos" com a linha de apostas
-            description_text = f"{apostas_text} Cartões asiáticos"
-            if "Cartões Asiáticos" in message:
-                mercado = mercado + "Cartões asiáticos"
-
-    # Verificar se há "Handicap Asiático" na mensagem
-    handicap_asiatico_match = re.search(r"Handicap Asiático", message)
-    if handicap_asiatico_match:
-        # Capturar a linha de apostas
-        apostas_match = re.search(r"Aposta: (.+?) @", message)
-        if apostas_match:
-            apostas_text = apostas_match.group(1).strip()
-            # Combina "Handicap asiático" com a linha de apostas
-            description_text = f"{apostas_text} Handicap Asiático"
-
-    # Verificar se há "Handicap Asiático" e "Cantos" na mensagem
-    handicap_asiatico_cantos_match = re.search(r"Handicap Asiático - Cantos", message)
-    if handicap_asiatico_cantos_match:
-        # Capturar a linha de apostas
-        apostas_match = re.search(r"Aposta: (.+?) @", message)
-        if apostas_match:
-            apostas_text = apostas_match.group(1).strip()
-            # Combina "Handicap Asiático - Cantos" com a linha de apostas
-            description_text = f"{apostas_text} Handicap Asiático - Cantos"
-            if "Handicap Asiático - Cantos" in message:
-                mercado = mercado + "Handicap Asiático - Cantos"
-
-    # Verificar se há "Map Handicap" na mensagem
-    second_map_handicap_match = re.search(r"2nd Map Handicap", message)
-    if second_map_handicap_match:
-        # Capturar a linha de apostas
-        apostas_match = re.search(r"Aposta: (.+?) @", message)
-        if apostas_match:
-            apostas_text = apostas_match.group(1).strip()
-            # Combina "Map Handicap" com a linha de apostas
-            description_text = f"{apostas_text} 2nd Map Handicap"
-    if not description_text:  # Verifica se já foi atribuída uma descrição
-        map_handicap_match = re.search(r"Map Handicap", message)
-        if map_handicap_match:
-            # Capturar a linha de apostas
-            apostas_match = re.search(r"Aposta: (.+?) @", message)
-            if apostas_match:
-                apostas_text = apostas_match.group(1).strip()
-                # Combina "Map Handicap" com a linha de apostas
-                description_text = f"{apostas_text} Map Handicap"
-
-    # Adicionar "Maps" ao final da descrição da aposta
-    if "Total Maps" in message:
-        description_text = description_text + " Maps"
-
-    if "1st Map Total Kills" in message:
-        description_text = description_text + " 1st Map Kills"
-
-    if "1st Map Total Kills" in message:
-        mercado = mercado + " 1st Map"
-
-    if "1st Map Moneyline" in message:
-        description_text = description_text + " ML 1st Map"
-
-    if "2nd Map Moneyline" in message:
-        description_text = description_text + " ML 2nd Map"
-
-    second_map_total_kills_match = re.search(r"2nd Map Total Kills", message)
-    if second_map_total_kills_match:
-        # Capturar a linha de apostas
-        apostas_match = re.search(r"Aposta: (.+?) @", message)
-        if apostas_match:
-            apostas_text = apostas_match.group(1).strip()
-            # Combina "2nd Map Total Kills" com a linha de apostas
-            description_text = f"{apostas_text} Kills 2nd Map"
-            mercado = mercado + " 2nd Map"
-
-    # Verificar se há "1ª Parte - Handicap Asiático" na mensagem
-    primeira_parte_handicap_match = re.search(r"1ª Parte - Handicap Asiático", message)
-    if primeira_parte_handicap_match:
-        # Capturar a linha de apostas
-        apostas_match = re.search(r"Aposta: (.+?) @", message)
-        if apostas_match:
-            apostas_text = apostas_match.group(1).strip()
-            # Combina "1ª Parte - Handicap Asiático" com a linha de apostas
-            description_text = f"{apostas_text} 1ª Parte Handicap Asiático"
-
-    # Verificar se há "1ª Parte - Golos" na mensagem
-    primeira_parte_golos_match = re.search(r"1ª Parte - Golos", message)
-    if primeira_parte_golos_match:
-        # Capturar a linha de apostas
-        apostas_match = re.search(r"Aposta: (.+?) @", message)
-        if apostas_match:
-            apostas_text = apostas_match.group(1).strip()
-            # Combina "1ª Parte - Golos" com a linha de apostas
-            description_text = f"{apostas_text} Golos 1ª Parte "
-    else:
-        # Verificar se há "Golos" na mensagem (apenas se "1ª Parte - Golos" não foi encontrado)
-        golos_match = re.search(r"Golos", message)
-        if golos_match:
-            # Capturar a linha de apostas
-            apostas_match = re.search(r"Aposta: (.+?) @", message)
-            if apostas_match:
-                apostas_text = apostas_match.group(1).strip()
-                # Combina "Golos" com a linha de apostas
-                description_text = f"{apostas_text} Golos"
-
-    # Capturar Player Props
-    player_props_match = re.search(r"Player Props - (.+?) \((.+?)\) \((\d+(\.\d+)?)\)", message)
-    if player_props_match:
-        player_name = player_props_match.group(1).strip()
-        stat_type = player_props_match.group(2).strip()
-        stat_value = player_props_match.group(3).strip()
-        description_text = f"{player_name} {description_text} {stat_type}"  # Combine com a descrição da aposta
-        description_text = f"{description_text}"  # Adiciona o valor da estatística
-
-    # Verificar se o mercado é de "Player Props" e ajustar o esporte
-    if "player props" in mercado_line.lower():
-        if sport_emoji:
-            # Diferenciar o esporte com base no emoji
-            match sport_emoji.group(1):
-                case "\U0001F3C0":  # Emoji de basquete
-                    sport = "Props NBA"
-                case "\U0001F3D2":  # Emoji de hóquei
-                    sport = "Hóquei"
-                case "\U000026BE":  # Emoji de beisebol
-                    sport = "Beisebol"
-                case "\U0001F3C8":  # Emoji de beisebol
-                    sport = "Futebol Americano"
-    else:
-        # Caso não seja "Player Props", ajustar normalmente o esporte pelo emoji
-        if sport_emoji:
-            match sport_emoji.group(1):
-                case "\U0001F3C0":
-                    sport = "NBA" if "NBA" in message else "Basquete"
-                case "\U0001F3D2":
-                    sport = "Hóquei"
-                case "\U000026BE":
-                    sport = "Beisebol"
-                case "\U000026BD" | "\U0001F6A9" | "\U0001F7E8":
-                    sport = "Futebol"
-                case "\U0001F3BE":
-                    sport = "Tênis"
-                case "\U0001F3C8":
-                    sport = "Futebol Americano"
-                case "\U0001F3AE":
-                    sport = "eSports"
-                case "\U0001F3D0":
-                    sport = "Vôlei"
-                case "\U0001F93C":
-                    sport = "Luta"
-                case "\U0001F93E":
-                    sport = "Handebol"
-                case "\U0001F3CC":
-                    sport = "Golfe"
-
-    # Substituir "Golos" por "Gols" ou "Pontos" dependendo do esporte
-    if "Golos" in description_text:
-        if sport == "Futebol":
-            description_text = description_text.replace("Golos", "Gols")
-        elif sport in ["Basquete", "NBA"]:
-            description_text = description_text.replace("Golos", "Pontos")
-        elif sport == "Tênis":
-            description_text = description_text.replace("Golos", "Games")  # Substituir por "Games" se for Tênis
-
-    # Substituir "Golos" por "Games" se o esporte for Tênis
-    if "Golos" in mercado:
-        if sport == "Futebol":
-            mercado = mercado.replace("Golos", "Gols")
-        elif sport in ["Basquete", "NBA"]:
-            mercado = mercado.replace("Golos", "Pontos")
-        elif sport == "Tênis":
-            mercado = mercado.replace("Golos", "Games")  # Substituir por "Games" se for Tênis
-
-    # Dicionário de traduções
-    translations = {
-        "Rebounds": "Rebotes",
-        "Points": "Pontos",
-        "Golos": "Gols",
-        "Assists": "Assistências",
-        "fouls": "faltas",
-        "Shots On Goal": "SOT",
-        "Receptions": "Recepções",
-        "Passing Yards": "Jardas de Passe",
-        "Rushing Yards": "Jardas de Corrida",
-        "Tackles+Assists": "Desarmes+Assistências",
-        "Receiving Yards": "Jardas de Recepção",
-        "Mais": "Over",
-        "Menos": "Under",
-        "Interceptions": "Interceptações",
-        "longest Reception": "Recepção mais longa",
-        "Pass Attempts": "Tentativas de Passe",
-        "Maps": "Mapas",
-        "Map": "Mapa",
-        "Moneyline": "Resultado Final",
-        "Equipa": "Equipe",
-        # Adicione mais traduções conforme necessário
-    }
-
-    #
-
-    # Função para traduzir a descrição da aposta
-    def translate_description(description: str) -> str:
-        for english_word, portuguese_word in translations.items():
-            description = description.replace(english_word, portuguese_word)
-        return description
-
-    # Função para traduzir o mercado
-    def translate_market_in_parentheses(market_in_parentheses: str) -> str:
-        for english_word, portuguese_word in translations.items():
-            market_in_parentheses = market_in_parentheses.replace(english_word, portuguese_word)
-        return market_in_parentheses
-
-    # Após capturar a descrição da aposta
-    description_text = translate_description(description_text)
-    # Após capturar o mercado
-    mercado = translate_market_in_parentheses(mercado)
-
-    # Formatando a resposta
-    if all([ev_percentage, stake, odds, sport_emoji, date, bookmaker]):
-        ev_percentage = round(float(ev_percentage.group(1)))
-        ev_percentage = ev_percentage / 100
-        # Converte stake e odds para float
-        stake = float(stake.group(1))
-        odds = float(odds.group(1))
-
-        # Formata stake: sem casas decimais se for número inteiro (ex: 1.00 → 1u)
-        if stake.is_integer():
-            stake_str = f"{int(stake)}"  # Retira a casa decimal
-        else:
-            stake_str = f"{str(stake).replace('.', ',')}"  # Troca ponto por vírgula em stake
-
-        # Formata odds: sempre com vírgula
-        odds_str = str(odds).replace('.', ',')
-
-        date_formatted = f"{date.group(3)}-{date.group(2)}-{date.group(1)}"
-        bookmaker = bookmaker.group(1)
-
-        # Construir a mensagem formatada
-        formatted_message = (
-            f"Casa de Aposta: {bookmaker}\n"
-            f"Data: {date_formatted}\n"
-            f"EV%: {ev_percentage}\n"
-            f"Jogo: {game_description}\n"
-            f"Aposta: {description_text}\n"
-            f"Esporte: {sport}\n"
-            f"Mercado: {mercado}\n"  # Adiciona o mercado à resposta
-            f"Odd: {odds}\n"
-            f"Stake: {stake_str}u"
+                await asyncio.to_thread(bet_ledger.renew, set(_ledger_tasks))
+                lotes, conciliacoes = [], []
+        except Exception as e:
+            logger.error("Erro ao ler o livro de apostas: {}", e)
+            lotes, conciliacoes = [], []
+
+        tarefas = [(spreadsheet_id, assumida, _compact_ledger_batch(application, spreadsheet_id, rows))
+                   for spreadsheet_id, rows, assumida in lotes]
+        tarefas += [(spreadsheet_id, assumida, _reconcile_ledger_sheet(spreadsheet_id, rows))
+                    for spreadsheet_id, rows, assumida in conciliacoes]
+        for spreadsheet_id, assumida, corrotina in tarefas:
+            if assumida:
+                # Outro bot gravou nesta planilha desde a última vez: reler a próxima linha livre
+                invalidate_next_free_row(spreadsheet_id)
+            tarefa = asyncio.create_task(corrotina)
+            _ledger_tasks[spreadsheet_id] = tarefa
+            tarefa.add_done_callback(lambda _, sid=spreadsheet_id: _ledger_tasks.pop(sid, None))
+
+        await asyncio.sleep(LEDGER_COMPACT_INTERVAL)
+
+
+# Função para iniciar a tarefa da fila junto com o bot (apostas pendentes de antes de um reinício são reenviadas)
+# e, no modo "local", a do livro
+async def _start_queue_flusher(application):
+    global _queue_flusher_task, _ledger_task
+    # A fila continua rodando no modo "local" para esvaziar o que foi enfileirado antes da troca de modo
+    _queue_flusher_task = asyncio.create_task(queue_flusher(application))
+    if SHEETS_WRITE_MODE == "local":
+        _ledger_task = asyncio.create_task(ledger_compactor(application))
+
+
+# Função para parar as tarefas da fila e do livro, esperando os lotes que já estão sendo enviados
+async def _stop_queue_flusher(application):
+    for tarefa in (_queue_flusher_task, _ledger_task):
+        if tarefa is not None:
+            tarefa.cancel()
+    em_andamento = list(_flushing.values()) + list(_ledger_tasks.values())
+    if em_andamento:
+        await asyncio.wait(em_andamento, timeout=30)
+    await asyncio.to_thread(bet_queue.release)
+    if SHEETS_WRITE_MODE == "local":
+        await asyncio.to_thread(bet_ledger.release)
+
+
+# Tamanho máximo de uma mensagem do Telegram (em caracteres)
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+# Função para juntar vários textos no menor número de mensagens, sem passar do limite do Telegram
+def pack_messages(textos, limite=TELEGRAM_MESSAGE_LIMIT, separador="\n\n"):
+    mensagem = ""
+    for texto in textos:
+        # Um texto maior que o limite (raro) é cortado em pedaços
+        while len(texto) > limite:
+            if mensagem:
+                yield mensagem
+                mensagem = ""
+            yield texto[:limite]
+            texto = texto[limite:]
+        if mensagem and len(mensagem) + len(separador) + len(texto) > limite:
+            yield mensagem
+            mensagem = ""
+        mensagem = f"{mensagem}{separador}{texto}" if mensagem else texto
+    if mensagem:
+        yield mensagem
+
+
+# Camada de envio das mensagens do bot: junta os textos no menor número de mensagens, respeita o intervalo
+# entre mensagens de cada chat e o total por segundo, e reenvia quando o Telegram pede para esperar (RetryAfter)
+class OutboundMessages:
+    def __init__(self, chat_interval, per_second, retries):
+        self._chat_interval = chat_interval
+        self._global_interval = 1 / per_second
+        self._retries = retries
+        self._next_global = 0.0
+        self._next_by_chat = {}  # chat_id -> instante a partir do qual o chat pode receber outra mensagem
+        self._chat_locks = {}  # chat_id -> [trava, envios aguardando ou em andamento]
+        self.stats = {"mensagens": 0, "retry_after": 0, "falhas_rede": 0}
+
+    # Enviar os textos para o chat, na ordem, no menor número de mensagens possível
+    async def send(self, bot, chat_id, textos, **kwargs):
+        # Os envios de um mesmo chat são feitos um de cada vez, para as mensagens chegarem na ordem
+        entrada = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                for texto in pack_messages(textos):
+                    await self._send_one(bot, chat_id, texto, **kwargs)
+        finally:
+            entrada[1] -= 1
+            if not entrada[1]:
+                del self._chat_locks[chat_id]
+
+    async def _send_one(self, bot, chat_id, texto, **kwargs):
+        from telegram.error import NetworkError, RetryAfter
+
+        for tentativa in range(self._retries + 1):
+            await self._wait_turn(chat_id)
+            try:
+                resultado = await bot.send_message(chat_id, texto, **kwargs)
+                self.stats["mensagens"] += 1
+                return resultado
+            except RetryAfter as e:
+                # O Telegram informa quanto esperar: nada é enviado para este chat antes disso
+                self.stats["retry_after"] += 1
+                espera = e.retry_after
+                espera = espera.total_seconds() if isinstance(espera, datetime.timedelta) else float(espera)
+                self._next_by_chat[chat_id] = time.monotonic() + espera
+                erro = e
+            except NetworkError as e:  # Inclui TimedOut
+                self.stats["falhas_rede"] += 1
+                self._next_by_chat[chat_id] = time.monotonic() + min(2 ** tentativa, 30)
+                erro = e
+            logger.warning("Envio para o chat {} recusado ({}); tentativa {} de {}",
+                           chat_id, erro, tentativa + 1, self._retries + 1)
+        raise erro
+
+    # Aguardar a vez do chat e a vez geral; as vagas são reservadas antes de esperar (ordem de chegada)
+    async def _wait_turn(self, chat_id):
+        agora = time.monotonic()
+        if len(self._next_by_chat) > 4096:
+            # Esquecer os chats que já podem receber mensagens (o padrão para um chat ausente)
+            self._next_by_chat = {chat: vez for chat, vez in self._next_by_chat.items() if vez > agora}
+        vez = max(agora, self._next_by_chat.get(chat_id, 0.0), self._next_global)
+        self._next_global = max(self._next_global, vez) + self._global_interval
+        self._next_by_chat[chat_id] = vez + self._chat_interval
+        if vez > agora:
+            await asyncio.sleep(vez - agora)
+
+
+# Camada de envio compartilhada por todas as respostas do bot
+outbound = OutboundMessages(TELEGRAM_CHAT_INTERVAL, TELEGRAM_MESSAGES_PER_SECOND, TELEGRAM_SEND_RETRIES)
+
+
+# Função para responder no chat de uma atualização pela camada de envio (vários textos viram o mínimo de mensagens)
+async def reply(update, *textos, **kwargs):
+    await outbound.send(update.get_bot(), update.effective_chat.id, textos, **kwargs)
+
+
+# Função para formatar um número com vírgula decimal, como nas respostas das apostas
+def _format_number(valor, casas=2):
+    return f"{valor:.{casas}f}".replace('.', ',')
+
+
+# Função para montar o texto do /stats a partir dos agregados do usuário
+def format_stats(resumo, top=STATS_TOP):
+    total = resumo["total"][0]
+    linhas = [
+        "📊 <b>Suas estatísticas</b>",
+        f"Apostas: {total['apostas']}",
+        f"Stake total: {_format_number(total['stake'])}u",
+        f"EV% médio: {_format_number(total['ev_medio'] * 100)}%",
+        f"Odd média: {_format_number(total['odd_media'])}",
+        f"Lucro esperado: {_format_number(total['lucro_esperado'])}u",
+        f"ROI esperado: {_format_number(total['roi_esperado'] * 100)}%",
+    ]
+    for dimensao, titulo in (("esporte", "Por esporte"), ("mercado", "Por mercado"), ("casa", "Por casa de aposta")):
+        grupos = resumo.get(dimensao, [])
+        if not grupos:
+            continue
+        linhas.append(f"\n<b>{titulo}</b>")
+        for grupo in grupos[:top]:
+            linhas.append(
+                f"{html.escape(grupo['valor'] or '-')}: {grupo['apostas']} aposta(s), "
+                f"{_format_number(grupo['stake'])}u, EV% {_format_number(grupo['ev_medio'] * 100)}%, "
+                f"ROI esperado {_format_number(grupo['roi_esperado'] * 100)}%"
+            )
+        if len(grupos) > top:
+            linhas.append(f"... e mais {len(grupos) - top}")
+    return "\n".join(linhas)
+
+
+# Função para lidar com o comando /stats (responde com os agregados locais, sem ler a planilha)
+async def handle_stats(update: Update, context: CallbackContext) -> None:
+    user_id = str(update.message.from_user.id)
+
+    if not await asyncio.to_thread(user_registry.__contains__, user_id):
+        await reply(
+            update,
+            "Você ainda não registrou uma planilha. Use o comando /registrar seguido do link da sua planilha para começar."
         )
+        return
 
-        formatted_data = {
-            "bookmaker": bookmaker,
-            "date": date_formatted,
-            "ev_percentage": ev_percentage,
-            "game_description": game_description,
-            "bet_description": description_text,
-            "sport": sport,
-            "odds": odds,
-            "stake": stake,
-            "market": mercado
-        }
+    try:
+        with span("estatisticas"):
+            resumo = await asyncio.to_thread(bet_stats.summary, user_id)
+        if "total" not in resumo:
+            await reply(update, "Nenhuma aposta registrada na sua planilha até agora.")
+            return
+        await reply(update, format_stats(resumo), parse_mode='HTML')
+    except Exception as e:
+        logger.exception("Erro no comando /stats: {}", e)
+        await reply(update, "Ocorreu um erro ao calcular suas estatísticas. Tente novamente mais tarde.")
 
-        return formatted_message.strip(), formatted_data
-    return None, None
 
+# Descrição de cada regra de roteamento, mostrada pelo /rota
+ROUTING_DESCRIPTIONS = {
+    "unica": f"todas as apostas na aba {SHEET_NAME}",
+    "esporte": f"uma aba por esporte (ex.: {SHEET_NAME} - Futebol)",
+    "mes": f"uma aba por mês do jogo (ex.: {SHEET_NAME} 2024-05)",
+    "ano": "uma planilha por ano (registre com /rota ano 2025 link-da-planilha)",
+}
 
-# Dicionário para armazenar o estado de cada usuário (se está em modo de registrar apostas)
-user_state = {}
+
+# Função para lidar com o comando /rota (para onde vão as apostas do usuário)
+async def handle_rota(update: Update, context: CallbackContext) -> None:
+    user_id = str(update.message.from_user.id)
+
+    if not await asyncio.to_thread(user_registry.__contains__, user_id):
+        await reply(
+            update,
+            "Você ainda não registrou uma planilha. Use o comando /registrar seguido do link da sua planilha para começar."
+        )
+        return
+
+    args = context.args or []
+    try:
+        if not args:
+            modo, planilhas_por_ano = await asyncio.to_thread(user_routes.get, user_id)
+            opcoes = "\n".join(f"/rota {nome} - {descricao}" for nome, descricao in ROUTING_DESCRIPTIONS.items())
+            anos = "".join(f"\nPlanilha de {ano}: {planilhas_por_ano[ano]}" for ano in sorted(planilhas_por_ano))
+            await reply(update, f"Regra atual: {ROUTING_DESCRIPTIONS[modo]}.{anos}\n\nOpções:\n{opcoes}")
+            return
+
+        modo = args[0].lower()
+        if modo == "ano" and len(args) >= 3:
+            ano, sheet_link = args[1], args[2]
+            if not (ano.isdigit() and len(ano) == 4):
+                await reply(update, "Informe o ano com 4 dígitos. Exemplo: /rota ano 2025 link-da-planilha")
+                return
+            if "docs.google.com/spreadsheets" not in sheet_link or "/d/" not in sheet_link:
+                await reply(
+                    update,
+                    "O link fornecido não parece ser de uma planilha do Google Sheets. Tente novamente.")
+                return
+            await asyncio.to_thread(user_routes.set_year_spreadsheet, user_id, ano, extract_spreadsheet_id(sheet_link))
+            await reply(update, f"As apostas de {ano} serão registradas na planilha informada. "
+                                "Lembre-se de adicionar o bot como editor dela.")
+            return
+
+        if modo not in ROUTING_MODES:
+            await reply(update, "Regra desconhecida. Use /rota para ver as opções.")
+            return
+        await asyncio.to_thread(user_routes.set_mode, user_id, modo)
+        await reply(update, f"Pronto! Agora as apostas vão para: {ROUTING_DESCRIPTIONS[modo]}.")
+    except Exception as e:
+        logger.exception("Erro no comando /rota: {}", e)
+        await reply(update, "Ocorreu um erro ao alterar a regra das suas apostas. Tente novamente mais tarde.")
 
 
 # Função para lidar com o comando /registrar
@@ -471,8 +2095,9 @@ async def handle_registrar(update: Update, context: CallbackContext) -> None:
     user_id = str(update.message.from_user.id)  # Converte o ID para string para compatibilidade no JSON
 
     # Verificar se o usuário já registrou uma planilha
-    if user_id in user_sheets:
-        await update.message.reply_text(
+    if await asyncio.to_thread(user_registry.__contains__, user_id):
+        await reply(
+            update,
             "Você já registrou uma planilha. Não é necessário registrar novamente. "
             "Se precisar alterar a planilha, entre em contato com o administrador."
         )
@@ -481,41 +2106,45 @@ async def handle_registrar(update: Update, context: CallbackContext) -> None:
     try:
         # Verificar se o usuário forneceu um link
         if not context.args:
-            await update.message.reply_text("Por favor, envie o link da sua planilha após o comando /registrar.")
+            await reply(update, "Por favor, envie o link da sua planilha após o comando /registrar.")
             return
 
         # Obter o link da planilha
         sheet_link = context.args[0]
 
         # Validar o link (opcional, mas recomendado)
-        if "docs.google.com/spreadsheets" not in sheet_link:
-            await update.message.reply_text(
+        if "docs.google.com/spreadsheets" not in sheet_link or "/d/" not in sheet_link:
+            await reply(
+                update,
                 "O link fornecido não parece ser de uma planilha do Google Sheets. Tente novamente.")
             return
 
         # Registrar o link da planilha para o usuário
-        user_sheets[user_id] = sheet_link
-        save_user_sheets(user_sheets)
+        await asyncio.to_thread(user_registry.register, user_id, sheet_link)
 
-        await update.message.reply_text(
+        await reply(
+            update,
             "Sua planilha foi registrada com sucesso. Agora você pode usar o comando /apostas para registrar suas apostas.")
     except Exception as e:
-        print(f"Erro no comando /registrar: {e}")
-        await update.message.reply_text("Ocorreu um erro ao registrar sua planilha. Tente novamente mais tarde.")
+        logger.exception("Erro no comando /registrar: {}", e)
+        await reply(update, "Ocorreu um erro ao registrar sua planilha. Tente novamente mais tarde.")
 
 
 async def handle_apostas(update: Update, context: CallbackContext) -> None:
     user_id = str(update.message.from_user.id)
 
-    if user_id not in user_sheets:
-        await update.message.reply_text(
+    # O registro e o estado ficam em SQLite: consultados fora do loop de eventos
+    if not await asyncio.to_thread(user_registry.__contains__, user_id):
+        await reply(
+            update,
             "Você ainda não registrou uma planilha. Use o comando /registrar seguido do link da sua planilha para começar."
         )
         return
 
-    user_state[user_id] = "registrando_apostas"
+    await asyncio.to_thread(user_state.set, user_id, "registrando_apostas")
 
-    await update.message.reply_text(
+    await reply(
+        update,
         "Agora você pode começar a enviar suas apostas para serem registradas na sua planilha."
     )
 
@@ -526,15 +2155,20 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
     # Saudações
     saudacoes = ["oi", "olá", "hello", "hi", "bem vindo", "ola", "oi oi"]
     if message.lower() in saudacoes:
-        await update.message.reply_text("Olá, seja bem-vindo! Aqui está nossa lista de comandos:\n"
-                                        "/help - Ver a lista de comandos\n"
-                                        "/apostas - Registrar apostas\n")
+        await reply(update, "Olá, seja bem-vindo! Aqui está nossa lista de comandos:\n"
+                            "/help - Ver a lista de comandos\n"
+                            "/apostas - Registrar apostas\n"
+                            "/stats - Ver suas estatísticas\n"
+                            "/rota - Escolher em qual aba ou planilha cada aposta é registrada\n")
         return
 
     if message.lower() == "/help":
-        await update.message.reply_text(
+        await reply(
+            update,
             "/help - Ver a lista de comandos\n"
             "/apostas - Registrar apostas\n"
+            "/stats - Ver suas estatísticas\n"
+            "/rota - Escolher em qual aba ou planilha cada aposta é registrada\n"
         )
         return
 
@@ -542,44 +2176,85 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
         await handle_apostas(update, context)
         return
 
-    if user_state.get(user_id) != "registrando_apostas":
-        await update.message.reply_text("Digite ou selecione o comando /apostas para começar a registrar suas apostas.")
+    if await asyncio.to_thread(user_state.get, user_id) != "registrando_apostas":
+        await reply(update, "Digite ou selecione o comando /apostas para começar a registrar suas apostas.")
         return
 
     try:
-        # Divide a mensagem se tiver múltiplas apostas separadas por dois \n\n
-        apostas = [ap.strip() for ap in message.strip().split("\n\n\n") if ap.strip()]
+        # Interpretar e validar todas as apostas da mensagem (separadas por "\n\n\n") antes de qualquer escrita;
+        # as válidas seguem mesmo que alguma outra esteja no formato incorreto
         respostas = []
-
-        for aposta in apostas:
-            formatted_message, formatted_data = process_message(aposta)
-            if formatted_message:
-                formatted_data['user_id'] = user_id
-                insert_data_to_sheet(formatted_data)
+        dados = []
+        invalidas = []
+        with span("interpretar") as etapa:
+            for numero, formatted_message, formatted_data in parse_bets(message):
+                if not formatted_message:
+                    invalidas.append(numero)
+                    continue
+                # Os dados vêm do cache do parser (somente leitura): o user_id vai numa cópia
+                dados.append(dict(formatted_data, user_id=user_id))
                 respostas.append(formatted_message)
-            else:
-                await update.message.reply_text(
-                    "Uma das mensagens está no formato incorreto. Verifique e tente novamente.")
-                return
-
-        # Enviar cada aposta formatada
-        for resposta in respostas:
-            await update.message.reply_text(resposta)
+            etapa["apostas"] = len(dados) + len(invalidas)
+        metricas.bets_parsed.inc(len(dados))
+        metricas.bets_failed.inc(len(invalidas), motivo="formato")
+
+        if not dados:
+            await reply(
+                update,
+                "Uma das mensagens está no formato incorreto. Verifique e tente novamente." if len(invalidas) <= 1
+                else "Nenhuma das apostas está no formato correto. Verifique e tente novamente.")
+            return
 
-        # Mensagem final
-        if len(respostas) > 1:
-            await update.message.reply_text("Apostas registradas com sucesso.")
-        else:
-            await update.message.reply_text("Aposta registrada com sucesso.")
+        # Descartar as apostas que o usuário já enviou antes, sem nenhuma chamada ao Google
+        with span("duplicatas"):
+            novas = await asyncio.to_thread(dedup_index.filter_new, user_id, dados)
+        repetidas = novas.count(False)
+        dados = [data for data, nova in zip(dados, novas) if nova]
+        respostas = [resposta for resposta, nova in zip(respostas, novas) if nova]
+
+        # Colocar todas as apostas válidas na fila persistente de uma vez; a gravação acontece em segundo plano
+        if dados:
+            try:
+                spreadsheet_id = await asyncio.to_thread(get_user_spreadsheet_id, user_id)
+                # Cada aposta vai para a planilha e a aba escolhidas pela regra de roteamento do usuário
+                rota = await asyncio.to_thread(user_routes.get, user_id)
+                destinos = [(*route_bet(rota, spreadsheet_id, data), data) for data in dados]
+                if SHEETS_WRITE_MODE == "local":
+                    with span("guardar_livro", apostas=len(dados)):
+                        await asyncio.to_thread(bet_ledger.append, user_id, update.effective_chat.id, destinos)
+                else:
+                    with span("enfileirar", apostas=len(dados)):
+                        await asyncio.to_thread(bet_queue.enqueue, user_id, update.effective_chat.id, destinos)
+            except Exception:
+                # Nada foi guardado: esquecer as apostas para o usuário poder reenviá-las, como pede a resposta de erro
+                await asyncio.to_thread(dedup_index.forget, user_id, dados)
+                raise
+            if SHEETS_WRITE_MODE == "local":
+                # O livro é a fonte da verdade: a aposta já está registrada e entra nas estatísticas agora
+                await asyncio.to_thread(record_bet_stats, user_id, dados)
+
+        # Uma única resposta com as apostas formatadas e o resultado de cada uma
+        resumo = []
+        if len(dados) > 1:
+            resumo.append(f"{len(dados)} apostas recebidas com sucesso. Elas serão registradas na sua planilha em instantes.")
+        elif dados:
+            resumo.append("Aposta recebida com sucesso. Ela será registrada na sua planilha em instantes.")
+        if repetidas:
+            resumo.append(f"{repetidas} aposta(s) já tinha(m) sido enviada(s) antes e foi(ram) ignorada(s).")
+        if invalidas:
+            numeros = ", ".join(map(str, invalidas))
+            resumo.append(f"Aposta(s) nº {numeros} no formato incorreto e não registrada(s). Verifique e envie novamente.")
+        await reply(update, *respostas, "\n".join(resumo))
 
     except Exception as e:
-        print(f"Erro ao processar a mensagem: {e}")
-        await update.message.reply_text("Ocorreu um erro ao registrar sua aposta. Tente novamente mais tarde.")
+        logger.exception("Erro ao processar a mensagem: {}", e)
+        await reply(update, "Ocorreu um erro ao registrar sua aposta. Tente novamente mais tarde.")
 
 
 # Função para configurar o comando /start
 async def start(update: Update, context: CallbackContext) -> None:
-    await update.message.reply_text(
+    await reply(
+        update,
         "Olá! 👋 Seja bem-vindo.\n\n"
         "Aqui você pode enviar suas apostas do <b>EV+ Scanner</b> diretamente para a sua <b>planilha no Google Sheets</b> 📊\n\n"
         "Antes de começar, você precisa registrar sua planilha e adicionar o nosso bot como editor.\n\n"
@@ -597,18 +2272,112 @@ async def start(update: Update, context: CallbackContext) -> None:
 
 
 # Função principal que configura o bot
+# Servidor HTTP do modo worker: as atualizações repassadas pelo roteador.py vão direto para a fila do
+# Application (sem Updater, portanto sem setWebhook); roda até o processo receber SIGINT ou SIGTERM
+async def run_worker(application):
+    from telegram import Update
+    from tornado.httpserver import HTTPServer
+    from tornado.web import Application as WebApplication, RequestHandler
+
+    class WorkerHandler(RequestHandler):
+        async def post(self):
+            if WEBHOOK_SECRET and self.request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+                self.set_status(403)
+                return
+            try:
+                update = Update.de_json(json.loads(self.request.body), application.bot)
+            except ValueError:
+                self.set_status(400)
+                return
+            await application.update_queue.put(update)
+
+    parar = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sinal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sinal, parar.set)
+
+    # Mesma sequência do run_webhook do PTB: post_init depois do initialize, post_stop depois do stop
+    await application.initialize()
+    try:
+        await application.post_init(application)
+        await application.start()
+        servidor = HTTPServer(WebApplication([(rf"/{WEBHOOK_PATH}/?", WorkerHandler)]))
+        servidor.listen(WEBHOOK_PORT, address=WEBHOOK_LISTEN)
+        logger.info("Recebendo as atualizações do roteador em {}:{}/{}", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        try:
+            await parar.wait()
+        finally:
+            servidor.stop()
+            await application.stop()
+            await application.post_stop(application)
+    finally:
+        await application.shutdown()
+
+
 def main():
-    application = Application.builder().token(API_TOKEN).build()
+    # Verificar se o token foi carregado corretamente
+    if not API_TOKEN:
+        raise ValueError("O token da API ('API_TOKEN') não foi encontrado no arquivo .env.")
+    if SHEETS_WRITE_MODE not in ("fila", "local"):
+        raise ValueError(f"SHEETS_WRITE_MODE inválido: {SHEETS_WRITE_MODE!r} (use 'fila' ou 'local').")
+    if BOT_MODE not in ("polling", "webhook", "worker"):
+        raise ValueError(f"BOT_MODE inválido: {BOT_MODE!r} (use 'polling', 'webhook' ou 'worker').")
+    # Sem a URL o PTB registraria no Telegram o endereço local do servidor (http://WEBHOOK_LISTEN:WEBHOOK_PORT)
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL é obrigatória no modo webhook (atrás do roteador.py, use BOT_MODE=worker).")
+
+    from telegram.ext import Application, MessageHandler, filters, CommandHandler
+    from processador import UserOrderedUpdateProcessor
+
+    metricas.configure_logging()
+    if metricas.METRICS_PORT:
+        metricas.start_metrics_server()
+    if metricas.METRICS_DUMP_INTERVAL:
+        metricas.start_periodic_dump()
+
+    builder = (
+        Application.builder()
+        .token(API_TOKEN)
+        .concurrent_updates(UserOrderedUpdateProcessor(BOT_CONCURRENT_UPDATES))
+        # Uma conexão por atualização simultânea; com o padrão (1) as respostas ficam na fila do pool HTTP
+        .connection_pool_size(BOT_CONCURRENT_UPDATES)
+        .post_init(_start_queue_flusher)
+        .post_stop(_stop_queue_flusher)
+    )
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(f"{TELEGRAM_BASE_URL.rstrip('/')}/bot")
+    if BOT_MODE == "worker":
+        builder = builder.updater(None)  # Quem recebe do Telegram é o roteador
+    application = builder.build()
 
     # Adicionar os handlers
     application.add_handler(CommandHandler("registrar", handle_registrar))
     application.add_handler(CommandHandler("apostas", handle_apostas))
+    application.add_handler(CommandHandler("stats", handle_stats))
+    application.add_handler(CommandHandler("rota", handle_rota))
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", handle_message))
 
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-    application.run_polling()
+    try:
+        if BOT_MODE == "webhook":
+            # Servidor HTTP assíncrono local recebendo as atualizações enviadas pelo Telegram (via proxy reverso)
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            )
+        elif BOT_MODE == "worker":
+            asyncio.run(run_worker(application))
+        else:
+            application.run_polling()
+    finally:
+        # Esperar as escritas que ainda estão no pool antes de encerrar
+        _sheets_executor.shutdown(wait=True)
+        credential_manager.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+# Credenciais da conta de serviço do Google: o arquivo é lido uma única vez e o token de acesso é renovado
+# numa thread em segundo plano antes de expirar, para nenhuma requisição à planilha esperar pela renovação
+import datetime
+import functools
+import math
+import os
+import threading
+
+from dotenv import load_dotenv
+from loguru import logger
+
+import metricas
+
+# Carregar as variáveis de ambiente do arquivo .env (antes de ler as configurações abaixo)
+load_dotenv()
+
+# Arquivo JSON da conta de serviço
+GOOGLE_CREDENTIALS_FILE = os.getenv("GOOGLE_CREDENTIALS_FILE", "credenciais.json")
+# Com quantos segundos de antecedência o token é renovado em segundo plano (o google-auth só renova,
+# durante a própria requisição, quando faltam menos de 3min45s)
+GOOGLE_TOKEN_REFRESH_MARGIN = float(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN", "600"))
+# Espera máxima (em segundos) entre novas tentativas quando a renovação falha
+GOOGLE_TOKEN_RETRY_MAX = float(os.getenv("GOOGLE_TOKEN_RETRY_MAX", "60"))
+
+# Abaixo desta validade restante (em segundos) o token não é mais entregue e a renovação acontece na hora
+TOKEN_MIN_VALIDITY = 30
+
+
+# Função para calcular quantos segundos faltam para um token expirar (o google-auth usa UTC sem fuso)
+def _seconds_left(token, expiry):
+    if not token:
+        return 0
+    if expiry is None:
+        return math.inf
+    agora = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return (expiry - agora).total_seconds()
+
+
+# Gerenciador compartilhado entre as threads do pool: uma única renovação por vez e leitura do token sem lock
+class CredentialManager:
+    def __init__(self, path, scopes, margin=GOOGLE_TOKEN_REFRESH_MARGIN, retry_max=GOOGLE_TOKEN_RETRY_MAX):
+        self._path = path
+        self._scopes = scopes
+        self._margin = margin
+        self._retry_max = retry_max
+        self._lock = threading.Lock()
+        self._credentials = None
+        self._request = None
+        self._state = (None, None)  # (token, expiração) publicados juntos a cada renovação
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"renovacoes": 0, "renovacoes_na_hora": 0, "falhas": 0}
+
+    # Ler o arquivo da conta de serviço (só na primeira vez)
+    def _load(self):
+        if self._credentials is None:
+            from google.auth.transport.requests import Request
+            from google.oauth2.service_account import Credentials
+
+            self._credentials = Credentials.from_service_account_file(self._path, scopes=self._scopes)
+            self._request = Request()
+        return self._credentials
+
+    # Renovar o token se faltarem até min_left segundos para expirar; devolve o token válido
+    def refresh(self, min_left=0, inline=False):
+        with self._lock:
+            token, expiry = self._state
+            if _seconds_left(token, expiry) > min_left:
+                return token  # Outra thread acabou de renovar
+
+            credentials = self._load()
+            try:
+                with metricas.span("renovar_token", na_hora=inline):
+                    credentials.refresh(self._request)
+            except Exception:
+                self.stats["falhas"] += 1
+                metricas.token_refreshes.inc(resultado="erro")
+                raise
+            self._state = (credentials.token, credentials.expiry)
+            self.stats["renovacoes"] += 1
+            if inline:
+                self.stats["renovacoes_na_hora"] += 1
+            metricas.token_refreshes.inc(resultado="ok")
+            return credentials.token
+
+    # Token de acesso válido; só bloqueia se a renovação em segundo plano não chegou a tempo
+    def token(self):
+        token, expiry = self._state
+        if _seconds_left(token, expiry) > TOKEN_MIN_VALIDITY:
+            return token
+        return self.refresh(TOKEN_MIN_VALIDITY, inline=True)
+
+    # Descartar um token recusado pelo Google (401) e obter outro
+    def invalidate(self, token):
+        with self._lock:
+            if self._state[0] == token:
+                self._state = (None, None)
+        return self.token()
+
+    # Credenciais no formato do google-auth, para o gspread usar o token deste gerenciador
+    def credentials(self):
+        return _managed_credentials_class()(self)
+
+    # Iniciar a thread que renova o token antes de ele expirar (a primeira renovação já acontece nela)
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="credenciais", daemon=True)
+            self._thread.start()
+
+    # Parar a thread de renovação
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def _run(self):
+        falhas = 0
+        while not self._stop.is_set():
+            espera = _seconds_left(*self._state) - self._margin
+            if espera > 0:
+                self._stop.wait(min(espera, 3600))
+                continue
+            try:
+                self.refresh(self._margin)
+                falhas = 0
+            except Exception as e:
+                falhas += 1
+                espera = min(2 ** falhas, self._retry_max)
+                logger.warning("Erro ao renovar o token do Google (nova tentativa em {}s): {}", espera, e)
+                self._stop.wait(espera)
+
+
+# Classe (criada só quando o google-auth é carregado) que aplica o token do gerenciador em cada requisição
+@functools.lru_cache
+def _managed_credentials_class():
+    from google.auth import credentials
+
+    class ManagedCredentials(credentials.Credentials):
+        def __init__(self, manager):
+            super().__init__()
+            self._manager = manager
+
+        @property
+        def valid(self):
+            return True
+
+        # Chamado pela sessão autorizada quando o Google recusa o token (401)
+        def refresh(self, request):
+            self.token = self._manager.invalidate(self.token)
+
+        def before_request(self, request, method, url, headers):
+            # O token vai direto para o cabeçalho: a mesma instância é usada por várias threads
+            token = self._manager.token()
+            self.token = token
+            self.apply(headers, token=token)
+
+    return ManagedCredentials
@@ -0,0 +1,448 @@
+# Interpretação das mensagens do EV+ Scanner (sem dependências de rede: pode ser importado por ferramentas e testes)
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+
+from dotenv import load_dotenv
+
+# Carregar as variáveis de ambiente do arquivo .env (antes de ler as configurações abaixo)
+load_dotenv()
+
+# Cache de apostas já interpretadas (o mesmo alerta costuma ser encaminhado por vários usuários em poucos minutos):
+# máximo de entradas (0 desativa) e tempo de vida (em segundos) de cada uma
+PARSE_CACHE_MAX_SIZE = int(os.getenv("PARSE_CACHE_MAX_SIZE", "2048"))
+PARSE_CACHE_TTL = float(os.getenv("PARSE_CACHE_TTL", "900"))
+
+# Arquivo com a tabela de regras de mercado (para incluir um mercado basta acrescentar uma regra nele)
+MARKET_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regras_mercado.json")
+
+# Modos das regras de mercado:
+#   "aposta"    -> descrição = texto da linha "Aposta:" + texto (só se a linha existir)
+#   "se_vazia"  -> igual a "aposta", mas só quando a descrição ainda estiver vazia
+#   "anexar"    -> descrição = descrição + texto
+MARKET_RULE_MODES = ("aposta", "se_vazia", "anexar")
+
+
+# Função para carregar e validar a tabela de regras de mercado. Devolve as regras, na ordem em que são
+# aplicadas, como (marcador, modo, texto da descrição, sufixo do mercado, marcador que anula a regra),
+# e todos os marcadores que o parser precisa encontrar na mensagem
+def load_market_rules(path=MARKET_RULES_FILE):
+    with open(path, "r", encoding="utf-8") as f:
+        tabela = json.load(f)
+
+    erros = []
+    marcadores = []
+    for marcador in tabela.get("marcadores", []):
+        if not isinstance(marcador, str) or not marcador:
+            erros.append(f"marcador inválido: {marcador!r}")
+        else:
+            marcadores.append(marcador)
+
+    regras = []
+    for numero, regra in enumerate(tabela.get("regras", []), 1):
+        desconhecidos = set(regra) - {"marcador", "modo", "texto", "sufixo", "exceto"}
+        if desconhecidos:
+            erros.append(f"regra {numero}: campos desconhecidos {sorted(desconhecidos)}")
+        marcador = regra.get("marcador")
+        if not isinstance(marcador, str) or not marcador:
+            erros.append(f"regra {numero}: 'marcador' é obrigatório")
+            continue
+        if regra.get("modo") not in MARKET_RULE_MODES:
+            erros.append(f"regra {numero} ({marcador}): 'modo' deve ser um de {MARKET_RULE_MODES}")
+        for campo in ("texto", "sufixo"):
+            if not isinstance(regra.get(campo, ""), str):
+                erros.append(f"regra {numero} ({marcador}): '{campo}' deve ser texto")
+        exceto = regra.get("exceto")
+        if exceto is not None and (not isinstance(exceto, str) or not exceto):
+            erros.append(f"regra {numero} ({marcador}): 'exceto' deve ser texto")
+        regras.append((marcador, regra.get("modo"), regra.get("texto", ""), regra.get("sufixo", ""), exceto))
+        marcadores += [m for m in (marcador, exceto) if m]
+
+    if not regras:
+        erros.append("nenhuma regra de mercado definida")
+    if erros:
+        raise ValueError(f"Tabela de regras de mercado inválida ({path}):\n  " + "\n  ".join(erros))
+    return tuple(regras), tuple(dict.fromkeys(marcadores))
+
+
+# Função para completar a lista de marcadores com as junções de marcadores que se sobrepõem
+# (ex.: "Map Handicap" + "Handicap Asiático" -> "Map Handicap Asiático"), para que uma varredura
+# sem sobreposição encontre todos eles
+def _marker_alternatives(markers):
+    alternatives = set(markers)
+    novos = set(markers)
+    while novos:
+        juncoes = set()
+        for x in novos:
+            for y in markers:
+                for size in range(1, min(len(x), len(y))):
+                    if x.endswith(y[:size]) and y not in x:
+                        juncoes.add(x + y[size:])
+        novos = juncoes - alternatives
+        alternatives |= novos
+    # Cada trecho encontrado implica todos os marcadores contidos nele
+    return {alt: frozenset(m for m in markers if m in alt) for alt in alternatives}
+
+
+# Tabela de regras carregada (e validada) uma única vez, na importação
+_MARKET_RULES, _MARKET_MARKERS = load_market_rules()
+_MARKER_IMPLIES = _marker_alternatives(_MARKET_MARKERS)
+
+# Varredura única dos marcadores de mercado (o mais longo vence numa mesma posição). A regex compilada
+# funciona como um autômato de múltiplos padrões; um Aho-Corasick em Python puro medido no corpus foi ~6x mais
+# lento, por percorrer a mensagem caractere a caractere no interpretador
+_MARKERS_RE = re.compile("|".join(map(re.escape, sorted(_MARKER_IMPLIES, key=len, reverse=True))))
+
+# Padrões pré-compilados dos campos rotulados da mensagem
+_EV_RE = re.compile(r"(\d+\.\d+)% aposta de valor")
+_STAKE_RE = re.compile(r"Stake: (\d+\.\d+)u")
+_ODDS_RE = re.compile(r"@ (\d+\.\d+)")
+_SPORT_EMOJI_RE = re.compile(
+    r"([\U0001F3C0\U000026BD\U0001F3BE\U0001F6A9\U0001F7E8\U0001F93D\U0001F3D2\U0001F3C8\U0001F3AE"
+    r"\U0001F3D0\U0001F93E\U000026BE\U0001F3CC])"  # Incluído emoji de beisebol (\U000026BE)
+)
+
+# Esporte de cada emoji (emojis reconhecidos sem esporte aqui ficam como "Desconhecido")
+SPORTS_BY_EMOJI = {
+    "\U0001F3C0": "Basquete",
+    "\U0001F3D2": "Hóquei",
+    "\U000026BE": "Beisebol",
+    "\U000026BD": "Futebol",
+    "\U0001F6A9": "Futebol",
+    "\U0001F7E8": "Futebol",
+    "\U0001F3BE": "Tênis",
+    "\U0001F3C8": "Futebol Americano",
+    "\U0001F3AE": "eSports",
+    "\U0001F3D0": "Vôlei",
+    "\U0001F93C": "Luta",
+    "\U0001F93E": "Handebol",
+    "\U0001F3CC": "Golfe",
+}
+# Basquete com o marcador "NBA" na mensagem
+NBA_EMOJI = "\U0001F3C0"
+# Esporte de cada emoji nos mercados de Player Props
+PLAYER_PROPS_SPORTS_BY_EMOJI = {
+    "\U0001F3C0": "Props NBA",
+    "\U0001F3D2": "Hóquei",
+    "\U000026BE": "Beisebol",
+    "\U0001F3C8": "Futebol Americano",
+}
+# Como "Golos" aparece em cada esporte
+GOLOS_BY_SPORT = {"Futebol": "Gols", "Basquete": "Pontos", "NBA": "Pontos", "Tênis": "Games"}
+_DATE_RE = re.compile(r"(\d{2})\.(\d{2})\.(\d{4})")  # Encontrar a data
+_BOOKMAKER_RE = re.compile(r"na (\w+)")  # Casa de aposta
+_APOSTA_RE = re.compile(r"Aposta: (.+?) @")
+_PLAYER_PROPS_RE = re.compile(r"Player Props - (.+?) \((.+?)\) \((\d+(\.\d+)?)\)")
+
+# Confronto entre duas equipes. O primeiro confronto sempre começa no início de uma linha,
+# então a busca fica ancorada em "^" em vez de recomeçar em cada caractere
+_GAME_RE = re.compile(r"^(.*\s(?:vs|x)\s.*?)(?=\s\d{2}\.\d{2}\.\d{4})", re.MULTILINE)
+
+# Mercado de Player Props na linha de mercado
+_PLAYER_PROPS_LINE_RE = re.compile(r"Player Props - (.+?) \((.+?)\)")
+
+# Dicionário de traduções
+TRANSLATIONS = {
+    "Rebounds": "Rebotes",
+    "Points": "Pontos",
+    "Golos": "Gols",
+    "Assists": "Assistências",
+    "fouls": "faltas",
+    "Shots On Goal": "SOT",
+    "Receptions": "Recepções",
+    "Passing Yards": "Jardas de Passe",
+    "Rushing Yards": "Jardas de Corrida",
+    "Tackles+Assists": "Desarmes+Assistências",
+    "Receiving Yards": "Jardas de Recepção",
+    "Mais": "Over",
+    "Menos": "Under",
+    "Interceptions": "Interceptações",
+    "longest Reception": "Recepção mais longa",
+    "Pass Attempts": "Tentativas de Passe",
+    "Maps": "Mapas",
+    "Map": "Mapa",
+    "Moneyline": "Resultado Final",
+    "Equipa": "Equipe",
+    # Adicione mais traduções conforme necessário
+}
+
+
+# Função para montar uma única regex de tradução equivalente a aplicar as traduções uma após a outra
+def _build_translation_re(translations):
+    items = list(translations.items())
+    alternatives = []
+    replacements = {}
+    for i, (key, value) in enumerate(items):
+        earlier = [k for k, _ in items[:i]]
+        # Uma chave que contém uma chave anterior nunca chega a ser encontrada (ex.: "Tackles+Assists")
+        if any(k in key for k in earlier):
+            continue
+        # Se o fim desta chave é o começo de uma chave anterior, a anterior tem prioridade
+        # (ex.: em "longest Receptions" vale "Receptions", e não "longest Reception")
+        blocked = sorted({
+            k[size:] for k in earlier for size in range(1, min(len(k), len(key)))
+            if key.endswith(k[:size])
+        })
+        pattern = re.escape(key) + "".join(f"(?!{re.escape(rest)})" for rest in blocked)
+        alternatives.append(pattern)
+        # O texto traduzido ainda passa pelas traduções seguintes (ex.: "Maps" -> "Mapas" -> "Mapaas")
+        for later_key, later_value in items[i + 1:]:
+            value = value.replace(later_key, later_value)
+        replacements[key] = value
+    return re.compile("|".join(alternatives)), replacements
+
+
+_TRANSLATION_RE, _TRANSLATION_REPLACEMENTS = _build_translation_re(TRANSLATIONS)
+
+
+# Função para traduzir a descrição da aposta ou o mercado
+def translate(text):
+    return _TRANSLATION_RE.sub(lambda m: _TRANSLATION_REPLACEMENTS[m.group()], text)
+
+
+# Função para varrer a mensagem uma única vez e devolver os marcadores de mercado presentes
+def _scan_markers(message):
+    markers = set()
+    for trecho in _MARKERS_RE.findall(message):
+        markers |= _MARKER_IMPLIES[trecho]
+    return markers
+
+
+# Separador entre as apostas de uma mesma mensagem
+BET_SEPARATOR = "\n\n\n"
+
+
+# Função para separar as apostas de um fluxo de texto (pedaços de um arquivo ou uma mensagem inteira),
+# uma de cada vez, sem montar a lista de todas elas
+def split_bets(chunks):
+    resto = ""
+    for chunk in chunks:
+        partes = (resto + chunk).split(BET_SEPARATOR)
+        resto = partes.pop()
+        for parte in partes:
+            parte = parte.strip()
+            if parte:
+                yield parte
+    resto = resto.strip()
+    if resto:
+        yield resto
+
+
+# Função para padronizar o texto de uma aposta: sem espaços nas pontas e com os espaços de cada linha reduzidos a um
+# só (o mesmo alerta encaminhado ou copiado de outro jeito cai na mesma entrada do cache). As quebras de linha são
+# mantidas: o parser localiza o mercado pela posição da linha.
+def normalize_bet(aposta):
+    return "\n".join(" ".join(linha.split()) for linha in aposta.strip().splitlines())
+
+
+# Cache de apostas interpretadas: digest do texto padronizado -> ((mensagem formatada, dados), momento da
+# interpretação)
+_parse_cache = OrderedDict()
+_parse_cache_lock = threading.Lock()
+
+# Contadores do cache de apostas interpretadas
+parse_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+# Função para interpretar uma aposta, reaproveitando o resultado de um texto igual (depois de padronizado) visto
+# há pouco. O mesmo resultado é entregue a todos os usuários, por isso os dados vêm num mapeamento somente leitura
+# (quem precisar acrescentar campos, como o user_id, faz uma cópia com dict())
+def parse_bet(aposta):
+    aposta = normalize_bet(aposta)
+    if PARSE_CACHE_MAX_SIZE <= 0:
+        return _parse_uncached(aposta)
+
+    chave = hashlib.blake2b(aposta.encode("utf-8"), digest_size=16).digest()
+    agora = time.monotonic()
+    with _parse_cache_lock:
+        entrada = _parse_cache.get(chave)
+        if entrada is not None and agora - entrada[1] < PARSE_CACHE_TTL:
+            _parse_cache.move_to_end(chave)
+            parse_cache_stats["hits"] += 1
+            return entrada[0]
+        parse_cache_stats["misses"] += 1
+
+    resultado = _parse_uncached(aposta)
+
+    with _parse_cache_lock:
+        _parse_cache[chave] = (resultado, agora)
+        _parse_cache.move_to_end(chave)
+        while len(_parse_cache) > PARSE_CACHE_MAX_SIZE:
+            _parse_cache.popitem(last=False)
+            parse_cache_stats["evictions"] += 1
+    return resultado
+
+
+# Função para interpretar uma aposta sem o cache; (None, None) se ela está no formato incorreto
+def _parse_uncached(aposta):
+    try:
+        formatted_message, formatted_data = process_message(aposta)
+    except (IndexError, ValueError):
+        # Mensagem curta demais (sem a linha de mercado) ou com números inválidos
+        return None, None
+    if formatted_data is None:
+        return None, None
+    return formatted_message, MappingProxyType(formatted_data)
+
+
+# Função para esvaziar o cache de apostas interpretadas (ex.: depois de trocar as regras de mercado)
+def clear_parse_cache():
+    with _parse_cache_lock:
+        _parse_cache.clear()
+
+
+# Função para interpretar as apostas de uma mensagem uma a uma. Para cada aposta devolve
+# (número da aposta, mensagem formatada, dados somente leitura), com (número, None, None) se ela está
+# no formato incorreto
+def parse_bets(message):
+    for numero, aposta in enumerate(split_bets([message]), 1):
+        formatted_message, formatted_data = parse_bet(aposta)
+        yield numero, formatted_message, formatted_data
+
+
+# Função para processar a mensagem e extrair os dados
+def process_message(message):
+    sport = "Desconhecido"
+
+    # A linha 11 contém o mercado, que queremos extrair
+    mercado_line = message.split("\n", 11)[10]  # Linha 11 é a index 10 (indexing começa de 0)
+
+    # Extrair o texto do mercado até o parêntese "("
+    mercado = mercado_line.split("(")[0].strip()  # Remove espaços extras
+
+    # Procurar as informações principais (EV%, Stake, odds, emoji de esporte, etc.)
+    ev_percentage = _EV_RE.search(message)
+    stake = _STAKE_RE.search(message)
+    odds = _ODDS_RE.search(message)
+    sport_emoji = _SPORT_EMOJI_RE.search(message)
+    date = _DATE_RE.search(message)
+    bookmaker = _BOOKMAKER_RE.search(message)
+
+    # Marcadores de mercado presentes na mensagem, numa única varredura
+    markers = _scan_markers(message)
+
+    # Captura o nome do confronto entre duas equipes
+    game_description = "Desconhecido"
+    game_match = _GAME_RE.search(message)
+    if game_match:
+        game_description = game_match.group(1).strip()
+
+    # Inicializar a descrição da aposta
+    description_text = "Descrição não encontrada"
+
+    # Capturar a descrição da aposta
+    apostas_text = None
+    description = _APOSTA_RE.search(message)
+    if description:
+        apostas_text = description.group(1).strip()
+        description_text = apostas_text  # Extrai a descrição da aposta
+
+        # Verificar se "Mais" ou "Menos" está na descrição e se "1ª Parte" está na mensagem
+        prefixo = "1ª Parte - " if "1ª Parte" in markers else ""
+        if "Mais" in description_text:
+            mercado = f"{prefixo}Over {mercado.split(' ')[-1]}"
+        elif "Menos" in description_text:
+            mercado = f"{prefixo}Under {mercado.split(' ')[-1]}"
+        # Verificar se a linha de mercado contém "Player Props" e extrair o mercado entre parênteses
+        if "Player Props" in mercado_line:
+            player_props_match = _PLAYER_PROPS_LINE_RE.search(mercado_line)
+            if player_props_match:
+                market_in_parentheses = player_props_match.group(2).strip()
+                # Combinar com "Mais" ou "Menos" se estiver presente na descrição
+                if "Mais" in description_text:
+                    mercado = f"Mais {market_in_parentheses}"
+                elif "Menos" in description_text:
+                    mercado = f"Menos {market_in_parentheses}"
+
+    # Aplicar as regras específicas de cada mercado encontrado na mensagem
+    for marker, modo, texto, sufixo, exceto in _MARKET_RULES:
+        if marker not in markers or exceto in markers:
+            continue
+        if modo == "anexar":
+            description_text = description_text + texto
+        elif apostas_text is None or (modo == "se_vazia" and description_text):
+            continue
+        else:
+            description_text = apostas_text + texto
+        mercado = mercado + sufixo
+
+    # Capturar Player Props
+    player_props_match = _PLAYER_PROPS_RE.search(message)
+    if player_props_match:
+        player_name = player_props_match.group(1).strip()
+        stat_type = player_props_match.group(2).strip()
+        description_text = f"{player_name} {description_text} {stat_type}"  # Combine com a descrição da aposta
+
+    # Ajustar o esporte pelo emoji (com tabela própria nos mercados de "Player Props")
+    if sport_emoji:
+        emoji = sport_emoji.group(1)
+        if "player props" in mercado_line.lower():
+            sport = PLAYER_PROPS_SPORTS_BY_EMOJI.get(emoji, sport)
+        elif emoji == NBA_EMOJI and "NBA" in markers:
+            sport = "NBA"
+        else:
+            sport = SPORTS_BY_EMOJI.get(emoji, sport)
+
+    # Substituir "Golos" por "Gols", "Pontos" ou "Games" dependendo do esporte
+    golos = GOLOS_BY_SPORT.get(sport)
+    if golos:
+        description_text = description_text.replace("Golos", golos)
+        mercado = mercado.replace("Golos", golos)
+
+    # Após capturar a descrição da aposta
+    description_text = translate(description_text)
+    # Após capturar o mercado
+    mercado = translate(mercado)
+
+    # Formatando a resposta
+    if all([ev_percentage, stake, odds, sport_emoji, date, bookmaker]):
+        ev_percentage = round(float(ev_percentage.group(1)))
+        ev_percentage = ev_percentage / 100
+        # Converte stake e odds para float
+        stake = float(stake.group(1))
+        odds = float(odds.group(1))
+
+        # Formata stake: sem casas decimais se for número inteiro (ex: 1.00 → 1u)
+        if stake.is_integer():
+            stake_str = f"{int(stake)}"  # Retira a casa decimal
+        else:
+            stake_str = f"{str(stake).replace('.', ',')}"  # Troca ponto por vírgula em stake
+
+        # Formata odds: sempre com vírgula
+        odds_str = str(odds).replace('.', ',')
+
+        date_formatted = f"{date.group(3)}-{date.group(2)}-{date.group(1)}"
+        bookmaker = bookmaker.group(1)
+
+        # Construir a mensagem formatada
+        formatted_message = (
+            f"Casa de Aposta: {bookmaker}\n"
+            f"Data: {date_formatted}\n"
+            f"EV%: {ev_percentage}\n"
+            f"Jogo: {game_description}\n"
+            f"Aposta: {description_text}\n"
+            f"Esporte: {sport}\n"
+            f"Mercado: {mercado}\n"  # Adiciona o mercado à resposta
+            f"Odd: {odds}\n"
+            f"Stake: {stake_str}u"
+        )
+
+        formatted_data = {
+            "bookmaker": bookmaker,
+            "date": date_formatted,
+            "ev_percentage": ev_percentage,
+            "game_description": game_description,
+            "bet_description": description_text,
+            "sport": sport,
+            "odds": odds,
+            "stake": stake,
+            "market": mercado
+        }
+
+        return formatted_message.strip(), formatted_data
+    return None, None
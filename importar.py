@@ -0,0 +1,250 @@
+# Importação em massa de apostas do EV+ Scanner (histórico exportado do Telegram ou arquivo de texto) para a planilha
+#
+# Uso:
+#   python importar.py historico.txt --usuario 123456789
+#   python importar.py result.json --planilha https://docs.google.com/spreadsheets/d/abc123XYZ/edit
+#   python importar.py historico.txt --usuario 123456789 --simular
+#
+# As apostas passam pelo mesmo caminho das mensagens do bot: índice de duplicatas, regra de roteamento do usuário e
+# fila (ou livro local, com SHEETS_WRITE_MODE=local). A fila é esvaziada respeitando a responsabilidade de cada
+# processo pela planilha: com o bot rodando, quem grava é quem responde pela planilha, sem dois processos
+# escrevendo nela ao mesmo tempo.
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from multiprocessing import Pool
+from pathlib import Path
+from types import SimpleNamespace
+
+import typer
+from tqdm import tqdm
+
+from botforma import (
+    QUEUE_FLUSH_INTERVAL,
+    SHEETS_WRITE_MODE,
+    _flush_batch,
+    bet_digest,
+    bet_ledger,
+    bet_queue,
+    dedup_index,
+    extract_spreadsheet_id,
+    get_user_spreadsheet_id,
+    invalidate_next_free_row,
+    record_bet_stats,
+    route_bet,
+    user_routes,
+)
+from formatador import process_message, split_bets
+
+# Tamanho (em caracteres) de cada leitura do arquivo
+READ_CHUNK_SIZE = 1 << 16
+
+app = typer.Typer(help="Importa em massa apostas do EV+ Scanner para a planilha de um usuário.")
+
+
+# Função para ler o arquivo em pedaços, atualizando a barra de progresso com os bytes lidos
+def read_chunks(f, progresso):
+    while True:
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return
+        progresso.update(f.buffer.tell() - progresso.n)
+        yield chunk
+
+
+# Função para obter o texto de uma mensagem do export JSON do Telegram (texto simples ou lista de entidades)
+def _export_message_text(mensagem):
+    if mensagem.get("type") != "message":
+        return ""
+    texto = mensagem.get("text", "")
+    if isinstance(texto, list):
+        texto = "".join(parte if isinstance(parte, str) else parte.get("text", "") for parte in texto)
+    return texto
+
+
+# Função para ler a lista "messages" do export JSON do Telegram uma mensagem por vez, sem carregar o arquivo inteiro
+def iter_export_messages(chunks):
+    decoder = json.JSONDecoder()
+    buffer = ""
+
+    # Procurar o início da lista "messages"
+    for chunk in chunks:
+        buffer += chunk
+        chave = buffer.find('"messages"')
+        inicio = buffer.find("[", chave) if chave >= 0 else -1
+        if inicio >= 0:
+            buffer = buffer[inicio + 1:]
+            break
+        if chave < 0:
+            buffer = buffer[-len('"messages"'):]
+    else:
+        return
+
+    pos = 0
+    while True:
+        # Pular separadores entre os objetos da lista
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            if pos >= len(buffer):
+                raise json.JSONDecodeError("fim do buffer", buffer, pos)
+            mensagem, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Objeto incompleto: ler mais um pedaço do arquivo e tentar de novo
+            chunk = next(chunks, "")
+            if not chunk:
+                if buffer[pos:].strip():
+                    raise
+                return
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield _export_message_text(mensagem)
+
+
+# Função executada nos processos do pool: o parser puro, sem derrubar o lote se uma mensagem quebrar
+def _parse_bet(texto):
+    try:
+        return process_message(texto)[1]
+    except Exception:
+        return None
+
+
+# Função para agrupar um fluxo em listas de tamanho fixo
+def _batched(iterable, tamanho):
+    lote = []
+    for item in iterable:
+        lote.append(item)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+# Função para guardar um bloco de apostas na fila (ou no livro local), descartando as que o usuário já enviou pelo
+# bot; devolve quantas eram novas e as planilhas de destino
+def _store_chunk(user_id, spreadsheet_id, rota, apostas):
+    novas = dedup_index.filter_new(user_id, apostas)
+    apostas = [data for data, nova in zip(apostas, novas) if nova]
+    try:
+        destinos = [(*route_bet(rota, spreadsheet_id, data), data) for data in apostas]
+        if SHEETS_WRITE_MODE == "local":
+            bet_ledger.append(user_id, None, destinos)
+        elif destinos:
+            bet_queue.enqueue(user_id, None, destinos)
+    except Exception:
+        # Nada foi guardado: esquecer as apostas para uma nova importação do arquivo não descartá-las
+        dedup_index.forget(user_id, apostas)
+        raise
+    if SHEETS_WRITE_MODE == "local":
+        record_bet_stats(user_id, apostas)
+    return len(apostas), {destino[0] for destino in destinos}
+
+
+# Função para esperar a fila chegar às planilhas informadas: este processo grava os lotes das planilhas pelas quais
+# responde e espera o bot terminar as que estão com ele. Devolve quantas apostas desistiram (limite de tentativas).
+async def _drain_queue(spreadsheet_ids, lote):
+    application = SimpleNamespace(bot=None)
+    desistidas = await asyncio.to_thread(bet_queue.failed, spreadsheet_ids)
+    while await asyncio.to_thread(bet_queue.pending, spreadsheet_ids):
+        lotes = await asyncio.to_thread(bet_queue.due_batches, lote, (), spreadsheet_ids)
+        for spreadsheet_id, _, assumida in lotes:
+            if assumida:
+                invalidate_next_free_row(spreadsheet_id)
+        await asyncio.gather(*(_flush_batch(application, spreadsheet_id, rows) for spreadsheet_id, rows, _ in lotes))
+        if not lotes:
+            await asyncio.sleep(QUEUE_FLUSH_INTERVAL)
+    return await asyncio.to_thread(bet_queue.failed, spreadsheet_ids) - desistidas
+
+
+@app.command()
+def importar(
+    arquivo: Path = typer.Argument(..., exists=True, dir_okay=False, help="Arquivo .txt ou export .json do Telegram"),
+    usuario: str = typer.Option(None, help="ID do Telegram de um usuário já registrado no bot"),
+    planilha: str = typer.Option(None, help="Link da planilha (alternativa a --usuario)"),
+    lote: int = typer.Option(500, help="Apostas gravadas por requisição na planilha"),
+    processos: int = typer.Option(os.cpu_count() or 1, help="Processos usados para interpretar as mensagens"),
+    janela_duplicatas: int = typer.Option(100_000, help="Quantas apostas recentes são lembradas para descartar duplicatas"),
+    simular: bool = typer.Option(False, help="Apenas interpretar e contar, sem gravar na planilha"),
+):
+    if bool(usuario) == bool(planilha):
+        raise typer.BadParameter("Informe --usuario ou --planilha (apenas um deles).")
+    if usuario:
+        spreadsheet_id = get_user_spreadsheet_id(usuario)
+        user_id, rota = usuario, user_routes.get(usuario)
+    else:
+        # Planilha sem usuário: índice de duplicatas próprio e tudo na aba padrão
+        spreadsheet_id = extract_spreadsheet_id(planilha)
+        user_id, rota = f"planilha:{spreadsheet_id}", ("unica", {})
+
+    contagem = {"validas": 0, "invalidas": 0, "duplicadas": 0, "gravadas": 0, "falhas": 0}
+    vistas = OrderedDict()  # Janela limitada de apostas já vistas (mantém a memória constante)
+    pendentes = []
+    loop = asyncio.new_event_loop()
+
+    # Função para guardar o bloco pendente e, no modo fila, esperar ele chegar à planilha
+    def gravar(apostas):
+        novas, planilhas = _store_chunk(user_id, spreadsheet_id, rota, apostas)
+        contagem["duplicadas"] += len(apostas) - novas
+        contagem["validas"] -= len(apostas) - novas
+        if SHEETS_WRITE_MODE != "local" and planilhas:
+            falhas = loop.run_until_complete(_drain_queue(planilhas, lote))
+            contagem["falhas"] += falhas
+            novas -= falhas
+        contagem["gravadas"] += novas
+
+    with open(arquivo, "r", encoding="utf-8") as f, \
+            tqdm(total=arquivo.stat().st_size, unit="B", unit_scale=True, desc="Importando") as progresso, \
+            Pool(processos) as pool:
+        chunks = read_chunks(f, progresso)
+        if arquivo.suffix.lower() == ".json":
+            textos = (aposta for texto in iter_export_messages(chunks) for aposta in split_bets([texto]))
+        else:
+            textos = split_bets(chunks)
+
+        # Interpretar em janelas de tamanho fixo para não acumular o arquivo inteiro na memória
+        for janela in _batched(textos, lote * 4):
+            for dados in pool.map(_parse_bet, janela, chunksize=max(1, len(janela) // (processos * 4))):
+                if dados is None:
+                    contagem["invalidas"] += 1
+                    continue
+
+                digest = bet_digest(dados)
+                if digest in vistas:
+                    vistas.move_to_end(digest)
+                    contagem["duplicadas"] += 1
+                    continue
+                vistas[digest] = None
+                if len(vistas) > janela_duplicatas:
+                    vistas.popitem(last=False)
+
+                contagem["validas"] += 1
+                pendentes.append(dados)
+
+                if len(pendentes) >= lote:
+                    if not simular:
+                        # O ritmo das requisições é controlado pelo agendador de cota do botforma
+                        gravar(pendentes)
+                    pendentes = []
+            progresso.set_postfix(contagem)
+
+        if pendentes and not simular:
+            gravar(pendentes)
+        progresso.set_postfix(contagem)
+
+    bet_queue.release()
+    loop.close()
+    gravadas = "guardadas no livro local" if SHEETS_WRITE_MODE == "local" else "gravadas"
+    typer.echo(
+        f"Apostas válidas: {contagem['validas']} | {gravadas}: {contagem['gravadas']} | "
+        f"não gravadas após várias tentativas: {contagem['falhas']} | "
+        f"duplicadas: {contagem['duplicadas']} | formato incorreto: {contagem['invalidas']}"
+    )
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,360 @@
+# Teste de carga do bot com um Telegram falso local, nos modos polling e webhook
+#
+# O script sobe uma Bot API falsa, inicia o botforma.py apontando para ela (TELEGRAM_BASE_URL) e envia
+# saudações ("oi") de vários usuários. A latência de cada atualização vai do envio até a resposta
+# (sendMessage) chegar ao Telegram falso; nenhuma planilha é acessada.
+#
+# Uso:
+#   python loadtest_bot.py --modo polling --atualizacoes 2000
+#   python loadtest_bot.py --modo webhook --atualizacoes 2000 --conexoes 40
+#   python loadtest_bot.py --modo ambos
+#   python loadtest_bot.py --modo webhook --bots 4   -> 4 processos do bot atrás do roteador.py
+#   python loadtest_bot.py --modo respostas          -> camada de envio contra um Bot falso com controle de flood
+import argparse
+import asyncio
+import math
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_TOKEN = "123456:TESTE-DE-CARGA"
+
+
+# Erro devolvido pela Bot API falsa (ok: false), como a API real faz com uma chamada inválida
+class FakeAPIError(Exception):
+    pass
+
+
+# Bot API falsa: entrega atualizações no getUpdates e registra as respostas enviadas pelo bot. O setWebhook só é
+# aceito com a URL esperada (webhook_url); qualquer outro fica em erros e faz a rodada falhar.
+class FakeTelegram:
+    def __init__(self, webhook_url=None):
+        self.webhook_url = webhook_url
+        self.erros = []
+        self.updates = []
+        self.respostas = {}  # chat_id -> instante em que o sendMessage chegou
+        self.getme_recebido = threading.Event()
+        self._cond = threading.Condition()
+        self._message_id = 0
+
+    # Enfileirar uma atualização para o próximo getUpdates
+    def push(self, update):
+        with self._cond:
+            self.updates.append(update)
+            self._cond.notify_all()
+
+    # Responder uma chamada da Bot API
+    def call(self, metodo, params):
+        if metodo == "getMe":
+            self.getme_recebido.set()
+            return {"id": 123456, "is_bot": True, "first_name": "Bot", "username": "bot_teste",
+                    "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        if metodo == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            timeout = float(params.get("timeout") or 0)
+            with self._cond:
+                self.updates = [u for u in self.updates if u["update_id"] >= offset]
+                if not self.updates:
+                    self._cond.wait(min(timeout, 1.0))
+                return self.updates[:100]
+        if metodo == "setWebhook":
+            if params.get("url") != self.webhook_url:
+                self.erros.append(f"setWebhook inesperado: {params.get('url')!r}")
+                raise FakeAPIError(f"Bad Request: setWebhook inesperado ({params.get('url')!r})")
+            return True
+        if metodo == "sendMessage":
+            agora = time.perf_counter()
+            chat_id = int(params["chat_id"])
+            with self._cond:
+                self._message_id += 1
+                self.respostas[chat_id] = agora
+                message_id = self._message_id
+            return {"message_id": message_id, "date": int(time.time()), "text": params.get("text", ""),
+                    "chat": {"id": chat_id, "type": "private"}}
+        return True
+
+
+# Servidor HTTP da Bot API falsa
+def start_fake_telegram(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Conexões persistentes, como na API real
+
+        def do_POST(self):
+            corpo = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params = json.loads(corpo or b"{}")
+            else:
+                params = dict(urllib.parse.parse_qsl(corpo.decode()))
+            try:
+                status, corpo = 200, {"ok": True, "result": fake.call(self.path.rsplit("/", 1)[-1], params)}
+            except FakeAPIError as e:
+                status, corpo = 400, {"ok": False, "error_code": 400, "description": str(e)}
+            resposta = json.dumps(corpo).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(resposta)))
+            self.end_headers()
+            self.wfile.write(resposta)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 1024
+
+        # O bot fecha as conexões de long polling ao encerrar; isso não é erro do teste
+        def handle_error(self, request, client_address):
+            if not isinstance(sys.exc_info()[1], ConnectionError):
+                super().handle_error(request, client_address)
+
+    servidor = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+# Função para obter uma porta livre para o webhook do bot
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Função para montar a atualização de uma saudação (cada atualização tem um chat próprio para medir a latência)
+def make_update(numero, usuarios):
+    return {
+        "update_id": numero,
+        "message": {
+            "message_id": numero,
+            "date": int(time.time()),
+            "chat": {"id": 1_000_000 + numero, "type": "private"},
+            "from": {"id": 1 + numero % usuarios, "is_bot": False, "first_name": "Teste"},
+            "text": "oi",
+        },
+    }
+
+
+# Função para rodar uma rodada de carga num modo e devolver as latências (em ms) e o tempo total.
+# Com mais de um bot (só no modo webhook) as atualizações passam pelo roteador.py e os bots rodam no modo worker,
+# sem registrar webhook; um bot sozinho registra a própria URL.
+def run_load(modo, atualizacoes, usuarios, conexoes, bots=1):
+    portas = [free_port() for _ in range(bots)]
+    url_bot = f"http://127.0.0.1:{portas[0]}" if modo == "webhook" and bots == 1 else ""
+    fake = FakeTelegram(f"{url_bot}/telegram" if url_bot else None)
+    servidor = start_fake_telegram(fake)
+    pasta = tempfile.mkdtemp(prefix="loadtest_bot_")
+    aqui = os.path.dirname(os.path.abspath(__file__))
+
+    processos = []
+    for numero, porta in enumerate(portas):
+        ambiente = dict(
+            os.environ,
+            API_TOKEN=FAKE_TOKEN,
+            BOT_MODE="worker" if modo == "webhook" and bots > 1 else modo,
+            TELEGRAM_BASE_URL=f"http://127.0.0.1:{servidor.server_port}",
+            WEBHOOK_LISTEN="127.0.0.1",
+            WEBHOOK_PORT=str(porta),
+            WEBHOOK_URL=url_bot,
+            WORKER_ID=f"bot-{numero}",
+            # Sem o ritmo de envio do bot: o teste mede o transporte (polling ou webhook), não o limite de mensagens
+            TELEGRAM_CHAT_INTERVAL="0",
+            TELEGRAM_MESSAGES_PER_SECOND="1000000",
+            QUEUE_DB_FILE=os.path.join(pasta, "fila.db"),
+            USER_REGISTRY_DB=os.path.join(pasta, "usuarios.db"),
+        )
+        processos.append(subprocess.Popen([sys.executable, os.path.join(aqui, "botforma.py")], env=ambiente,
+                                          cwd=pasta, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    porta_webhook = portas[0]
+    if bots > 1:
+        porta_webhook = free_port()
+        workers = [f"http://127.0.0.1:{porta}" for porta in portas]
+        processos.append(subprocess.Popen(
+            [sys.executable, os.path.join(aqui, "roteador.py"), "--porta", str(porta_webhook), *workers],
+            cwd=pasta, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    try:
+        if not fake.getme_recebido.wait(30):
+            raise RuntimeError("O bot não iniciou (nenhum getMe recebido).")
+        url_webhook = f"http://127.0.0.1:{porta_webhook}/telegram"
+        if modo == "webhook":
+            for porta in portas + [porta_webhook]:
+                _wait_port(porta)
+        else:
+            time.sleep(0.5)  # Dar tempo para o primeiro getUpdates
+        if fake.erros:
+            raise RuntimeError(f"Chamadas inesperadas à Bot API: {fake.erros}")
+
+        enviados = {}
+
+        def enviar(numero):
+            update = make_update(numero, usuarios)
+            enviados[update["message"]["chat"]["id"]] = time.perf_counter()
+            if modo == "webhook":
+                requisicao = urllib.request.Request(
+                    url_webhook, data=json.dumps(update).encode(), headers={"Content-Type": "application/json"})
+                urllib.request.urlopen(requisicao, timeout=30).read()
+            else:
+                fake.push(update)
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=conexoes) as pool:
+            list(pool.map(enviar, range(1, atualizacoes + 1)))
+
+        # Esperar todas as respostas (ou desistir após 60 s sem progresso)
+        limite = time.perf_counter() + 60
+        while len(fake.respostas) < atualizacoes and time.perf_counter() < limite:
+            time.sleep(0.01)
+        total = max(fake.respostas.values(), default=inicio) - inicio
+        if fake.erros:
+            raise RuntimeError(f"Chamadas inesperadas à Bot API: {fake.erros}")
+
+        latencias = [(fake.respostas[chat] - enviado) * 1000 for chat, enviado in enviados.items()
+                     if chat in fake.respostas]
+        return latencias, total
+    finally:
+        for processo in processos:
+            processo.terminate()
+        for processo in processos:
+            try:
+                processo.wait(15)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+        servidor.shutdown()
+
+
+# Função para esperar o servidor do webhook aceitar conexões
+def _wait_port(porta, timeout=30):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        try:
+            with socket.create_connection(("127.0.0.1", porta), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("O servidor do webhook não respondeu.")
+
+
+# Bot falso (no próprio processo) que imita o controle de flood do Telegram: mensagens maiores que o limite
+# são recusadas e, num mesmo chat, mensagens mais próximas que o intervalo recebem RetryAfter
+class StubBot:
+    def __init__(self, intervalo, latencia=0.01):
+        self._intervalo = intervalo
+        self._latencia = latencia
+        self._ultima = {}
+        self.recebidas = {}
+        self.recusadas = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        from telegram.error import BadRequest, RetryAfter
+
+        await asyncio.sleep(self._latencia)
+        if len(text) > 4096:
+            raise BadRequest("Message is too long")
+        agora = time.monotonic()
+        if agora - self._ultima.get(chat_id, -math.inf) < self._intervalo:
+            self.recusadas += 1
+            raise RetryAfter(max(1, math.ceil(self._intervalo)) if self._intervalo >= 1 else 0)
+        self._ultima[chat_id] = agora
+        self.recebidas.setdefault(chat_id, []).append(text)
+        return text
+
+
+# Função para montar as respostas de uma colagem com N apostas (mensagens formatadas do corpus + resumo)
+def make_replies(apostas):
+    from formatador import process_message
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus_parser.json"), encoding="utf-8") as f:
+        mensagens = [caso["mensagem"] for caso in json.load(f)]
+    formatadas = [texto for texto in (process_message(m)[0] for m in mensagens) if texto]
+    respostas = [formatadas[i % len(formatadas)] for i in range(apostas)]
+    return respostas + [f"{apostas} apostas recebidas com sucesso."]
+
+
+# Função para comparar o envio antigo (uma mensagem por aposta, sem controle) com a camada de envio do bot
+def run_replies(chats, apostas, intervalo_telegram, intervalo_bot):
+    from botforma import OutboundMessages
+
+    respostas = make_replies(apostas)
+
+    async def antigo():
+        bot = StubBot(intervalo_telegram)
+        perdidas = 0
+
+        async def colagem(chat_id):
+            nonlocal perdidas
+            for texto in respostas:
+                try:
+                    await bot.send_message(chat_id, texto)
+                except Exception:
+                    perdidas += 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(colagem(chat) for chat in range(chats)))
+        return bot, perdidas, time.perf_counter() - inicio
+
+    async def camada():
+        bot = StubBot(intervalo_telegram)
+        outbound = OutboundMessages(intervalo_bot, 30, 5)
+        inicio = time.perf_counter()
+        await asyncio.gather(*(outbound.send(bot, chat, respostas) for chat in range(chats)))
+        return bot, outbound, time.perf_counter() - inicio
+
+    bot, perdidas, total = asyncio.run(antigo())
+    enviadas = sum(map(len, bot.recebidas.values()))
+    print(f"uma por aposta  {enviadas} mensagens | {bot.recusadas} RetryAfter | {perdidas} perdidas | {total:.2f}s")
+
+    bot, outbound, total = asyncio.run(camada())
+    completas = all("\n\n".join(bot.recebidas.get(chat, [])) == "\n\n".join(respostas) for chat in range(chats))
+    print(f"camada de envio {outbound.stats['mensagens']} mensagens | {bot.recusadas} RetryAfter | "
+          f"0 perdidas | {total:.2f}s | conteúdo e ordem {'ok' if completas else 'DIFERENTES'}")
+
+
+# Função para calcular um percentil de uma lista de latências
+def percentile(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do bot com um Telegram falso")
+    parser.add_argument("--modo", choices=["polling", "webhook", "ambos", "respostas"], default="ambos")
+    parser.add_argument("--atualizacoes", type=int, default=1000, help="quantas atualizações enviar")
+    parser.add_argument("--usuarios", type=int, default=100, help="quantos usuários diferentes")
+    parser.add_argument("--conexoes", type=int, default=20, help="envios simultâneos")
+    parser.add_argument("--bots", type=int, default=1, help="processos do bot atrás do roteador (modo webhook)")
+    parser.add_argument("--apostas", type=int, default=60, help="apostas por colagem (modo respostas)")
+    parser.add_argument("--intervalo-telegram", type=float, default=0.3,
+                        help="intervalo mínimo por chat imposto pelo Bot falso (modo respostas)")
+    parser.add_argument("--intervalo-bot", type=float, default=0.2,
+                        help="intervalo por chat usado pela camada de envio (modo respostas)")
+    args = parser.parse_args()
+    if args.bots > 1 and args.modo != "webhook":
+        parser.error("--bots só vale para --modo webhook")
+
+    if args.modo == "respostas":
+        run_replies(args.usuarios, args.apostas, args.intervalo_telegram, args.intervalo_bot)
+        return
+
+    modos = ["polling", "webhook"] if args.modo == "ambos" else [args.modo]
+    for modo in modos:
+        latencias, total = run_load(modo, args.atualizacoes, args.usuarios, args.conexoes, args.bots)
+        if not latencias:
+            print(f"{modo}: nenhuma resposta recebida")
+            continue
+        print(
+            f"{modo:<8} {args.bots} bot(s) {len(latencias)}/{args.atualizacoes} respostas em {total:.2f}s | "
+            f"{len(latencias) / total:,.0f} atualizações/s | "
+            f"p50 {percentile(latencias, 50):.1f} ms | p99 {percentile(latencias, 99):.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+# Teste de carga do caminho de gravação inteiro (handle_message -> fila -> agendador de cota -> planilha) contra o
+# simulador de planilhas em memória: milhares de usuários simulados enviando apostas, sem Telegram nem Google
+#
+# Uso:
+#   python loadtest_planilhas.py                                   -> 1000 usuários, 3 mensagens de 2 apostas cada
+#   python loadtest_planilhas.py --usuarios 5000 --latencia 0.2    -> requisições mais lentas
+#   python loadtest_planilhas.py --cota 300                        -> cota padrão de um projeto do Google
+#   python loadtest_planilhas.py --erros 0.05                      -> 5% das requisições recebem 429 por sorteio
+#   python loadtest_planilhas.py --rota esporte                    -> apostas roteadas para uma aba por esporte
+#   python loadtest_planilhas.py --local --mexer 50                -> livro local; depois da compactação, 50 planilhas
+#                                                                     têm uma linha editada e outra excluída, e a
+#                                                                     conciliação precisa restaurá-las
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import re
+import tempfile
+import time
+from types import SimpleNamespace
+
+# Corpus com mensagens reais do EV+ Scanner, usadas como modelo das apostas
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus_parser.json")
+
+# Data do jogo na mensagem (trocada para cada aposta ser única e a ordem poder ser conferida na planilha)
+_DATE_RE = re.compile(r"\d{2}\.\d{2}\.\d{4}")
+
+
+# Função para configurar o bot (antes de importá-lo): bancos num diretório temporário, simulador de planilhas
+# e respostas sem controle de ritmo (o Bot falso não tem limite de envio)
+def configure_environment(args, pasta):
+    os.environ.update({
+        "QUEUE_DB_FILE": os.path.join(pasta, "fila.db"),
+        "USER_REGISTRY_DB": os.path.join(pasta, "usuarios.db"),
+        "SHEETS_BACKEND": "simulador",
+        "SHEETS_SIM_LATENCY": str(args.latencia),
+        "SHEETS_SIM_QUOTA_PER_MINUTE": str(args.cota),
+        "SHEETS_SIM_ERROR_RATE": str(args.erros),
+        "SHEETS_REQUESTS_PER_MINUTE": str(args.cota_bot or args.cota * 0.9),
+        "SHEETS_QUOTA_PAUSE": str(args.pausa),
+        "SHEETS_QUOTA_PAUSE_MAX": str(args.pausa * 8),
+        "QUEUE_FLUSH_INTERVAL": "0.2",
+        "SHEETS_WRITE_MODE": "local" if args.local else "fila",
+        "LEDGER_COMPACT_INTERVAL": str(args.compactacao),
+        # A conciliação só acontece quando o teste pede
+        "LEDGER_RECONCILE_INTERVAL": "86400",
+        "TELEGRAM_CHAT_INTERVAL": "0",
+        "TELEGRAM_MESSAGES_PER_SECOND": "1000000",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    })
+
+
+# Bot falso: só conta as respostas de cada chat
+class FakeBot:
+    def __init__(self):
+        self.respostas = {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.respostas[chat_id] = self.respostas.get(chat_id, 0) + 1
+
+
+# Função para montar as mensagens de um usuário: cada aposta com uma data própria, crescente na ordem de envio
+def make_messages(modelos, indice, mensagens, apostas):
+    textos = []
+    for m in range(mensagens):
+        bets = []
+        for a in range(apostas):
+            n = m * apostas + a
+            data = datetime.date(2024, 1, 1) + datetime.timedelta(days=n)
+            modelo = modelos[(indice + n) % len(modelos)]
+            bets.append(_DATE_RE.sub(data.strftime("%d.%m.%Y"), modelo, count=1))
+        textos.append("\n\n\n".join(bets))
+    return textos
+
+
+# Função para montar uma atualização do Telegram com o mínimo que o handle_message usa
+def make_update(bot, user_id, texto):
+    return SimpleNamespace(
+        message=SimpleNamespace(text=texto, from_user=SimpleNamespace(id=int(user_id))),
+        effective_chat=SimpleNamespace(id=int(user_id)),
+        get_bot=lambda: bot,
+    )
+
+
+# Função para esperar a fila (ou o livro) chegar às planilhas; devolve quantas apostas ficaram pendentes
+async def wait_written(botforma, args, inicio):
+    pendentes = botforma.bet_ledger.pending if args.local else botforma.bet_queue.pending
+    while await asyncio.to_thread(pendentes) and time.perf_counter() - inicio < args.timeout:
+        await asyncio.sleep(0.2)
+    return await asyncio.to_thread(pendentes)
+
+
+# Função para simular usuários mexendo nas planilhas: em cada uma, a data de uma aposta é trocada e outra linha
+# de aposta é excluída; devolve as planilhas alteradas
+def tamper(simulador, usuarios, quantidade, sorteio):
+    alteradas = []
+    for user_id in sorteio.sample(usuarios, min(quantidade, len(usuarios))):
+        spreadsheet_id = f"sim{user_id}"
+        title = sorteio.choice([t for t in simulador.titles(spreadsheet_id) if len(simulador.values(spreadsheet_id, t)) > 2])
+        linhas = len(simulador.values(spreadsheet_id, title))
+        editada, excluida = sorteio.sample(range(2, linhas + 1), 2)
+        simulador.edit_cell(spreadsheet_id, title, editada, 3, "data editada")
+        simulador.delete_rows(spreadsheet_id, title, excluida)
+        alteradas.append(spreadsheet_id)
+    return alteradas
+
+
+# Função para resumir as linhas restauradas pela conciliação, por tipo
+def metricas_reparos(botforma):
+    reparos = botforma.metricas.ledger_repairs
+    return ", ".join(f"{reparos.value(tipo=tipo)} {tipo}(s)" for tipo in ("editada", "apagada", "copia"))
+
+
+# Função para calcular um percentil de uma lista de latências
+def percentile(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+async def run_load(args):
+    import botforma
+    from formatador import process_message
+
+    botforma.metricas.configure_logging()
+    with open(CORPUS_FILE, encoding="utf-8") as f:
+        modelos = [caso["mensagem"] for caso in json.load(f) if caso["formatted_data"]]
+    # Só modelos em que a troca da data não muda mais nada
+    modelos = [m for m in modelos if process_message(_DATE_RE.sub("01.01.2024", m, count=1))[0]]
+
+    usuarios = [str(100000 + i) for i in range(args.usuarios)]
+    for user_id in usuarios:
+        botforma.user_registry.register(user_id, f"https://docs.google.com/spreadsheets/d/sim{user_id}/edit")
+        botforma.user_state.set(user_id, "registrando_apostas")
+        botforma.user_routes.set_mode(user_id, args.rota)
+    mensagens = {user_id: make_messages(modelos, i, args.mensagens, args.apostas) for i, user_id in enumerate(usuarios)}
+
+    bot = FakeBot()
+    application = SimpleNamespace(bot=bot)
+    await botforma._start_queue_flusher(application)
+
+    # Cada usuário envia as mensagens em sequência; os usuários disputam as vagas de atualizações simultâneas
+    vagas = asyncio.Semaphore(args.simultaneas)
+    latencias = []
+
+    async def usuario(user_id):
+        for texto in mensagens[user_id]:
+            async with vagas:
+                inicio = time.perf_counter()
+                await botforma.handle_message(make_update(bot, user_id, texto), None)
+                latencias.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(usuario(user_id) for user_id in usuarios))
+    recebidas = time.perf_counter() - inicio
+
+    # Esperar a fila (ou o livro) chegar às planilhas
+    pendentes = await wait_written(botforma, args, inicio)
+    gravadas = time.perf_counter() - inicio
+    simulador = botforma.sheet_backend._get()
+
+    # Mexer nas planilhas e conciliá-las com o livro; as linhas excluídas voltam pela compactação
+    alteradas = []
+    if args.local and args.mexer:
+        alteradas = tamper(simulador, usuarios, args.mexer, random.Random(7))
+        inicio_conciliacao = time.perf_counter()
+        # Conciliar todas as planilhas, repetindo as que falharam (ex.: 429) até o prazo
+        faltando = {f"sim{user_id}" for user_id in usuarios}
+        while faltando and time.perf_counter() - inicio_conciliacao < args.timeout:
+            conciliacoes = await asyncio.to_thread(botforma.bet_ledger.due_reconciliations, len(usuarios), 0)
+            conciliacoes = [(spreadsheet_id, rows) for spreadsheet_id, rows, _ in conciliacoes if spreadsheet_id in faltando]
+            resultados = await asyncio.gather(*(botforma._reconcile_ledger_sheet(spreadsheet_id, rows)
+                                                for spreadsheet_id, rows in conciliacoes))
+            faltando -= {spreadsheet_id for (spreadsheet_id, _), ok in zip(conciliacoes, resultados) if ok}
+            await asyncio.sleep(0.5)
+        pendentes = await wait_written(botforma, args, time.perf_counter())
+        conciliadas = time.perf_counter() - inicio_conciliacao
+    await botforma._stop_queue_flusher(application)
+
+    # Conferir cada planilha: todas as apostas, sem repetição, na ordem de envio (datas crescentes na coluna C
+    # de cada aba; nas planilhas alteradas a linha restaurada vai para o fim, então só o conjunto é conferido)
+    esperadas = args.mensagens * args.apostas
+    erradas = 0
+    abas = 0
+    for user_id in usuarios:
+        gravadas_usuario = 0
+        em_ordem = True
+        for title in simulador.titles(f"sim{user_id}"):
+            linhas = simulador.values(f"sim{user_id}", title)
+            datas = [linha[2] for linha in linhas[1:] if len(linha) > 2 and linha[2]]
+            try:
+                ordem = [datetime.datetime.strptime(d, "%d/%m/%Y").date() for d in datas]
+            except ValueError:
+                ordem = None  # Célula editada que não foi restaurada
+            gravadas_usuario += len(datas)
+            if ordem is None or len(set(ordem)) != len(ordem):
+                em_ordem = False
+            elif f"sim{user_id}" not in alteradas:
+                em_ordem = em_ordem and ordem == sorted(ordem)
+            if args.local and len(linhas) > 1:
+                # A coluna dos IDs precisa estar oculta
+                em_ordem = em_ordem and simulador.hidden_columns(f"sim{user_id}", title) == [25]
+            abas += 1
+        if gravadas_usuario != esperadas or not em_ordem:
+            erradas += 1
+
+    total_mensagens = len(latencias)
+    total_apostas = total_mensagens * args.apostas
+    print(
+        f"{args.usuarios} usuários | {total_mensagens} mensagens ({total_apostas} apostas) recebidas em {recebidas:.2f}s "
+        f"({total_mensagens / recebidas:,.0f} mensagens/s)"
+    )
+    print(
+        f"handle_message: p50 {percentile(latencias, 50) * 1000:.1f} ms | p95 {percentile(latencias, 95) * 1000:.1f} ms | "
+        f"p99 {percentile(latencias, 99) * 1000:.1f} ms | máx {max(latencias) * 1000:.1f} ms"
+    )
+    print(
+        f"planilhas: {total_apostas - pendentes} apostas gravadas em {gravadas:.2f}s "
+        f"({(total_apostas - pendentes) / gravadas:,.0f} apostas/s) | {pendentes} pendentes | "
+        f"{simulador.stats['requisicoes']} requisições | {simulador.stats['cota_excedida']} 429 de cota | "
+        f"{simulador.stats['erros_sorteados']} 429 sorteados"
+    )
+    if alteradas:
+        print(
+            f"conciliação: {len(alteradas)} planilhas alteradas, "
+            f"{metricas_reparos(botforma)} | reparadas em {conciliadas:.2f}s"
+        )
+    print(
+        f"conferência ({abas} abas): {len(usuarios) - erradas} planilhas ok, "
+        f"{erradas} com apostas faltando, repetidas ou fora de ordem"
+    )
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do caminho de gravação com o simulador de planilhas")
+    parser.add_argument("--usuarios", type=int, default=1000)
+    parser.add_argument("--mensagens", type=int, default=3, help="mensagens por usuário")
+    parser.add_argument("--apostas", type=int, default=2, help="apostas por mensagem")
+    parser.add_argument("--simultaneas", type=int, default=32, help="atualizações processadas ao mesmo tempo")
+    parser.add_argument("--latencia", type=float, default=0.05, help="latência média de cada requisição (s)")
+    parser.add_argument("--cota", type=float, default=6000, help="requisições por minuto do Google simulado")
+    parser.add_argument("--cota-bot", type=float, default=0,
+                        help="requisições por minuto do agendador do bot (padrão: 90%% da cota)")
+    parser.add_argument("--erros", type=float, default=0.0, help="fração das requisições que recebem 429 por sorteio")
+    parser.add_argument("--pausa", type=float, default=5,
+                        help="pausa inicial do agendador após um 429 (s; o bot usa SHEETS_QUOTA_PAUSE=30)")
+    parser.add_argument("--timeout", type=float, default=600, help="espera máxima pela gravação (s)")
+    parser.add_argument("--rota", choices=["unica", "esporte", "mes", "ano"], default="unica",
+                        help="regra de roteamento de todos os usuários")
+    parser.add_argument("--local", action="store_true", help="gravar pelo livro local (SHEETS_WRITE_MODE=local)")
+    parser.add_argument("--compactacao", type=float, default=1, help="intervalo entre as compactações do livro (s)")
+    parser.add_argument("--mexer", type=int, default=0,
+                        help="planilhas alteradas depois da compactação, para a conciliação restaurar (com --local)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        configure_environment(args, pasta)
+        asyncio.run(run_load(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# Métricas e medições de tempo do bot: contadores, histogramas, etapas cronometradas (loguru)
+# e um endpoint /metrics no formato texto do Prometheus
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from loguru import logger
+
+# Carregar as variáveis de ambiente do arquivo .env (antes de ler as configurações abaixo)
+load_dotenv()
+
+# Nível do log e saída em JSON (um objeto por linha, com os campos de cada etapa)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_JSON = os.getenv("LOG_JSON", "0") == "1"
+# Porta local do endpoint /metrics (0 desativa) e intervalo (em segundos) do resumo periódico no log (0 desativa)
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", "0"))
+
+# Limites (em segundos) dos buckets dos histogramas de latência
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+# Função para escrever os rótulos de uma série no formato do Prometheus
+def _format_labels(labels):
+    if not labels:
+        return ""
+    partes = []
+    for nome, valor in labels:
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        partes.append(f'{nome}="{valor}"')
+    return "{" + ",".join(partes) + "}"
+
+
+# Contador que só cresce, com uma série por combinação de rótulos
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        chave = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[chave] = self._values.get(chave, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, chave, valor) for chave, valor in self._values.items()]
+
+
+# Valor lido na hora da coleta (ex.: tamanho da fila)
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text, func):
+        self.name = name
+        self.help = help_text
+        self._func = func
+
+    def samples(self):
+        try:
+            return [(self.name, (), self._func())]
+        except Exception as e:
+            logger.warning("Erro ao ler a métrica {}: {}", self.name, e)
+            return []
+
+
+# Histograma com buckets cumulativos, soma e contagem por combinação de rótulos
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # rótulos -> [contagens por bucket..., soma, total]
+
+    def observe(self, value, **labels):
+        chave = tuple(sorted(labels.items()))
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [0] * (len(self._buckets) + 2)
+            for i, limite in enumerate(self._buckets):
+                if value <= limite:
+                    serie[i] += 1
+                    break
+            serie[-2] += value
+            serie[-1] += 1
+
+    # Total de observações e soma de uma série (usado no resumo do log)
+    def totals(self):
+        with self._lock:
+            return {chave: (serie[-1], serie[-2]) for chave, serie in self._series.items()}
+
+    def samples(self):
+        with self._lock:
+            series = {chave: list(serie) for chave, serie in self._series.items()}
+        amostras = []
+        for chave, serie in series.items():
+            acumulado = 0
+            for limite, contagem in zip(self._buckets, serie):
+                acumulado += contagem
+                amostras.append((f"{self.name}_bucket", chave + (("le", repr(float(limite))),), acumulado))
+            amostras.append((f"{self.name}_bucket", chave + (("le", "+Inf"),), serie[-1]))
+            amostras.append((f"{self.name}_sum", chave, serie[-2]))
+            amostras.append((f"{self.name}_count", chave, serie[-1]))
+        return amostras
+
+
+# Conjunto das métricas do processo
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def gauge(self, name, help_text, func):
+        return self.register(Gauge(name, help_text, func))
+
+    # Texto no formato de exposição do Prometheus
+    def render(self):
+        linhas = []
+        for metric in self._metrics:
+            linhas.append(f"# HELP {metric.name} {metric.help}")
+            linhas.append(f"# TYPE {metric.name} {metric.kind}")
+            for nome, labels, valor in metric.samples():
+                linhas.append(f"{nome}{_format_labels(labels)} {valor}")
+        return "\n".join(linhas) + "\n"
+
+
+registry = Registry()
+
+# Métricas do caminho principal (mensagem -> fila -> planilha)
+bets_parsed = registry.counter("botsheets_apostas_interpretadas_total", "Apostas interpretadas com sucesso")
+bets_failed = registry.counter("botsheets_apostas_falhas_total", "Apostas que falharam, por motivo")
+bets_written = registry.counter("botsheets_apostas_gravadas_total", "Apostas gravadas na planilha")
+bets_retried = registry.counter("botsheets_apostas_reenvios_total", "Apostas devolvidas à fila para nova tentativa")
+stage_seconds = registry.histogram("botsheets_etapa_segundos", "Duração de cada etapa do processamento")
+sheets_request_seconds = registry.histogram(
+    "botsheets_sheets_requisicao_segundos", "Latência das requisições à API do Google Sheets, por tipo de chamada")
+sheets_requests = registry.counter(
+    "botsheets_sheets_requisicoes_total", "Requisições à API do Google Sheets, por tipo de chamada e status HTTP")
+sheets_quota_wait_seconds = registry.histogram(
+    "botsheets_sheets_espera_cota_segundos", "Tempo de espera no agendador de cota antes de cada requisição")
+token_refreshes = registry.counter(
+    "botsheets_token_renovacoes_total", "Renovações do token de acesso do Google, por resultado")
+ledger_repairs = registry.counter(
+    "botsheets_livro_reparos_total", "Linhas da planilha restauradas a partir do livro local, por tipo")
+
+
+# Cronometrar uma etapa: registra a duração no histograma e no log (nível DEBUG, com os campos da etapa;
+# o dicionário de campos é devolvido para a etapa completar com o que só descobre no meio do caminho)
+@contextmanager
+def span(stage, **fields):
+    inicio = time.perf_counter()
+    status = "ok"
+    try:
+        yield fields
+    except BaseException:
+        status = "erro"
+        raise
+    finally:
+        duracao = time.perf_counter() - inicio
+        stage_seconds.observe(duracao, etapa=stage)
+        logger.debug("etapa {etapa} em {ms:.2f} ms ({status})", etapa=stage, ms=duracao * 1000, status=status, **fields)
+
+
+# Função para configurar a saída do log (texto legível ou JSON)
+def configure_logging():
+    logger.remove()
+    logger.add(sys.stderr, level=LOG_LEVEL, serialize=LOG_JSON)
+
+
+# Função para iniciar o endpoint /metrics numa thread em segundo plano
+def start_metrics_server(listen=METRICS_LISTEN, port=METRICS_PORT):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            corpo = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((listen, port), Handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    logger.info("Métricas disponíveis em http://{}:{}/metrics", listen, servidor.server_port)
+    return servidor
+
+
+# Função para escrever um resumo das métricas no log (contadores e latência média de cada etapa/chamada)
+def log_summary():
+    contadores = {
+        "interpretadas": sum(v for _, _, v in bets_parsed.samples()),
+        "falhas": sum(v for _, _, v in bets_failed.samples()),
+        "gravadas": sum(v for _, _, v in bets_written.samples()),
+        "reenvios": sum(v for _, _, v in bets_retried.samples()),
+    }
+    latencias = {}
+    for histogram in (stage_seconds, sheets_request_seconds):
+        for chave, (total, soma) in histogram.totals().items():
+            nome = "/".join(str(valor) for _, valor in chave)
+            latencias[nome] = f"{total}x {soma / total * 1000:.1f} ms"
+    logger.info("métricas: {contadores} | latência média: {latencias}", contadores=contadores, latencias=latencias)
+
+
+# Função para escrever o resumo das métricas no log a cada intervalo, numa thread em segundo plano
+def start_periodic_dump(interval=METRICS_DUMP_INTERVAL):
+    def loop():
+        while True:
+            time.sleep(interval)
+            log_summary()
+
+    threading.Thread(target=loop, name="resumo-metricas", daemon=True).start()
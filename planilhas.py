@@ -0,0 +1,480 @@
+# Backends das planilhas: o gspread (Google Sheets de verdade) e um simulador em memória, com latência e erros
+# de cota configuráveis, para exercitar o caminho de gravação inteiro sem rede (testes de carga, CI)
+#
+# Um backend abre as abas de uma planilha (open_worksheets) e sabe classificar os próprios erros
+# (is_quota_error, is_access_error, is_invalid_request_error). As abas devolvidas têm a parte da interface do gspread usada pelo bot:
+# id, title, row_count, col_count, spreadsheet.id, spreadsheet.batch_update, spreadsheet.values_batch_get,
+# row_values, col_values, get_all_values, update e format.
+import datetime
+import random
+import re
+import secrets
+import threading
+import time
+from collections import deque
+
+
+# Função para executar uma requisição sem nenhum controle (padrão do simulador fora do bot)
+def _direct(spreadsheet_id, chamada, call):
+    return call()
+
+
+# Linhas das abas criadas pelo roteamento (a grade cresce conforme as apostas chegam)
+NEW_TAB_ROWS = 1000
+
+
+# Função para montar as operações de um batchUpdate que criam abas com o cabeçalho (linha 1) de uma aba-modelo;
+# os IDs das abas novas são sorteados aqui para o cabeçalho ir na mesma requisição
+def new_tab_requests(titles, base, cabecalho, ids_em_uso):
+    requests = []
+    for title in titles:
+        sheet_id = secrets.randbelow(2 ** 31 - 1)
+        while sheet_id in ids_em_uso:
+            sheet_id = secrets.randbelow(2 ** 31 - 1)
+        ids_em_uso.add(sheet_id)
+        requests.append({"addSheet": {"properties": {
+            "sheetId": sheet_id,
+            "title": title,
+            "gridProperties": {"rowCount": NEW_TAB_ROWS, "columnCount": base.col_count},
+        }}})
+        if cabecalho:
+            requests.append({"updateCells": {
+                "start": {"sheetId": sheet_id, "rowIndex": 0, "columnIndex": 0},
+                "rows": [{"values": [{"userEnteredValue": {"stringValue": valor}} for valor in cabecalho]}],
+                "fields": "userEnteredValue",
+            }})
+    return requests
+
+
+# Backend do Google Sheets de verdade, via gspread
+class GspreadBackend:
+    def __init__(self, client_factory):
+        self._client_factory = client_factory
+
+    # Abrir as abas pedidas com uma única leitura dos metadados; com create_from, as que não existem são criadas
+    # (todas numa única requisição) com o cabeçalho dessa outra aba
+    def open_worksheets(self, spreadsheet_id, titles, create_from=None):
+        import gspread
+
+        planilha = self._client_factory().open_by_key(spreadsheet_id)
+        abas = {aba.title: aba for aba in planilha.worksheets()}
+        faltando = [title for title in titles if title not in abas]
+        if faltando:
+            if create_from is None or create_from not in abas:
+                raise gspread.exceptions.WorksheetNotFound(faltando[0])
+            base = abas[create_from]
+            resposta = planilha.batch_update({"requests": new_tab_requests(
+                faltando, base, base.row_values(1), {aba.id for aba in abas.values()})})
+            for reply in resposta["replies"]:
+                if "addSheet" in reply:
+                    propriedades = reply["addSheet"]["properties"]
+                    abas[propriedades["title"]] = gspread.Worksheet(planilha, propriedades, planilha.id, planilha.client)
+        return {title: abas[title] for title in titles}
+
+    def is_quota_error(self, error):
+        import gspread
+
+        return isinstance(error, gspread.exceptions.APIError) and error.code == 429
+
+    def is_access_error(self, error):
+        import gspread
+
+        if isinstance(error, (gspread.exceptions.SpreadsheetNotFound,
+                              gspread.exceptions.WorksheetNotFound,
+                              PermissionError)):
+            return True
+        return isinstance(error, gspread.exceptions.APIError) and error.code in (403, 404)
+
+    def is_invalid_request_error(self, error):
+        import gspread
+
+        return isinstance(error, gspread.exceptions.APIError) and error.code == 400
+
+
+# Erro devolvido pelo simulador, com o código HTTP que o Google devolveria
+class SimulatedAPIError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+
+
+# Intervalo em notação A1 (ex.: "B2", "B2:J10", "C:C")
+_A1_RE = re.compile(r"^([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?$")
+
+
+# Função para converter as letras de uma coluna no número dela (A -> 1)
+def _column_number(letras):
+    numero = 0
+    for letra in letras:
+        numero = numero * 26 + ord(letra) - ord("A") + 1
+    return numero
+
+
+# Função para converter um intervalo A1 em (primeira linha, primeira coluna, última linha, última coluna),
+# começando em 1; linhas omitidas valem a coluna inteira
+def a1_to_bounds(a1, row_count):
+    encontrado = _A1_RE.match(a1.split("!")[-1].replace("$", "").upper())
+    if encontrado is None:
+        raise SimulatedAPIError(400, f"intervalo inválido: {a1!r}")
+    col_ini, lin_ini, col_fim, lin_fim = encontrado.groups()
+    col_fim = col_fim or col_ini
+    lin_fim = lin_fim or (lin_ini if encontrado.group(3) is None else "")
+    return (int(lin_ini or 1), _column_number(col_ini),
+            int(lin_fim or row_count), _column_number(col_fim))
+
+
+# Aba simulada: células e formatos guardados por (linha, coluna), começando em 0
+class SimulatedWorksheet:
+    def __init__(self, spreadsheet, sheet_id, title, rows, cols):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self._cells = {}
+        self._formats = {}
+        self._hidden = set()  # Colunas ocultas, começando em 0
+
+    # Valor de uma célula como o Sheets mostraria (datas com o formato dd/mm/yyyy)
+    def _displayed(self, linha, coluna):
+        valor = self._cells.get((linha, coluna), "")
+        if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            formato = self._formats.get((linha, coluna), {})
+            if formato.get("type") == "DATE":
+                data = datetime.date(1899, 12, 30) + datetime.timedelta(days=int(valor))
+                return data.strftime("%d/%m/%Y")
+            return str(int(valor)) if float(valor).is_integer() else str(valor)
+        return str(valor)
+
+    # Tirar da grade as linhas de inicio a fim (índices a partir de 0, fim exclusivo): as de baixo sobem
+    def _remove_rows(self, inicio, fim):
+        for tabela in (self._cells, self._formats):
+            movidas = {}
+            for (linha, coluna), valor in tabela.items():
+                if linha < inicio:
+                    movidas[(linha, coluna)] = valor
+                elif linha >= fim:
+                    movidas[(linha - (fim - inicio), coluna)] = valor
+            tabela.clear()
+            tabela.update(movidas)
+
+    def _check_bounds(self, linha, coluna):
+        if linha >= self.row_count or coluna >= self.col_count:
+            raise SimulatedAPIError(400, f"o intervalo ultrapassa os limites da grade da aba {self.title!r}")
+
+    def row_values(self, row):
+        def ler():
+            colunas = sorted(coluna for linha, coluna in self._cells if linha == row - 1)
+            if not colunas:
+                return []
+            return [self._displayed(row - 1, coluna) for coluna in range(colunas[-1] + 1)]
+        return self.spreadsheet.request("values.get", ler)
+
+    def col_values(self, col):
+        def ler():
+            linhas = sorted(linha for linha, coluna in self._cells if coluna == col - 1)
+            if not linhas:
+                return []
+            return [self._displayed(linha, col - 1) for linha in range(linhas[-1] + 1)]
+        return self.spreadsheet.request("values.get", ler)
+
+    def get_all_values(self):
+        return self.spreadsheet.request("values.get", self._all_values)
+
+    # Todas as células até a última preenchida; sem formatted, os valores como foram gravados (UNFORMATTED_VALUE)
+    def _all_values(self, formatted=True):
+        if not self._cells:
+            return []
+        ultima_linha = max(linha for linha, _ in self._cells)
+        ultima_coluna = max(coluna for _, coluna in self._cells)
+        valor = self._displayed if formatted else lambda linha, coluna: self._cells.get((linha, coluna), "")
+        return [[valor(linha, coluna) for coluna in range(ultima_coluna + 1)] for linha in range(ultima_linha + 1)]
+
+    # Gravar valores a partir do canto do intervalo (mesma ordem de argumentos do gspread 6)
+    def update(self, values, range_name=None):
+        if isinstance(values, str):
+            values, range_name = range_name, values
+        lin_ini, col_ini, _, _ = a1_to_bounds(range_name or "A1", self.row_count)
+
+        def gravar():
+            self._check_bounds(lin_ini - 2 + len(values), col_ini - 2 + max(map(len, values), default=0))
+            for i, linha in enumerate(values):
+                for j, valor in enumerate(linha):
+                    self._cells[(lin_ini - 1 + i, col_ini - 1 + j)] = valor
+            return {"updatedRows": len(values)}
+        return self.spreadsheet.request("values.update", gravar)
+
+    # Aplicar um formato de número a todas as células do intervalo
+    def format(self, ranges, format):
+        def formatar():
+            for a1 in [ranges] if isinstance(ranges, str) else ranges:
+                lin_ini, col_ini, lin_fim, col_fim = a1_to_bounds(a1, self.row_count)
+                self._check_bounds(lin_fim - 1, col_fim - 1)
+                for linha in range(lin_ini - 1, lin_fim):
+                    for coluna in range(col_ini - 1, col_fim):
+                        self._formats[(linha, coluna)] = format.get("numberFormat", {})
+            return {}
+        return self.spreadsheet.request("batchUpdate", formatar)
+
+
+# Planilha simulada, com suas abas
+class SimulatedSpreadsheet:
+    def __init__(self, backend, spreadsheet_id, titles, rows, cols):
+        self._backend = backend
+        self.id = spreadsheet_id
+        self._worksheets = {
+            title: SimulatedWorksheet(self, sheet_id, title, rows, cols) for sheet_id, title in enumerate(titles)
+        }
+
+    def request(self, chamada, func):
+        return self._backend.request(self.id, chamada, func)
+
+    def worksheet(self, title):
+        try:
+            return self._worksheets[title]
+        except KeyError:
+            raise SimulatedAPIError(404, f"aba {title!r} não encontrada") from None
+
+    # Títulos das abas, na ordem de criação
+    def titles(self):
+        return list(self._worksheets)
+
+    # Ler vários intervalos ("'aba'!B:B") numa única requisição, no formato da API
+    def values_batch_get(self, ranges, params=None):
+        colunas = (params or {}).get("majorDimension") == "COLUMNS"
+        formatted = (params or {}).get("valueRenderOption", "FORMATTED_VALUE") == "FORMATTED_VALUE"
+
+        def ler():
+            intervalos = []
+            for a1 in ranges:
+                title, _, celulas = a1.rpartition("!")
+                sheet = self.worksheet(title[1:-1].replace("''", "'") if title.startswith("'") else title)
+                lin_ini, col_ini, lin_fim, col_fim = a1_to_bounds(celulas, sheet.row_count)
+                valores = sheet._all_values(formatted)
+                linhas = [linha[col_ini - 1:col_fim] for linha in valores[lin_ini - 1:lin_fim]]
+                if colunas:
+                    largura = max(map(len, linhas), default=0)
+                    linhas = [[linha[j] if j < len(linha) else "" for linha in linhas] for j in range(largura)]
+                # Como na API, as células vazias do fim ficam de fora
+                linhas = [list(linha) for linha in linhas]
+                for linha in linhas:
+                    while linha and linha[-1] == "":
+                        linha.pop()
+                while linhas and not linhas[-1]:
+                    linhas.pop()
+                intervalo = {"range": a1}
+                if linhas:
+                    intervalo["values"] = linhas
+                intervalos.append(intervalo)
+            return {"spreadsheetId": self.id, "valueRanges": intervalos}
+        return self.request("values.batchGet", ler)
+
+    # Aplicar as operações do batchUpdate usadas pelo bot; como no Google, ou todas valem ou nenhuma
+    def batch_update(self, body):
+        return self.request("batchUpdate", lambda: self._apply(body["requests"]))
+
+    def _apply(self, requests):
+        por_id = {sheet.id: sheet for sheet in self._worksheets.values()}
+        linhas = {sheet_id: sheet.row_count for sheet_id, sheet in por_id.items()}
+        colunas = {sheet_id: sheet.col_count for sheet_id, sheet in por_id.items()}
+        novas = {}
+        operacoes = []
+        for req in requests:
+            (tipo, dados), = req.items()
+            if tipo == "addSheet":
+                propriedades = dados["properties"]
+                if propriedades["sheetId"] in linhas or propriedades["title"] in self._worksheets or (
+                        propriedades["title"] in {p["title"] for p in novas.values()}):
+                    raise SimulatedAPIError(400, f"já existe uma aba chamada {propriedades['title']!r}")
+                novas[propriedades["sheetId"]] = propriedades
+                linhas[propriedades["sheetId"]] = propriedades["gridProperties"]["rowCount"]
+                colunas[propriedades["sheetId"]] = propriedades["gridProperties"]["columnCount"]
+            elif tipo == "appendDimension":
+                grade = linhas if dados["dimension"] == "ROWS" else colunas
+                grade[dados["sheetId"]] += dados["length"]
+            elif tipo == "deleteDimension":
+                intervalo = dados["range"]
+                if intervalo["dimension"] != "ROWS" or intervalo["endIndex"] > linhas[intervalo["sheetId"]]:
+                    raise SimulatedAPIError(400, "o intervalo ultrapassa os limites da grade")
+                linhas[intervalo["sheetId"]] -= intervalo["endIndex"] - intervalo["startIndex"]
+            elif tipo == "updateCells":
+                inicio = dados["start"]
+                fim = inicio["rowIndex"] + len(dados["rows"])
+                largura = inicio["columnIndex"] + max((len(linha["values"]) for linha in dados["rows"]), default=0)
+                if fim > linhas[inicio["sheetId"]] or largura > colunas[inicio["sheetId"]]:
+                    raise SimulatedAPIError(400, "o intervalo ultrapassa os limites da grade")
+            elif tipo == "repeatCell":
+                intervalo = dados["range"]
+                if (intervalo["endRowIndex"] > linhas[intervalo["sheetId"]]
+                        or intervalo["endColumnIndex"] > colunas[intervalo["sheetId"]]):
+                    raise SimulatedAPIError(400, "o intervalo ultrapassa os limites da grade")
+            elif tipo == "updateDimensionProperties":
+                intervalo = dados["range"]
+                if intervalo["dimension"] != "COLUMNS" or intervalo["endIndex"] > colunas[intervalo["sheetId"]]:
+                    raise SimulatedAPIError(400, "o intervalo ultrapassa os limites da grade")
+            else:
+                raise SimulatedAPIError(400, f"operação não suportada pelo simulador: {tipo}")
+            operacoes.append((tipo, dados))
+
+        respostas = []
+        for sheet_id, propriedades in novas.items():
+            grade = propriedades["gridProperties"]
+            sheet = SimulatedWorksheet(self, sheet_id, propriedades["title"], grade["rowCount"], grade["columnCount"])
+            self._worksheets[sheet.title] = por_id[sheet_id] = sheet
+        for sheet_id, total in linhas.items():
+            por_id[sheet_id].row_count = total
+            por_id[sheet_id].col_count = colunas[sheet_id]
+        for tipo, dados in operacoes:
+            respostas.append({"addSheet": {"properties": novas[dados["properties"]["sheetId"]]}}
+                             if tipo == "addSheet" else {})
+            if tipo == "updateCells":
+                sheet = por_id[dados["start"]["sheetId"]]
+                for i, linha in enumerate(dados["rows"]):
+                    for j, celula in enumerate(linha["values"]):
+                        posicao = (dados["start"]["rowIndex"] + i, dados["start"]["columnIndex"] + j)
+                        valor = celula.get("userEnteredValue")
+                        if valor is None:
+                            sheet._cells.pop(posicao, None)  # Célula sem valor: apagar o conteúdo
+                        else:
+                            sheet._cells[posicao] = valor["numberValue"] if "numberValue" in valor else valor["stringValue"]
+            elif tipo == "repeatCell":
+                intervalo = dados["range"]
+                formato = dados["cell"]["userEnteredFormat"].get("numberFormat", {})
+                sheet = por_id[intervalo["sheetId"]]
+                for linha in range(intervalo["startRowIndex"], intervalo["endRowIndex"]):
+                    for coluna in range(intervalo["startColumnIndex"], intervalo["endColumnIndex"]):
+                        sheet._formats[(linha, coluna)] = formato
+            elif tipo == "deleteDimension":
+                intervalo = dados["range"]
+                por_id[intervalo["sheetId"]]._remove_rows(intervalo["startIndex"], intervalo["endIndex"])
+            elif tipo == "updateDimensionProperties":
+                intervalo = dados["range"]
+                sheet = por_id[intervalo["sheetId"]]
+                for coluna in range(intervalo["startIndex"], intervalo["endIndex"]):
+                    if dados["properties"].get("hiddenByUser"):
+                        sheet._hidden.add(coluna)
+                    else:
+                        sheet._hidden.discard(coluna)
+        return {"replies": respostas}
+
+
+# Simulador do Google Sheets em memória. Cada requisição espera a latência configurada e conta para a cota
+# por minuto do projeto (excedida, devolve 429); error_rate sorteia 429 extras. request_hook recebe
+# (spreadsheet_id, tipo de chamada, função da requisição), para o bot passar tudo pelo agendador de cota.
+class SimulatedSheets:
+    def __init__(self, latency=0.05, jitter=0.5, quota_per_minute=300, error_rate=0.0,
+                 auto_create=True, titles=("APOSTAS",), rows=1000, cols=26, request_hook=_direct, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_per_minute = quota_per_minute
+        self.error_rate = error_rate
+        self._auto_create = auto_create
+        self._titles = tuple(titles)
+        self._rows = rows
+        self._cols = cols
+        self._request_hook = request_hook
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._spreadsheets = {}
+        self._recentes = deque()  # Instantes das requisições aceitas no último minuto
+        self.stats = {"requisicoes": 0, "cota_excedida": 0, "erros_sorteados": 0}
+
+    # Criar uma planilha vazia (com as abas padrão)
+    def create(self, spreadsheet_id):
+        with self._lock:
+            return self._create(spreadsheet_id)
+
+    def _create(self, spreadsheet_id):
+        planilha = self._spreadsheets.get(spreadsheet_id)
+        if planilha is None:
+            planilha = SimulatedSpreadsheet(self, spreadsheet_id, self._titles, self._rows, self._cols)
+            self._spreadsheets[spreadsheet_id] = planilha
+        return planilha
+
+    # Valores de uma aba sem passar pela cota nem pela latência (para conferir o resultado de um teste);
+    # None se a planilha nunca foi aberta
+    def values(self, spreadsheet_id, title):
+        with self._lock:
+            planilha = self._spreadsheets.get(spreadsheet_id)
+            return None if planilha is None else planilha.worksheet(title)._all_values()
+
+    # Colunas ocultas de uma aba (começando em 0), também sem passar pela cota
+    def hidden_columns(self, spreadsheet_id, title):
+        with self._lock:
+            return sorted(self._spreadsheets[spreadsheet_id].worksheet(title)._hidden)
+
+    # Editar uma célula como um usuário faria pela interface do Sheets (linha e coluna começando em 1)
+    def edit_cell(self, spreadsheet_id, title, row, col, value):
+        with self._lock:
+            sheet = self._spreadsheets[spreadsheet_id].worksheet(title)
+            if value == "":
+                sheet._cells.pop((row - 1, col - 1), None)
+            else:
+                sheet._cells[(row - 1, col - 1)] = value
+
+    # Excluir linhas como um usuário faria pela interface: as de baixo sobem e a grade diminui
+    def delete_rows(self, spreadsheet_id, title, start, count=1):
+        with self._lock:
+            sheet = self._spreadsheets[spreadsheet_id].worksheet(title)
+            sheet._remove_rows(start - 1, start - 1 + count)
+            sheet.row_count -= count
+
+    # Títulos das abas de uma planilha (lista vazia se ela nunca foi aberta)
+    def titles(self, spreadsheet_id):
+        with self._lock:
+            planilha = self._spreadsheets.get(spreadsheet_id)
+            return [] if planilha is None else planilha.titles()
+
+    # Abrir as abas pedidas com uma única leitura dos metadados; com create_from, as que não existem são criadas
+    # (todas numa única requisição) com o cabeçalho dessa outra aba
+    def open_worksheets(self, spreadsheet_id, titles, create_from=None):
+        def abrir():
+            planilha = self._spreadsheets.get(spreadsheet_id)
+            if planilha is None:
+                if not self._auto_create:
+                    raise SimulatedAPIError(404, f"planilha {spreadsheet_id!r} não encontrada")
+                planilha = self._create(spreadsheet_id)
+            return planilha, dict(planilha._worksheets)
+        planilha, abas = self.request(spreadsheet_id, "metadata", abrir)
+        faltando = [title for title in titles if title not in abas]
+        if faltando:
+            if create_from is None or create_from not in abas:
+                raise SimulatedAPIError(404, f"aba {faltando[0]!r} não encontrada")
+            base = abas[create_from]
+            resposta = planilha.batch_update({"requests": new_tab_requests(
+                faltando, base, base.row_values(1), {aba.id for aba in abas.values()})})
+            for reply in resposta["replies"]:
+                if "addSheet" in reply:
+                    title = reply["addSheet"]["properties"]["title"]
+                    abas[title] = planilha.worksheet(title)
+        return {title: abas[title] for title in titles}
+
+    def request(self, spreadsheet_id, chamada, func):
+        return self._request_hook(spreadsheet_id, chamada, lambda: self._execute(func))
+
+    def _execute(self, func):
+        if self.latency > 0:
+            time.sleep(self.latency * self._random.uniform(1 - self.jitter, 1 + self.jitter))
+        with self._lock:
+            agora = time.monotonic()
+            while self._recentes and agora - self._recentes[0] >= 60:
+                self._recentes.popleft()
+            if self.quota_per_minute and len(self._recentes) >= self.quota_per_minute:
+                self.stats["cota_excedida"] += 1
+                raise SimulatedAPIError(429, "cota de requisições por minuto excedida")
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.stats["erros_sorteados"] += 1
+                raise SimulatedAPIError(429, "cota de requisições excedida (sorteado)")
+            self._recentes.append(agora)
+            self.stats["requisicoes"] += 1
+            # A requisição é aplicada de uma vez, como no Google
+            return func()
+
+    def is_quota_error(self, error):
+        return isinstance(error, SimulatedAPIError) and error.code == 429
+
+    def is_access_error(self, error):
+        return isinstance(error, SimulatedAPIError) and error.code in (403, 404)
+
+    def is_invalid_request_error(self, error):
+        return isinstance(error, SimulatedAPIError) and error.code == 400
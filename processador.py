@@ -0,0 +1,40 @@
+# Processador de atualizações do Telegram usado pelo bot (importado só ao iniciar o bot, em main())
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+# Processador de atualizações que mantém a ordem de chegada das mensagens de cada usuário:
+# usuários diferentes são atendidos em paralelo, as mensagens de um mesmo usuário uma de cada vez
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._user_locks = {}
+
+    # A vez do usuário vem antes da vaga geral, para um usuário com muitas mensagens não ocupar todas as vagas
+    async def process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await super().process_update(update, coroutine)
+            return
+
+        # user_id -> [trava, atualizações do usuário aguardando ou em andamento]
+        entrada = self._user_locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entrada[1] -= 1
+            if not entrada[1]:
+                del self._user_locks[user.id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
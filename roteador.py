@@ -0,0 +1,155 @@
+# Roteador de webhook para rodar vários processos do bot (BOT_MODE=worker) dividindo a carga
+#
+# O Telegram envia as atualizações para o roteador, que repassa cada uma ao bot responsável pelo usuário
+# (hash consistente do user_id). As mensagens de um mesmo usuário vão sempre para o mesmo bot e uma de cada
+# vez, na ordem de chegada; se esse bot não responde, a atualização vai para o próximo do anel. O estado dos
+# usuários, o registro das planilhas e a fila ficam em SQLite, compartilhados por todos os bots.
+#
+# Uso (cada bot com WEBHOOK_PORT próprio; os bots não registram webhook, o público aponta para o roteador):
+#   BOT_MODE=worker WEBHOOK_PORT=8081 python botforma.py
+#   BOT_MODE=worker WEBHOOK_PORT=8082 python botforma.py
+#   python roteador.py --porta 8443 http://127.0.0.1:8081 http://127.0.0.1:8082
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+
+import httpx
+from dotenv import load_dotenv
+from loguru import logger
+from tornado.web import Application, RequestHandler
+
+# Carregar as variáveis de ambiente do arquivo .env (antes de ler as configurações abaixo)
+load_dotenv()
+
+# Caminho do endpoint do webhook (o mesmo nos bots) e segredo enviado pelo Telegram
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Pontos de cada bot no anel: quanto mais pontos, mais uniforme a divisão dos usuários
+RING_REPLICAS = int(os.getenv("ROUTER_RING_REPLICAS", "160"))
+# Tempo máximo (em segundos) para um bot aceitar uma atualização
+FORWARD_TIMEOUT = float(os.getenv("ROUTER_FORWARD_TIMEOUT", "10"))
+
+
+# Função para calcular a posição de uma chave no anel
+def ring_position(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+# Anel de hash consistente: ao entrar ou sair um bot, só os usuários dele mudam de lugar
+class HashRing:
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        self._nodes = list(dict.fromkeys(nodes))
+        pontos = sorted((ring_position(f"{node}#{i}"), node) for node in self._nodes for i in range(replicas))
+        self._positions = [posicao for posicao, _ in pontos]
+        self._owners = [node for _, node in pontos]
+
+    # Bots em ordem de preferência para a chave: o responsável primeiro, depois os seguintes no anel
+    def nodes_for(self, key):
+        inicio = bisect.bisect(self._positions, ring_position(key))
+        vistos = []
+        for i in range(len(self._owners)):
+            node = self._owners[(inicio + i) % len(self._owners)]
+            if node not in vistos:
+                vistos.append(node)
+                if len(vistos) == len(self._nodes):
+                    break
+        return vistos
+
+
+# Função para obter a chave de roteamento de uma atualização: o usuário que a enviou (ou o chat)
+def routing_key(update):
+    for valor in update.values():
+        if isinstance(valor, dict):
+            remetente = valor.get("from") or valor.get("user")
+            if isinstance(remetente, dict) and "id" in remetente:
+                return f"user:{remetente['id']}"
+            chat = valor.get("chat") or (valor.get("message") or {}).get("chat")
+            if isinstance(chat, dict) and "id" in chat:
+                return f"chat:{chat['id']}"
+    return f"update:{update.get('update_id')}"
+
+
+# Estado compartilhado do roteador: o anel, o cliente HTTP e a fila de cada usuário
+class Router:
+    def __init__(self, workers):
+        self.ring = HashRing(workers)
+        self.client = httpx.AsyncClient(timeout=FORWARD_TIMEOUT, limits=httpx.Limits(max_connections=256))
+        self._key_locks = {}  # chave -> [trava, atualizações aguardando ou em andamento]
+
+    # Repassar a atualização ao bot responsável, mantendo a ordem das atualizações de cada usuário
+    async def forward(self, key, body):
+        entrada = self._key_locks.setdefault(key, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                return await self._send(key, body)
+        finally:
+            entrada[1] -= 1
+            if not entrada[1]:
+                del self._key_locks[key]
+
+    # Enviar ao primeiro bot do anel que aceitar; devolve o status HTTP para o Telegram
+    async def _send(self, key, body):
+        headers = {"Content-Type": "application/json"}
+        if WEBHOOK_SECRET:
+            headers[SECRET_HEADER] = WEBHOOK_SECRET
+        for worker in self.ring.nodes_for(key):
+            try:
+                resposta = await self.client.post(f"{worker.rstrip('/')}/{WEBHOOK_PATH}", content=body, headers=headers)
+            except httpx.HTTPError as e:
+                logger.warning("Erro ao repassar a atualização para {}: {}", worker, e)
+                continue
+            if resposta.status_code < 500:
+                return resposta.status_code
+            logger.warning("O bot {} respondeu {}", worker, resposta.status_code)
+        # Nenhum bot disponível: o Telegram tenta de novo mais tarde
+        return 503
+
+
+# Endpoint que recebe as atualizações do Telegram
+class WebhookHandler(RequestHandler):
+    def initialize(self, router):
+        self.router = router
+
+    async def post(self):
+        if WEBHOOK_SECRET and self.request.headers.get(SECRET_HEADER) != WEBHOOK_SECRET:
+            self.set_status(403)
+            return
+        try:
+            update = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        self.set_status(await self.router.forward(routing_key(update), self.request.body))
+
+
+async def serve(listen, porta, workers):
+    router = Router(workers)
+    app = Application([(rf"/{WEBHOOK_PATH}/?", WebhookHandler, {"router": router})])
+    app.listen(porta, address=listen)
+    logger.info("Roteando atualizações de {}:{}/{} para {} bot(s)", listen, porta, WEBHOOK_PATH, len(workers))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await router.client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Roteador de webhook para vários processos do bot")
+    parser.add_argument("workers", nargs="+", help="URL base de cada bot, ex.: http://127.0.0.1:8081")
+    parser.add_argument("--listen", default=os.getenv("WEBHOOK_LISTEN", "127.0.0.1"))
+    parser.add_argument("--porta", type=int, default=int(os.getenv("WEBHOOK_PORT", "8443")))
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.listen, args.porta, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
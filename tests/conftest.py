@@ -0,0 +1,67 @@
+# Configuração dos testes: bancos SQLite num diretório temporário e o diretório do projeto no caminho de importação,
+# antes de qualquer teste importar o botforma (as configurações são lidas na importação)
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+_pasta = tempfile.mkdtemp(prefix="botsheets-testes-")
+os.environ.setdefault("QUEUE_DB_FILE", os.path.join(_pasta, "fila.db"))
+os.environ.setdefault("USER_REGISTRY_DB", os.path.join(_pasta, "usuarios.db"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+# Bot falso que imita o controle de flood do Telegram: mensagens maiores que o limite são recusadas e, num mesmo
+# chat, mensagens mais próximas que o intervalo recebem RetryAfter
+class StubBot:
+    def __init__(self, intervalo, latencia=0.01):
+        self._intervalo = intervalo
+        self._latencia = latencia
+        self._ultima = {}
+        self.recebidas = {}
+        self.recusadas = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        from telegram.error import BadRequest, RetryAfter
+
+        await asyncio.sleep(self._latencia)
+        if len(text) > 4096:
+            raise BadRequest("Message is too long")
+        agora = time.monotonic()
+        if agora - self._ultima.get(chat_id, -math.inf) < self._intervalo:
+            self.recusadas += 1
+            raise RetryAfter(max(1, math.ceil(self._intervalo)) if self._intervalo >= 1 else 0)
+        self._ultima[chat_id] = agora
+        self.recebidas.setdefault(chat_id, []).append(text)
+        return text
+
+
+# Classe do bot falso, para cada teste escolher o intervalo do controle de flood
+@pytest.fixture
+def stub_bot():
+    return StubBot
+
+
+# Respostas de uma colagem com N apostas: mensagens formatadas do corpus do parser e o resumo no final
+@pytest.fixture
+def make_replies():
+    from formatador import process_message
+
+    with open(os.path.join(RAIZ, "corpus_parser.json"), encoding="utf-8") as f:
+        mensagens = [caso["mensagem"] for caso in json.load(f)]
+    formatadas = [texto for texto in (process_message(m)[0] for m in mensagens) if texto]
+
+    def montar(apostas):
+        respostas = [formatadas[i % len(formatadas)] for i in range(apostas)]
+        return respostas + [f"{apostas} apostas recebidas com sucesso."]
+
+    return montar
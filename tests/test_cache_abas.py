@@ -0,0 +1,146 @@
+# Testes do cache de abas abertas (get_worksheets) contra um cliente gspread falso, sem rede
+import gspread
+import pytest
+
+import botforma
+from planilhas import GspreadBackend
+
+
+# Aba falsa: só o que o cache e a gravação usam
+class FakeWorksheet:
+    def __init__(self, spreadsheet, sheet_id, title):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.row_count = 1000
+        self.col_count = 26
+
+
+# Planilha falsa que conta as leituras de metadados
+class FakeSpreadsheet:
+    def __init__(self, client, spreadsheet_id, titles):
+        self.client = client
+        self.id = spreadsheet_id
+        self._abas = [FakeWorksheet(self, i, title) for i, title in enumerate(titles)]
+
+    def worksheets(self):
+        self.client.leituras += 1
+        return list(self._abas)
+
+    def values_batch_get(self, ranges, params=None):
+        if self.client.sem_acesso:
+            raise PermissionError("o bot não é mais editor da planilha")
+        return {"valueRanges": [{"range": a1} for a1 in ranges]}
+
+
+# Cliente gspread falso: abre planilhas conhecidas e conta as aberturas
+class FakeClient:
+    def __init__(self):
+        self.planilhas = {}
+        self.aberturas = 0
+        self.leituras = 0
+        self.sem_acesso = False
+
+    def add(self, spreadsheet_id, *titles):
+        self.planilhas[spreadsheet_id] = FakeSpreadsheet(self, spreadsheet_id, titles or (botforma.SHEET_NAME,))
+
+    def open_by_key(self, key):
+        self.aberturas += 1
+        if key not in self.planilhas:
+            raise gspread.exceptions.SpreadsheetNotFound(key)
+        return self.planilhas[key]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = FakeClient()
+    monkeypatch.setattr(botforma, "sheet_backend", GspreadBackend(lambda: fake))
+    botforma._sheet_cache.clear()
+    botforma._next_free_row.clear()
+    for chave in botforma.sheet_cache_stats:
+        botforma.sheet_cache_stats[chave] = 0
+    yield fake
+    botforma._sheet_cache.clear()
+    botforma._next_free_row.clear()
+
+
+def test_segunda_abertura_vem_do_cache(client):
+    client.add("p1")
+    primeira = botforma.get_worksheet("p1")
+    segunda = botforma.get_worksheet("p1")
+
+    assert segunda is primeira
+    assert client.aberturas == 1
+    assert botforma.sheet_cache_stats["hits"] == 1
+    assert botforma.sheet_cache_stats["misses"] == 1
+
+
+def test_abas_de_uma_planilha_abertas_juntas(client):
+    client.add("p1", "APOSTAS", "APOSTAS - Futebol", "APOSTAS - Tênis")
+    abas = botforma.get_worksheets("p1", ["APOSTAS - Futebol", "APOSTAS - Tênis"])
+
+    assert [aba.title for aba in abas.values()] == ["APOSTAS - Futebol", "APOSTAS - Tênis"]
+    assert (client.aberturas, client.leituras) == (1, 1)
+    # As duas abas ficaram no cache
+    botforma.get_worksheets("p1", ["APOSTAS - Tênis", "APOSTAS - Futebol"])
+    assert client.aberturas == 1
+
+
+def test_invalidar_reabre_a_planilha(client):
+    client.add("p1", "APOSTAS", "OUTRA")
+    botforma.get_worksheets("p1", ["APOSTAS", "OUTRA"])
+
+    botforma.invalidate_sheet("p1", "OUTRA")
+    botforma.get_worksheet("p1")
+    assert client.aberturas == 1  # A aba APOSTAS continua no cache
+    botforma.get_worksheet("p1", "OUTRA")
+    assert client.aberturas == 2
+
+    # Sem título, todas as abas da planilha saem do cache
+    botforma.invalidate_sheet("p1")
+    assert botforma.sheet_cache_stats["invalidations"] == 3
+    botforma.get_worksheets("p1", ["APOSTAS", "OUTRA"])
+    assert client.aberturas == 3
+
+
+def test_entrada_expirada_reabre(client, monkeypatch):
+    client.add("p1")
+    botforma.get_worksheet("p1")
+    monkeypatch.setattr(botforma, "SHEET_CACHE_TTL", 0)
+
+    botforma.get_worksheet("p1")
+    assert client.aberturas == 2
+    assert botforma.sheet_cache_stats["hits"] == 0
+
+
+def test_cache_cheio_descarta_a_menos_usada(client, monkeypatch):
+    monkeypatch.setattr(botforma, "SHEET_CACHE_MAX_SIZE", 2)
+    for spreadsheet_id in ("p1", "p2", "p3"):
+        client.add(spreadsheet_id)
+    botforma.get_worksheet("p1")
+    botforma.get_worksheet("p2")
+    botforma.get_worksheet("p1")  # p1 passa a ser a mais recente
+    botforma.get_worksheet("p3")  # p2 sai do cache
+
+    assert botforma.sheet_cache_stats["evictions"] == 1
+    aberturas = client.aberturas
+    botforma.get_worksheet("p1")
+    assert client.aberturas == aberturas
+    botforma.get_worksheet("p2")
+    assert client.aberturas == aberturas + 1
+
+
+def test_planilha_inexistente_nao_entra_no_cache(client):
+    with pytest.raises(gspread.exceptions.SpreadsheetNotFound):
+        botforma.get_worksheet("nao-existe")
+    assert not botforma._sheet_cache
+
+
+def test_perda_de_acesso_descarta_a_planilha(client):
+    client.add("p1")
+    botforma.get_worksheet("p1")
+    client.sem_acesso = True
+
+    with pytest.raises(PermissionError):
+        botforma.append_bets_to_sheet("p1", [{"bookmaker": "Betano"}])
+    assert ("p1", botforma.SHEET_NAME) not in botforma._sheet_cache
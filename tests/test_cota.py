@@ -0,0 +1,96 @@
+# Testes do agendador de cota do Google Sheets (SheetsQuotaScheduler): limite por planilha e global, vez
+# alternada entre as planilhas e pausa de todas as requisições no 429. Usam intervalos curtos e threads, como as
+# do pool que chamam o agendador.
+import threading
+import time
+
+import pytest
+
+import botforma
+from botforma import SheetsQuotaScheduler
+
+
+# Função para fazer n requisições da planilha em outra thread, anotando (planilha, instante) de cada uma
+def requisicoes(scheduler, spreadsheet_id, n, atendidas):
+    def rodar():
+        for _ in range(n):
+            scheduler.acquire(spreadsheet_id)
+            atendidas.append((spreadsheet_id, time.monotonic()))
+
+    thread = threading.Thread(target=rodar)
+    thread.start()
+    return thread
+
+
+# Erro da API com o código HTTP em .code, como os do gspread e do simulador
+class APIError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def test_planilha_movimentada_nao_gasta_o_orcamento_das_outras():
+    # 20 requisições/s por planilha (rajada de 2) e um limite global folgado
+    scheduler = SheetsQuotaScheduler(60000, 1200, 2, 1, 1)
+    atendidas = []
+    inicio = time.monotonic()
+    ocupada = requisicoes(scheduler, "a", 12, atendidas)
+    time.sleep(0.1)
+
+    # A planilha "a" está sem fichas, mas "b" tem as próprias
+    antes = time.monotonic()
+    scheduler.acquire("b")
+    scheduler.acquire("b")
+    assert time.monotonic() - antes < 0.05
+    assert "a" in scheduler.throttled_sheets() and "b" in scheduler.throttled_sheets()
+
+    ocupada.join()
+    # 12 requisições com 2 de rajada: pelo menos 10 esperaram a ficha da própria planilha (1/20 s cada)
+    assert atendidas[-1][1] - inicio >= 10 / 20 * 0.9
+
+
+def test_orcamento_global_e_dividido_entre_as_planilhas():
+    # Limite global de 20 requisições/s (sem rajada) e limite por planilha folgado
+    scheduler = SheetsQuotaScheduler(1200, 60000, 1, 1, 1)
+    atendidas = []
+    movimentada = requisicoes(scheduler, "a", 20, atendidas)
+    time.sleep(0.1)
+    outra = requisicoes(scheduler, "b", 4, atendidas)
+    movimentada.join()
+    outra.join()
+
+    ordem = [spreadsheet_id for spreadsheet_id, _ in atendidas]
+    primeira_b = ordem.index("b")
+    # Com a vez alternada, as 4 de "b" saem intercaladas com as de "a", sem esperar a fila de "a" acabar
+    assert ordem[primeira_b:primeira_b + 8].count("b") == 4
+    intervalos = [b - a for (_, a), (_, b) in zip(atendidas, atendidas[1:])]
+    assert min(intervalos) >= 1 / 20 * 0.8
+
+
+def test_429_pausa_todas_as_requisicoes(monkeypatch):
+    scheduler = SheetsQuotaScheduler(60000, 60000, 10, 0.3, 1)
+    monkeypatch.setattr(botforma, "sheets_scheduler", scheduler)
+
+    def cota_excedida():
+        raise APIError(429)
+
+    with pytest.raises(APIError):
+        botforma.scheduled_request("a", "values.get", cota_excedida)
+    assert not scheduler.has_budget()
+
+    # A pausa vale para qualquer planilha, não só para a que recebeu o 429
+    antes = time.monotonic()
+    assert botforma.scheduled_request("b", "values.get", lambda: "ok") == "ok"
+    assert time.monotonic() - antes >= 0.3 * 0.95
+    assert scheduler.has_budget()
+
+
+def test_pausa_dobra_com_429_seguidos_e_zera_no_sucesso():
+    scheduler = SheetsQuotaScheduler(60000, 60000, 10, 0.1, 0.3)
+
+    for pausa in (0.1, 0.2, 0.3, 0.3):
+        scheduler.quota_exceeded()
+        assert scheduler._pause == pytest.approx(pausa)
+    scheduler.succeeded()
+    scheduler.quota_exceeded()
+    assert scheduler._pause == pytest.approx(0.1)
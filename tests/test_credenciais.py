@@ -0,0 +1,129 @@
+# Testes do gerenciador de credenciais contra um endpoint de token falso (servidor HTTP local, sem rede)
+import functools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from credenciais import CredentialManager
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+
+# Endpoint de token falso: cada pedido recebe um token novo (token-1, token-2, ...) com a validade configurada
+class FakeTokenServer(ThreadingHTTPServer):
+    def __init__(self, expires_in):
+        super().__init__(("127.0.0.1", 0), FakeTokenHandler)
+        self.expires_in = expires_in
+        self.pedidos = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/token"
+
+
+class FakeTokenHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.pedidos += 1
+        corpo = json.dumps({
+            "access_token": f"token-{self.server.pedidos}", "expires_in": self.server.expires_in, "token_type": "Bearer",
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+# Chave RSA da conta de serviço falsa (gerada uma vez para todos os testes)
+@functools.lru_cache
+def _private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode("ascii")
+
+
+# Função para subir o endpoint falso e gravar uma conta de serviço (chave RSA própria) que aponta para ele
+def _setup(tmp_path, expires_in):
+    servidor = FakeTokenServer(expires_in)
+    threading.Thread(target=servidor.serve_forever, args=(0.05,), daemon=True).start()
+    arquivo = tmp_path / "credenciais.json"
+    arquivo.write_text(json.dumps({
+        "type": "service_account", "project_id": "teste", "private_key_id": "1", "private_key": _private_key(),
+        "client_email": "bot@teste.iam.gserviceaccount.com", "client_id": "1", "token_uri": servidor.url,
+    }))
+    return servidor, str(arquivo)
+
+
+@pytest.fixture
+def endpoint(tmp_path):
+    servidores = []
+
+    def criar(expires_in=3600):
+        servidor, arquivo = _setup(tmp_path, expires_in)
+        servidores.append(servidor)
+        return servidor, arquivo
+
+    yield criar
+    for servidor in servidores:
+        servidor.shutdown()
+        servidor.server_close()
+
+
+def test_token_e_reaproveitado_ate_perto_de_expirar(endpoint):
+    servidor, arquivo = endpoint()
+    manager = CredentialManager(arquivo, SCOPES)
+
+    assert [manager.token() for _ in range(5)] == ["token-1"] * 5
+    assert servidor.pedidos == 1
+    assert manager.stats == {"renovacoes": 1, "renovacoes_na_hora": 1, "falhas": 0}
+
+
+def test_renovacao_em_segundo_plano_antes_de_expirar(endpoint):
+    # Tokens de 60s renovados com 59,8s de antecedência: a thread renova a cada ~0,2s
+    servidor, arquivo = endpoint(expires_in=60)
+    manager = CredentialManager(arquivo, SCOPES, margin=59.8)
+    manager.start()
+    try:
+        prazo = time.monotonic() + 10
+        # A primeira renovação também acontece na thread
+        while manager.stats["renovacoes"] < 1 and time.monotonic() < prazo:
+            time.sleep(0.01)
+        while manager.stats["renovacoes"] < 3 and time.monotonic() < prazo:
+            assert manager.token().startswith("token-")
+            time.sleep(0.01)
+    finally:
+        manager.stop()
+
+    assert manager.stats["renovacoes"] >= 3
+    # Nenhuma requisição precisou esperar pela renovação
+    assert manager.stats["renovacoes_na_hora"] == 0
+    assert manager.stats["falhas"] == 0
+
+
+def test_token_recusado_e_trocado(endpoint):
+    servidor, arquivo = endpoint()
+    manager = CredentialManager(arquivo, SCOPES)
+    token = manager.token()
+
+    assert manager.invalidate(token) == "token-2"
+    # Um token antigo recusado depois da troca não provoca outra renovação
+    assert manager.invalidate(token) == "token-2"
+    assert servidor.pedidos == 2
+
+
+def test_credenciais_do_gspread_usam_o_token_do_gerenciador(endpoint):
+    _, arquivo = endpoint()
+    credentials = CredentialManager(arquivo, SCOPES).credentials()
+    headers = {}
+
+    credentials.before_request(None, "GET", "https://sheets.googleapis.com/", headers)
+    assert headers["authorization"] == "Bearer token-1"
@@ -0,0 +1,53 @@
+# Testes da camada de envio das mensagens (pack_messages e OutboundMessages) contra um bot falso com controle de flood
+import asyncio
+import time
+
+from botforma import TELEGRAM_MESSAGE_LIMIT, OutboundMessages, pack_messages
+
+
+def test_textos_juntados_sem_passar_do_limite(make_replies):
+    respostas = make_replies(200)
+    mensagens = list(pack_messages(respostas))
+
+    assert all(len(mensagem) <= TELEGRAM_MESSAGE_LIMIT for mensagem in mensagens)
+    # Nada se perde nem muda de ordem, e cada mensagem só fecha quando o próximo texto não cabe mais nela
+    assert "\n\n".join(mensagens) == "\n\n".join(respostas)
+    assert len(mensagens) < len(respostas)
+    assert all(len(mensagem) + 2 + len(respostas[0]) > TELEGRAM_MESSAGE_LIMIT or mensagem == mensagens[-1]
+               for mensagem in mensagens)
+
+
+def test_texto_maior_que_o_limite_e_cortado():
+    mensagens = list(pack_messages(["a", "b" * 5000, "c"], limite=4096))
+    assert mensagens == ["a", "b" * 4096, "b" * 904 + "\n\nc"]
+
+
+def test_mensagens_de_um_chat_chegam_na_ordem_e_no_ritmo(stub_bot):
+    # O Telegram falso recusa duas mensagens no mesmo chat com menos de 40ms entre elas; a camada espaça em 50ms
+    bot = stub_bot(0.04, latencia=0)
+    outbound = OutboundMessages(0.05, 1000, 0)
+
+    async def enviar():
+        await asyncio.gather(*(outbound.send(bot, chat, [f"{chat}-{i}"]) for i in range(5) for chat in (1, 2)))
+
+    asyncio.run(enviar())
+    assert bot.recusadas == 0
+    assert bot.recebidas == {chat: [f"{chat}-{i}" for i in range(5)] for chat in (1, 2)}
+    assert outbound.stats["mensagens"] == 10
+
+
+def test_retry_after_espera_o_tempo_pedido_e_reenvia(stub_bot):
+    # Sem intervalo na camada, a segunda mensagem é recusada com RetryAfter(1) e reenviada depois de 1s
+    bot = stub_bot(1, latencia=0)
+    outbound = OutboundMessages(0, 1000, 3)
+
+    async def enviar():
+        inicio = time.monotonic()
+        await outbound.send(bot, 1, ["primeira"])
+        await outbound.send(bot, 1, ["segunda"])
+        return time.monotonic() - inicio
+
+    assert asyncio.run(enviar()) >= 1
+    assert bot.recebidas == {1: ["primeira", "segunda"]}
+    assert bot.recusadas == 1
+    assert outbound.stats == {"mensagens": 2, "retry_after": 1, "falhas_rede": 0}
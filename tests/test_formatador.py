@@ -0,0 +1,44 @@
+# Testes do parser (saída esperada de cada mensagem do corpus) e do cache de apostas interpretadas (parse_bet)
+import json
+import os
+
+import pytest
+
+import formatador
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "corpus_parser.json")
+
+with open(CORPUS, encoding="utf-8") as _f:
+    CASOS = json.load(_f)
+
+
+# A mesma verificação do bench_parser.py --verificar, para uma mudança no parser não passar despercebida
+@pytest.mark.parametrize("caso", CASOS, ids=[caso["nome"] for caso in CASOS])
+def test_corpus(caso):
+    formatted_message, formatted_data = formatador.process_message(caso["mensagem"])
+    assert formatted_message == caso["formatted_message"]
+    assert formatted_data == caso["formatted_data"]
+
+
+@pytest.fixture
+def mensagem():
+    formatador.clear_parse_cache()
+    yield CASOS[0]["mensagem"]
+    formatador.clear_parse_cache()
+
+
+def test_mesmo_alerta_com_espacos_diferentes_usa_o_cache(mensagem):
+    # Encaminhado por outro usuário: espaços nas pontas, espaços repetidos e quebras de linha do Windows
+    variacao = "  " + mensagem.replace(" ", "  ").replace("\n", " \r\n") + "\n\n"
+    antes = dict(formatador.parse_cache_stats)
+
+    resultado = formatador.parse_bet(mensagem)
+    assert formatador.parse_bet(variacao) is resultado
+    assert formatador.parse_cache_stats["hits"] - antes["hits"] == 1
+    assert formatador.parse_cache_stats["misses"] - antes["misses"] == 1
+
+
+def test_padronizar_nao_muda_o_resultado_do_corpus():
+    for caso in CASOS:
+        for aposta in formatador.split_bets([caso["mensagem"]]):
+            assert formatador._parse_uncached(formatador.normalize_bet(aposta)) == formatador._parse_uncached(aposta)
@@ -0,0 +1,107 @@
+# Testes do caminho de gravação (append_bets_to_sheet e a fila) contra o simulador de planilhas em memória
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import botforma
+import importar
+from planilhas import SimulatedSheets
+
+
+# Função para montar uma aposta com o jogo informado (coluna E)
+def aposta(jogo):
+    return {
+        "bookmaker": "Betano", "date": "2024-05-12", "ev_percentage": 0.04, "game_description": jogo,
+        "bet_description": "Over de 2.5 Gols", "sport": "Futebol", "odds": 1.95, "stake": 1.0, "market": "Over 2.5",
+    }
+
+
+# Função para ler a coluna E (jogo) de uma aba do simulador, sem o cabeçalho
+def jogos(simulador, spreadsheet_id="p1", title=botforma.SHEET_NAME):
+    return [linha[4] if len(linha) > 4 else "" for linha in simulador.values(spreadsheet_id, title)[1:]]
+
+
+@pytest.fixture
+def simulador(monkeypatch):
+    sim = SimulatedSheets(latency=0, quota_per_minute=0)
+    monkeypatch.setattr(botforma, "sheet_backend", sim)
+    botforma._sheet_cache.clear()
+    botforma._next_free_row.clear()
+    yield sim
+    botforma._sheet_cache.clear()
+    botforma._next_free_row.clear()
+
+
+def test_bloco_comeca_depois_da_ultima_linha_preenchida(simulador):
+    botforma.append_bets_to_sheet("p1", [aposta(f"J{i}") for i in range(2, 7)])
+    # Usuário apaga o conteúdo da linha 3, deixando um buraco no meio da aba
+    for coluna in range(2, 11):
+        simulador.edit_cell("p1", botforma.SHEET_NAME, 3, coluna, "")
+    botforma.invalidate_next_free_row("p1")
+
+    botforma.append_bets_to_sheet("p1", [aposta("NOVA1"), aposta("NOVA2"), aposta("NOVA3")])
+    assert jogos(simulador) == ["J2", "", "J4", "J5", "J6", "NOVA1", "NOVA2", "NOVA3"]
+
+
+def test_linha_digitada_depois_da_leitura_nao_e_sobrescrita(simulador):
+    botforma.append_bets_to_sheet("p1", [aposta("J2"), aposta("J3")])
+    # Usuário digita uma linha logo abaixo enquanto o índice da próxima linha ainda está no cache
+    simulador.edit_cell("p1", botforma.SHEET_NAME, 4, 2, "Bet365")
+    simulador.edit_cell("p1", botforma.SHEET_NAME, 4, 5, "MANUAL")
+
+    botforma.append_bets_to_sheet("p1", [aposta("J5")])
+    assert jogos(simulador) == ["J2", "J3", "MANUAL", "J5"]
+
+
+def test_indice_conferido_continua_valido(simulador):
+    botforma.append_bets_to_sheet("p1", [aposta("J2")])
+    lido_em = botforma._next_free_row[("p1", botforma.SHEET_NAME)][1]
+
+    botforma.append_bets_to_sheet("p1", [aposta("J3")])
+    assert botforma._next_free_row[("p1", botforma.SHEET_NAME)] == [4, lido_em]
+    assert jogos(simulador) == ["J2", "J3"]
+
+
+def test_aposta_com_problema_nao_gasta_as_tentativas_do_lote(simulador):
+    ruim = aposta("RUIM")
+    del ruim["odds"]
+    destinos = [("fila1", botforma.SHEET_NAME, data) for data in (aposta("J2"), aposta("J3"), ruim, aposta("J5"))]
+    botforma.bet_queue.enqueue("1", None, destinos)
+    (spreadsheet_id, rows, _), = botforma.bet_queue.due_batches(10)
+
+    asyncio.run(botforma._flush_batch(SimpleNamespace(bot=None), spreadsheet_id, rows))
+
+    assert jogos(simulador, "fila1") == ["J2", "J3", "J5"]
+    restantes = botforma.bet_queue._conn.execute(
+        "SELECT dados, tentativas FROM fila WHERE spreadsheet_id = 'fila1'").fetchall()
+    assert [(dados.count("RUIM"), tentativas) for dados, tentativas in restantes] == [(1, 1)]
+
+
+def test_importacao_passa_pelo_indice_de_duplicatas_e_pela_fila(simulador):
+    # A aposta J2 já chegou pelo bot: o histórico importado não pode gravá-la de novo
+    botforma.dedup_index.filter_new("importador", [aposta("J2")])
+    novas, planilhas = importar._store_chunk("importador", "p2", ("esporte", {}), [aposta("J2"), aposta("J3")])
+    assert (novas, planilhas) == (1, {"p2"})
+
+    assert asyncio.run(importar._drain_queue(planilhas, 500)) == 0
+    assert botforma.bet_queue.pending({"p2"}) == 0
+    assert jogos(simulador, "p2", f"{botforma.SHEET_NAME} - Futebol") == ["J3"]
+
+
+def test_conciliacao_exclui_as_copias_sem_deixar_buraco(simulador):
+    apostas = [aposta("J2"), aposta("J3"), aposta("J4")]
+    ids = ["w-1", "w-2", "w-3"]
+    botforma.append_bets_to_sheet("p3", apostas, ids=ids)
+    # O bot caiu depois de gravar J3 e J4 e antes de registrar no livro: o lote foi gravado de novo
+    botforma.append_bets_to_sheet("p3", apostas[1:], ids=ids[1:])
+    botforma.append_bets_to_sheet("p3", [aposta("J5")])
+    linhas = [(row_id, n, botforma.SHEET_NAME, data) for n, (row_id, data) in enumerate(zip(ids, apostas), 1)]
+
+    faltando, editadas, copias = botforma.reconcile_sheet("p3", linhas)
+    assert (faltando, editadas, copias) == ([], 0, 2)
+    assert jogos(simulador, "p3") == ["J2", "J3", "J4", "J5"]
+
+    # A próxima aposta vai logo depois da última linha, sem buraco
+    botforma.append_bets_to_sheet("p3", [aposta("J6")])
+    assert jogos(simulador, "p3") == ["J2", "J3", "J4", "J5", "J6"]
@@ -0,0 +1,71 @@
+# Testes dos handlers de mensagens do bot com uma atualização e um bot falsos (sem Telegram e sem planilha)
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import botforma
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "corpus_parser.json")
+
+
+# Função para montar a atualização de uma mensagem de texto do usuário
+def mensagem(bot, user_id, texto):
+    return SimpleNamespace(
+        message=SimpleNamespace(text=texto, from_user=SimpleNamespace(id=user_id)),
+        effective_chat=SimpleNamespace(id=user_id),
+        get_bot=lambda: bot,
+    )
+
+
+@pytest.fixture
+def bot(monkeypatch, stub_bot):
+    # Respostas sem espera entre mensagens do mesmo chat
+    monkeypatch.setattr(botforma, "outbound", botforma.OutboundMessages(0, 1000, 0))
+    return stub_bot(0, latencia=0)
+
+
+@pytest.fixture
+def alerta():
+    with open(CORPUS, encoding="utf-8") as f:
+        return json.load(f)[0]["mensagem"]
+
+
+def test_aposta_que_nao_entrou_na_fila_pode_ser_reenviada(bot, alerta, monkeypatch):
+    user_id = 7001
+    botforma.user_registry.register(str(user_id), "https://docs.google.com/spreadsheets/d/fila-falha/edit")
+    botforma.user_state.set(str(user_id), "registrando_apostas")
+
+    enqueue = botforma.bet_queue._get().enqueue
+
+    def falhar(*args):
+        raise OSError("disco cheio")
+
+    monkeypatch.setattr(botforma.bet_queue, "enqueue", falhar)
+    asyncio.run(botforma.handle_message(mensagem(bot, user_id, alerta), None))
+    assert bot.recebidas[user_id][-1].startswith("Ocorreu um erro")
+    assert botforma.bet_queue.pending({"fila-falha"}) == 0
+
+    # A resposta pede para tentar de novo: a nova tentativa não pode ser descartada como repetida
+    monkeypatch.setattr(botforma.bet_queue, "enqueue", enqueue)
+    asyncio.run(botforma.handle_message(mensagem(bot, user_id, alerta), None))
+    assert "já tinha(m) sido enviada(s)" not in bot.recebidas[user_id][-1]
+    assert botforma.bet_queue.pending({"fila-falha"}) == 1
+
+
+def test_registrar_e_rota_consultam_o_registro(bot):
+    user_id = 7002
+    contexto = SimpleNamespace(args=["https://docs.google.com/spreadsheets/d/registro/edit"])
+
+    asyncio.run(botforma.handle_rota(mensagem(bot, user_id, "/rota"), SimpleNamespace(args=[])))
+    assert bot.recebidas[user_id][-1].startswith("Você ainda não registrou")
+
+    asyncio.run(botforma.handle_registrar(mensagem(bot, user_id, "/registrar"), contexto))
+    asyncio.run(botforma.handle_registrar(mensagem(bot, user_id, "/registrar"), contexto))
+    assert bot.recebidas[user_id][-2].startswith("Sua planilha foi registrada")
+    assert bot.recebidas[user_id][-1].startswith("Você já registrou")
+
+    asyncio.run(botforma.handle_rota(mensagem(bot, user_id, "/rota esporte"), SimpleNamespace(args=["esporte"])))
+    assert botforma.user_routes.get(str(user_id)) == ("esporte", {})
@@ -0,0 +1,89 @@
+# Testes do roteador de webhook: anel de hash consistente, ordem das atualizações de cada usuário e troca de bot
+# quando o responsável não responde (bots falsos via httpx.MockTransport, sem rede)
+import asyncio
+import json
+import random
+
+import httpx
+
+from roteador import HashRing, Router, routing_key
+
+BOTS = ["http://bot-1", "http://bot-2", "http://bot-3"]
+
+
+# Função para criar um roteador cujos bots são atendidos pela função handler(bot, update)
+def router_falso(handler):
+    async def transporte(request):
+        return await handler(f"http://{request.url.host}", json.loads(request.content))
+
+    router = Router(BOTS)
+    router.client = httpx.AsyncClient(transport=httpx.MockTransport(transporte))
+    return router
+
+
+# Função para repassar as atualizações como o WebhookHandler faz, todas ao mesmo tempo
+async def repassar(router, updates):
+    try:
+        return await asyncio.gather(*(
+            router.forward(routing_key(update), json.dumps(update).encode()) for update in updates
+        ))
+    finally:
+        await router.client.aclose()
+
+
+def update(numero, user_id):
+    return {"update_id": numero, "message": {"message_id": numero, "from": {"id": user_id}, "chat": {"id": user_id}}}
+
+
+def test_anel_so_move_os_usuarios_do_bot_que_saiu():
+    anel, sem_bot_2 = HashRing(BOTS), HashRing([BOTS[0], BOTS[2]])
+    chaves = [f"user:{n}" for n in range(2000)]
+    antes = {chave: anel.nodes_for(chave) for chave in chaves}
+
+    assert all(sorted(bots) == sorted(BOTS) for bots in antes.values())
+    assert {bots[0] for bots in antes.values()} == set(BOTS)
+    for chave, bots in antes.items():
+        # Quem estava no bot 2 vai para o próximo dele no anel; os outros não mudam de bot
+        assert sem_bot_2.nodes_for(chave)[0] == [bot for bot in bots if bot != BOTS[1]][0]
+
+
+def test_atualizacoes_de_um_usuario_chegam_na_ordem():
+    recebidas = {}
+
+    async def bot(nome, dados):
+        # Respostas com tempos variados: sem a fila por usuário a ordem se perderia
+        await asyncio.sleep(random.uniform(0, 0.01))
+        recebidas.setdefault(dados["message"]["from"]["id"], []).append((nome, dados["update_id"]))
+        return httpx.Response(200)
+
+    updates = [update(numero, user_id) for numero in range(1, 31) for user_id in (10, 20)]
+    assert asyncio.run(repassar(router_falso(bot), updates)) == [200] * len(updates)
+
+    for user_id, entregues in recebidas.items():
+        enviadas = [u["update_id"] for u in updates if u["message"]["from"]["id"] == user_id]
+        assert [numero for _, numero in entregues] == enviadas
+        # Todas no mesmo bot
+        assert len({nome for nome, _ in entregues}) == 1
+
+
+def test_bot_fora_do_ar_passa_o_usuario_para_o_proximo():
+    responsavel, proximo, ultimo = HashRing(BOTS).nodes_for("user:10")
+    entregues = []
+
+    async def bot(nome, dados):
+        if nome == responsavel:
+            raise httpx.ConnectError("conexão recusada")
+        if nome == proximo:
+            return httpx.Response(502)  # No ar, mas com erro: também vale o próximo
+        entregues.append((nome, dados["update_id"]))
+        return httpx.Response(200)
+
+    assert asyncio.run(repassar(router_falso(bot), [update(n, 10) for n in (1, 2, 3)])) == [200] * 3
+    assert entregues == [(ultimo, 1), (ultimo, 2), (ultimo, 3)]
+
+
+def test_sem_nenhum_bot_o_telegram_tenta_de_novo():
+    async def bot(nome, dados):
+        raise httpx.ConnectError("conexão recusada")
+
+    assert asyncio.run(repassar(router_falso(bot), [update(1, 10)])) == [503]
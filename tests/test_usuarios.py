@@ -0,0 +1,30 @@
+# Testes dos armazenamentos de usuários em SQLite (estado da conversa e regra de roteamento), compartilhados por
+# todos os processos do bot
+from botforma import SQLiteRouteStore, SQLiteStateStore
+
+
+def test_estado_e_visto_por_outro_processo(tmp_path):
+    caminho = str(tmp_path / "usuarios.db")
+    bot_1, bot_2 = SQLiteStateStore(caminho), SQLiteStateStore(caminho)
+
+    assert bot_2.get("10") is None
+    bot_1.set("10", "registrando_apostas")
+    assert bot_2.get("10") == "registrando_apostas"
+    bot_2.clear("10")
+    assert bot_1.get("10") is None
+
+
+def test_regra_de_roteamento(tmp_path):
+    caminho = str(tmp_path / "rotas.db")
+    rotas = SQLiteRouteStore(caminho)
+
+    # Quem nunca configurou usa a aba única
+    assert rotas.get("10") == ("unica", {})
+    rotas.set_mode("10", "esporte")
+    assert rotas.get("10") == ("esporte", {})
+
+    # Registrar a planilha de um ano passa o modo para "ano" e mantém as planilhas dos outros anos
+    rotas.set_year_spreadsheet("10", 2024, "planilha-2024")
+    rotas.set_year_spreadsheet("10", 2025, "planilha-2025")
+    assert SQLiteRouteStore(caminho).get("10") == ("ano", {"2024": "planilha-2024", "2025": "planilha-2025"})
+    assert rotas.get("20") == ("unica", {})